@@ -0,0 +1,56 @@
+"""Scalar vs batch variant assignment for 1M users.
+
+Times assign_variant_by_hash called once per user against
+assign_variants_by_hash over the whole array, and checks that both give
+exactly the same variant for every user.
+
+    python -m benchmarks.bench_assignment --users 1000000
+"""
+from types import SimpleNamespace
+from src.services.utils import AllocationTable, assign_variant_by_hash, assign_variants_by_hash
+import argparse
+import time
+import uuid
+
+EXPERIMENT_ID = 42
+ALLOCATIONS = [50.0, 25.0, 12.5, 12.5]
+
+
+def run(num_users: int, repeat: int):
+    variants = [
+        SimpleNamespace(id=variant_id, percent_allocated=percent)
+        for variant_id, percent in enumerate(ALLOCATIONS, start=1)
+    ]
+    user_ids = [str(uuid.uuid4()) for _ in range(num_users)]
+
+    start = time.perf_counter()
+    scalar = [assign_variant_by_hash(user_id, EXPERIMENT_ID, variants) for user_id in user_ids]
+    scalar_seconds = time.perf_counter() - start
+
+    batch_timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        table = AllocationTable.from_variants(variants)
+        batch = assign_variants_by_hash(user_ids, EXPERIMENT_ID, table)
+        batch_timings.append(time.perf_counter() - start)
+    batch_seconds = sorted(batch_timings)[len(batch_timings) // 2]
+
+    identical = batch.tolist() == scalar
+    print(f"{'impl':>8} {'users':>10} {'seconds':>9} {'users/s':>12}")
+    print(f"{'scalar':>8} {num_users:>10,} {scalar_seconds:>9.2f} {num_users / scalar_seconds:>12,.0f}")
+    print(f"{'batch':>8} {num_users:>10,} {batch_seconds:>9.2f} {num_users / batch_seconds:>12,.0f}")
+    print(f"speedup {scalar_seconds / batch_seconds:.1f}x, identical: {identical}")
+    if not identical:
+        raise SystemExit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    run(args.users, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Query plans and timings for the events analytics queries, before and after
+the composite indexes on ``events`` are built by the schema migration.
+
+    python -m benchmarks.bench_event_indexes --events 10000000 --output plans.json
+"""
+from src.migrations import upgrade_schema
+from src.models import Event
+from src.schemas.events import EventFilterRequest
+from src.services.events import get_events
+from src.services.counters import check_variant_event_counters
+from benchmarks.common import build_database, make_session_factory, QueryCounter, time_async
+from sqlalchemy import create_engine
+from datetime import datetime, timedelta
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import time
+
+VARIANT_COUNTS = [2, 5, 20]
+
+
+def scenarios(layout):
+    experiment_id, variant_ids = max(layout.items(), key=lambda item: len(item[1]))
+    one_day_ago = datetime.utcnow() - timedelta(days=1)
+    return {
+        "counter_check": lambda db: check_variant_event_counters(db, experiment_id),
+        "events_last_day": lambda db: get_events(db, experiment_id, EventFilterRequest(start_time=one_day_ago)),
+        "events_variant_conversions": lambda db: get_events(
+            db, experiment_id, EventFilterRequest(variant_id=variant_ids[0], event_types=["conversion"])
+        ),
+    }
+
+
+def explain(path: str, statements) -> list:
+    conn = sqlite3.connect(path)
+    plans = []
+    for statement, parameters in statements:
+        rows = conn.execute(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+        plans.append({"sql": statement, "plan": [row[-1] for row in rows]})
+    conn.close()
+    return plans
+
+
+async def measure(path: str, layout, repeat: int) -> dict:
+    engine, session_factory = make_session_factory(path)
+    results = {}
+    async with session_factory() as db:
+        for name, call in scenarios(layout).items():
+            with QueryCounter(engine) as counter:
+                await call(db)
+            latency = await time_async(lambda: call(db), repeat)
+            results[name] = {"median_ms": round(latency, 1), "queries": explain(path, counter.statements)}
+            db.expunge_all()
+    await engine.dispose()
+    return results
+
+
+def drop_event_indexes(path: str) -> None:
+    conn = sqlite3.connect(path)
+    for index in Event.__table__.indexes:
+        if index.name != "ix_events_id":
+            conn.execute(f"DROP INDEX IF EXISTS {index.name}")
+    conn.commit()
+    conn.close()
+
+
+def migrate(path: str) -> float:
+    engine = create_engine(f"sqlite:///{path}")
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        upgrade_schema(conn)
+        conn.exec_driver_sql("ANALYZE")
+    engine.dispose()
+    return time.perf_counter() - start
+
+
+def report(label: str, results: dict) -> None:
+    print(f"\n== {label}")
+    for name, result in results.items():
+        print(f"{name}: {result['median_ms']} ms")
+        for query in result["queries"]:
+            if query["sql"].lstrip().upper().startswith("SELECT") and "events" in query["sql"]:
+                for step in query["plan"]:
+                    print(f"    {step}")
+
+
+async def run(num_events: int, repeat: int, path: str, output: str):
+    print(f"Building {num_events:,} events at {path}")
+    layout = build_database(path, VARIANT_COUNTS, num_events)
+    drop_event_indexes(path)
+
+    before = await measure(path, layout, repeat)
+    report("before", before)
+
+    migration_seconds = migrate(path)
+    print(f"\nMigration built the indexes in {migration_seconds:.1f} s")
+
+    after = await measure(path, layout, repeat)
+    report("after", after)
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(
+                {"events": num_events, "migration_seconds": migration_seconds, "before": before, "after": after},
+                f,
+                indent=2
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=10_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--db", help="Path of the SQLite file to build (default: a temporary file)")
+    parser.add_argument("--output", help="Write plans and timings as JSON to this file")
+    args = parser.parse_args()
+
+    if args.db:
+        asyncio.run(run(args.events, args.repeat, args.db, args.output))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(args.events, args.repeat, os.path.join(tmp, "bench.db"), args.output))
+
+
+if __name__ == "__main__":
+    main()
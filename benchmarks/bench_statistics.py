@@ -0,0 +1,73 @@
+"""Query count and latency of get_experiment_statistics for 2, 5 and 20 variants.
+
+Compares the current implementation, which reads the variant_event_counters
+rollup, with the original one, which ran two COUNT queries per variant over
+the events table.
+
+    python -m benchmarks.bench_statistics --events 10000000
+"""
+from sqlalchemy import select, func
+from src.models import Experiment, Variant, Event
+from src.services.statistics import get_experiment_statistics
+from benchmarks.common import build_database, make_session_factory, QueryCounter, time_async
+import argparse
+import asyncio
+import os
+import tempfile
+
+VARIANT_COUNTS = [2, 5, 20]
+
+
+async def legacy_variant_counts(db, experiment_id: int, conversion_event_type: str = "conversion"):
+    await db.execute(select(Experiment).filter(Experiment.id == experiment_id))
+    result = await db.execute(select(Variant).filter(Variant.experiment_id == experiment_id))
+    counts = {}
+    for variant in result.scalars().all():
+        sessions = await db.execute(
+            select(func.count(Event.id)).filter(Event.variant_id == variant.id, Event.type == "page_view")
+        )
+        conversions = await db.execute(
+            select(func.count(Event.id)).filter(Event.variant_id == variant.id, Event.type == conversion_event_type)
+        )
+        counts[variant.id] = (sessions.scalar() or 0, conversions.scalar() or 0)
+    return counts
+
+
+async def run(num_events: int, repeat: int, path: str):
+    print(f"Building {num_events:,} events for experiments with {VARIANT_COUNTS} variants at {path}")
+    layout = build_database(path, VARIANT_COUNTS, num_events)
+    engine, session_factory = make_session_factory(path)
+
+    print(f"{'variants':>8} {'impl':>8} {'queries':>8} {'median ms':>10}")
+    async with session_factory() as db:
+        for experiment_id, variant_ids in layout.items():
+            implementations = {
+                "legacy": lambda: legacy_variant_counts(db, experiment_id),
+                "current": lambda: get_experiment_statistics(db, experiment_id),
+            }
+            for name, call in implementations.items():
+                with QueryCounter(engine) as counter:
+                    await call()
+                latency = await time_async(call, repeat)
+                print(f"{len(variant_ids):>8} {name:>8} {counter.count:>8} {latency:>10.1f}")
+
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=10_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--db", help="Path of the SQLite file to build (default: a temporary file)")
+    args = parser.parse_args()
+
+    if args.db:
+        asyncio.run(run(args.events, args.repeat, args.db))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(args.events, args.repeat, os.path.join(tmp, "bench.db")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""UI page latency with the views calling the REST API over HTTP (before) vs.
+calling the experiment services in-process (after).
+
+The app is served by uvicorn on a local port. The "before" pages are the
+previous view code, mounted under ``/ui-loopback``. Every view there creates
+a web-session API key, then opens a new ``httpx.AsyncClient`` to call
+``/api/experiments`` on the same server. The "after" pages are the current
+``/ui`` routes. Both are requested through one keep-alive client, as a
+browser would.
+
+    python -m benchmarks.bench_ui_views --experiments 50 --requests 500
+"""
+from fastapi import APIRouter, Depends, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.database import get_db
+from src.main import app
+from src.cache import clear_all_caches
+from src.services import auth as auth_service
+from src.views.experiment_views import templates
+from benchmarks.common import build_database, make_session_factory, QueryCounter
+from datetime import datetime
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import tempfile
+import threading
+import time
+import httpx
+import uvicorn
+
+SESSION_COOKIE_NAME = "session_api_key"
+
+
+def loopback_router(api_base: str) -> APIRouter:
+    """The views as they were: each page mints a session key, then calls the API over TCP."""
+    router = APIRouter()
+
+    async def get_or_create_session_token(request: Request, response: Response, db: AsyncSession) -> str:
+        existing_key = request.cookies.get(SESSION_COOKIE_NAME)
+        if existing_key:
+            return existing_key
+        new_key = await auth_service.create_api_key(db, "web_session")
+        # Lost: the view returns its own TemplateResponse, so this cookie never reaches the browser
+        response.set_cookie(key=SESSION_COOKIE_NAME, value=new_key.key, httponly=True, samesite="lax")
+        return new_key.key
+
+    @router.get("/experiments")
+    async def list_experiments(request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+        api_key = await get_or_create_session_token(request, response, db)
+        experiments = []
+        async with httpx.AsyncClient() as client:
+            resp = await client.get(api_base, headers={"Authorization": f"Bearer {api_key}"})
+            if resp.status_code == 200 and resp.text:
+                experiments = resp.json()
+                for exp in experiments:
+                    if exp.get("created_at"):
+                        dt = datetime.fromisoformat(exp["created_at"].replace("Z", "+00:00"))
+                        exp["created_at_formatted"] = dt.strftime("%B %d, %Y")
+        return templates.TemplateResponse("experiment_list.html", {"request": request, "experiments": experiments})
+
+    @router.get("/experiment/{experiment_id}")
+    async def view_experiment(experiment_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+        api_key = await get_or_create_session_token(request, response, db)
+        experiment = None
+        async with httpx.AsyncClient() as client:
+            resp = await client.get(f"{api_base}{experiment_id}", headers={"Authorization": f"Bearer {api_key}"})
+            if resp.status_code == 200 and resp.text:
+                experiment = resp.json()
+                for item in [experiment, *experiment.get("variants", [])]:
+                    for field in ("created_at", "started_at", "ended_at"):
+                        if item.get(field):
+                            dt = datetime.fromisoformat(item[field].replace("Z", "+00:00"))
+                            item[f"{field}_formatted"] = dt.strftime("%B %d, %Y")
+        return templates.TemplateResponse("experiment_view.html", {"request": request, "experiment": experiment})
+
+    return router
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve(port: int) -> uvicorn.Server:
+    # No lifespan: the background workers would open the default database
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, lifespan="off", log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def measure(client: httpx.AsyncClient, path: str, requests: int, counter: QueryCounter) -> dict:
+    await client.get(path)  # warm the caches
+    samples = []
+    with counter:
+        for _ in range(requests):
+            start = time.perf_counter()
+            response = await client.get(path)
+            samples.append((time.perf_counter() - start) * 1000)
+            response.raise_for_status()
+    samples.sort()
+    return {
+        "median_ms": round(statistics.median(samples), 2),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 2),
+        "statements_per_page": round(counter.count / requests, 1),
+    }
+
+
+async def run(num_experiments: int, requests: int, path: str):
+    print(f"Building {num_experiments} experiments at {path}")
+    build_database(path, [2] * num_experiments, num_events=0, num_users=10)
+
+    engine, session_factory = make_session_factory(path)
+
+    async def override_get_db():
+        async with session_factory() as session:
+            yield session
+
+    port = free_port()
+    app.dependency_overrides[get_db] = override_get_db
+    app.include_router(loopback_router(f"http://127.0.0.1:{port}/api/experiments/"), prefix="/ui-loopback")
+    clear_all_caches()
+    server = serve(port)
+
+    pages = {"list": "/experiments", "detail": "/experiment/1"}
+    counter = QueryCounter(engine)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=30.0) as client:
+            for name, page in pages.items():
+                before = await measure(client, f"/ui-loopback{page}", requests, counter)
+                after = await measure(client, f"/ui{page}", requests, counter)
+                print(f"\n== {name} page ({requests} requests)")
+                for label, result in (("before", before), ("after", after)):
+                    print(
+                        f"{label:>6}: median {result['median_ms']} ms, p95 {result['p95_ms']} ms, "
+                        f"{result['statements_per_page']} SQL statements per page"
+                    )
+                print(f"speedup: {before['median_ms'] / after['median_ms']:.1f}x (median)")
+    finally:
+        server.should_exit = True
+        app.dependency_overrides.clear()
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--experiments", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--db", help="Path of the SQLite file to build (default: a temporary file)")
+    args = parser.parse_args()
+
+    if args.db:
+        asyncio.run(run(args.experiments, args.requests, args.db))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(args.experiments, args.requests, os.path.join(tmp, "bench.db")))
+
+
+if __name__ == "__main__":
+    main()
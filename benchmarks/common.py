@@ -0,0 +1,145 @@
+"""Shared helpers for the benchmark scripts.
+
+Benchmarks are run from the repository root as modules, for example
+``python -m benchmarks.bench_statistics --events 1000000``.
+"""
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from src.database import Base
+from src import models  # noqa: F401 - registers the tables on Base.metadata
+from datetime import datetime, timedelta
+from typing import Dict, List
+import random
+import sqlite3
+import statistics
+import time
+import uuid
+
+EVENT_TYPE_WEIGHTS = {"page_view": 0.7, "conversion": 0.2, "click": 0.1}
+INSERT_CHUNK_SIZE = 100_000
+
+
+def build_database(
+    path: str,
+    variants_per_experiment: List[int],
+    num_events: int,
+    num_users: int = 10_000,
+    seed: int = 42
+) -> Dict[int, List[int]]:
+    """Create a synthetic database at ``path`` and return {experiment_id: [variant_ids]}.
+
+    Events are spread uniformly over every variant of every experiment and over
+    the last 30 days.
+    """
+    rng = random.Random(seed)
+
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    engine.dispose()
+
+    conn = sqlite3.connect(path)
+    now = datetime.utcnow()
+    created_at = now.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+    user_ids = [str(uuid.uuid4()) for _ in range(num_users)]
+    conn.executemany(
+        "INSERT INTO users (id, first_name, last_name, email, is_premium, country_code, created_at) "
+        "VALUES (?, 'Bench', 'User', ?, ?, ?, ?)",
+        [
+            (user_id, f"{user_id}@bench.test", rng.random() < 0.2, rng.choice(["US", "GB", "DE", "AR"]), created_at)
+            for user_id in user_ids
+        ]
+    )
+
+    layout: Dict[int, List[int]] = {}
+    variant_id = 0
+    for experiment_id, variant_count in enumerate(variants_per_experiment, start=1):
+        conn.execute(
+            "INSERT INTO experiments (id, name, status, created_at) VALUES (?, ?, 'RUNNING', ?)",
+            (experiment_id, f"bench_experiment_{experiment_id}", created_at)
+        )
+        layout[experiment_id] = []
+        for index in range(variant_count):
+            variant_id += 1
+            conn.execute(
+                "INSERT INTO variants (id, experiment_id, name, percent_allocated, enabled, created_at) "
+                "VALUES (?, ?, ?, ?, 1, ?)",
+                (variant_id, experiment_id, "control" if index == 0 else f"variant_{index}", 100.0 / variant_count, created_at)
+            )
+            layout[experiment_id].append(variant_id)
+
+    targets = [
+        (experiment_id, variant_id)
+        for experiment_id, variant_ids in layout.items()
+        for variant_id in variant_ids
+    ]
+    event_types = list(EVENT_TYPE_WEIGHTS)
+    weights = list(EVENT_TYPE_WEIGHTS.values())
+    window_seconds = 30 * 24 * 3600
+
+    remaining = num_events
+    while remaining > 0:
+        chunk = min(INSERT_CHUNK_SIZE, remaining)
+        kinds = rng.choices(event_types, weights, k=chunk)
+        rows = []
+        for kind in kinds:
+            experiment_id, variant_id = rng.choice(targets)
+            timestamp = now - timedelta(seconds=rng.randrange(window_seconds))
+            rows.append((
+                rng.choice(user_ids),
+                experiment_id,
+                variant_id,
+                kind,
+                timestamp.strftime("%Y-%m-%d %H:%M:%S.%f")
+            ))
+        conn.executemany(
+            "INSERT INTO events (user_id, experiment_id, variant_id, type, timestamp) VALUES (?, ?, ?, ?, ?)",
+            rows
+        )
+        remaining -= chunk
+
+    conn.execute(
+        "INSERT INTO variant_event_counters (experiment_id, variant_id, event_type, count) "
+        "SELECT experiment_id, variant_id, type, COUNT(id) FROM events GROUP BY experiment_id, variant_id, type"
+    )
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+    return layout
+
+
+def make_session_factory(path: str):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    return engine, async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+
+class QueryCounter:
+    """Counts (and records) statements sent to the database while active."""
+
+    def __init__(self, engine):
+        self.engine = engine.sync_engine if hasattr(engine, "sync_engine") else engine
+        self.count = 0
+        self.statements = []
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+        self.statements.append((statement, parameters))
+
+    def __enter__(self):
+        self.count = 0
+        self.statements = []
+        event.listen(self.engine, "before_cursor_execute", self._before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._before_cursor_execute)
+
+
+async def time_async(func, repeat: int) -> float:
+    """Median wall time of ``await func()`` in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
@@ -1,5 +1,6 @@
 import httpx
 import asyncio
+from sdk import ExperimentationClient
 import random
 from datetime import datetime
 
@@ -175,61 +176,53 @@ async def assign_segments_to_experiment(client, headers, experiment_id, segment_
         )
 
 
-async def simulate_user_interactions(client, headers, experiment_id, users, treatment_variant_id):
-    """Simulate user sessions with page views and conversions."""
+async def simulate_user_interactions(sdk, experiment_id, users, vip_segment_id, explicit_users, treatment_variant_id):
+    """Simulate user sessions with page views and conversions.
+
+    Variants are assigned locally from the SDK's config bundle and events are
+    buffered and sent in batches, so the loop itself makes no HTTP calls.
+    """
     user_variant_map = {}
+    explicit_user_ids = {user["id"] for user in explicit_users}
 
     for _ in range(NUM_ITERATIONS):
         user = random.choice(users)
         user_id = user["id"]
 
-        # Check eligibility
-        response = await client.post(
-            f"{BASE_URL}/experiments/check-eligibility",
-            headers=headers,
-            json={"user_id": user_id, "experiment_ids": [experiment_id]}
+        # Check eligibility: segment rules are matched against the user's attributes,
+        # explicit segment memberships are passed in
+        variant_id = sdk.get_variant(
+            user_id,
+            experiment_id,
+            attributes=user,
+            segment_ids=[vip_segment_id] if user_id in explicit_user_ids else []
         )
-        eligibility = response.json()
-
-        if str(experiment_id) not in eligibility["eligible_experiment_ids"]:
+        if variant_id is None:
             continue
 
-        variant_id = eligibility["eligible_experiment_ids"][str(experiment_id)]["variant_id"]
-
         if user_id not in user_variant_map:
             user_variant_map[user_id] = variant_id
 
         # Log page view event
-        await client.post(
-            f"{BASE_URL}/events/",
-            headers=headers,
-            json={
-                "user_id": user_id,
-                "experiment_id": experiment_id,
-                "variant_id": variant_id,
-                "type": "page_view",
-                "properties": {"page": "checkout"}
-            }
-        )
+        sdk.track(user_id, "page_view", experiment_id=experiment_id, variant_id=variant_id, properties={"page": "checkout"})
 
         # Log conversion event based on variant-specific conversion rate
         conversion_probability = TREATMENT_CONVERSION_RATE if variant_id == treatment_variant_id else CONTROL_CONVERSION_RATE
         if random.random() < conversion_probability:
-            await client.post(
-                f"{BASE_URL}/events/",
-                headers=headers,
-                json={
-                    "user_id": user_id,
-                    "experiment_id": experiment_id,
-                    "variant_id": variant_id,
-                    "type": "conversion",
-                    "properties": {
-                        "amount": round(random.uniform(20, 200), 2),
-                        "currency": "USD"
-                    }
+            sdk.track(
+                user_id,
+                "conversion",
+                experiment_id=experiment_id,
+                variant_id=variant_id,
+                properties={
+                    "amount": round(random.uniform(20, 200), 2),
+                    "currency": "USD"
                 }
             )
 
+    # Send whatever is still buffered before reading the events back
+    await sdk.flush()
+
     return user_variant_map
 
 
@@ -241,7 +234,7 @@ async def display_event_logs(client, headers, experiment_id, treatment_variant_i
 
     # All events
     response = await client.post(f"{BASE_URL}/events/{experiment_id}", headers=headers, json={})
-    all_events = response.json()
+    all_events = response.json()["events"]
     print(f"\n[Query 1] All events for the experiment:")
     print(f"Total events: {len(all_events)}")
 
@@ -260,7 +253,7 @@ async def display_event_logs(client, headers, experiment_id, treatment_variant_i
         headers=headers,
         json={"event_types": ["conversion"]}
     )
-    conversion_events = response.json()
+    conversion_events = response.json()["events"]
     print(f"\n[Query 2] Conversion events only:")
     print(f"Total conversions: {len(conversion_events)}")
 
@@ -274,7 +267,7 @@ async def display_event_logs(client, headers, experiment_id, treatment_variant_i
         headers=headers,
         json={"variant_id": treatment_variant_id}
     )
-    treatment_events = response.json()
+    treatment_events = response.json()["events"]
     print(f"\n[Query 3] Events for treatment variant only:")
     print(f"Treatment variant events: {len(treatment_events)}")
 
@@ -405,9 +398,10 @@ async def main():
         print(f"\n[STEP 6] Simulating {NUM_ITERATIONS} user interactions...")
         print(f"  Control conversion rate: {CONTROL_CONVERSION_RATE * 100}%")
         print(f"  Treatment conversion rate: {TREATMENT_CONVERSION_RATE * 100}%")
-        user_variant_map = await simulate_user_interactions(
-            client, headers, experiment_id, users, treatment_variant_id
-        )
+        async with ExperimentationClient(BASE_URL.removesuffix("/api"), api_key) as sdk:
+            user_variant_map = await simulate_user_interactions(
+                sdk, experiment_id, users, vip_segment_id, explicit_users, treatment_variant_id
+            )
         print(f"✓ Completed {NUM_ITERATIONS} interactions")
         print(f"✓ {len(user_variant_map)} unique users participated")
 
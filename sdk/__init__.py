@@ -0,0 +1,5 @@
+from .client import ExperimentationClient
+from .evaluation import Bundle, BundleError
+from .events import EventBuffer
+
+__all__ = ['ExperimentationClient', 'Bundle', 'BundleError', 'EventBuffer']
@@ -0,0 +1,201 @@
+"""Client for the experimentation platform that assigns variants in-process.
+
+``start`` downloads the config bundle once; after that ``get_assignments`` and
+``get_variant`` are pure function calls with no network round trip. The
+bundle is refreshed in the background with a conditional GET, which the
+server answers with an empty 304 while nothing has changed. Events passed to
+``track`` are buffered and sent in batches (see ``sdk/events.py``).
+
+All requests share one pooled ``httpx.AsyncClient`` and are retried on
+connection errors, 429 and 5xx responses with exponential backoff and full
+jitter, so many clients recovering from the same outage don't retry in step.
+"""
+from typing import Any, Collection, Dict, Iterable, List, Optional
+from .evaluation import Attributes, Bundle
+from .events import (
+    EventBuffer, DEFAULT_EVENT_BATCH_SIZE, DEFAULT_FLUSH_INTERVAL_SECONDS, DEFAULT_MAX_QUEUE_SIZE
+)
+import asyncio
+import logging
+import random
+import httpx
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REFRESH_INTERVAL_SECONDS = 30.0
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_BASE_DELAY_SECONDS = 0.2
+DEFAULT_RETRY_MAX_DELAY_SECONDS = 5.0
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def is_retryable(error: Exception) -> bool:
+    """Transport errors, 429 and 5xx may succeed later; any other failure never will."""
+    if isinstance(error, httpx.HTTPStatusError):
+        status_code = error.response.status_code
+        return status_code == 429 or status_code >= 500
+    return isinstance(error, httpx.TransportError)
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    # Full jitter: anywhere between zero and the exponential cap
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+class ExperimentationClient:
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        refresh_interval: float = DEFAULT_REFRESH_INTERVAL_SECONDS,
+        event_batch_size: int = DEFAULT_EVENT_BATCH_SIZE,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL_SECONDS,
+        max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        retry_base_delay: float = DEFAULT_RETRY_BASE_DELAY_SECONDS,
+        retry_max_delay: float = DEFAULT_RETRY_MAX_DELAY_SECONDS,
+        timeout: float = 10.0,
+        http_client: Optional[httpx.AsyncClient] = None
+    ):
+        """``base_url`` is the server root, e.g. ``http://localhost:8000``.
+
+        Pass ``http_client`` to reuse a client the application already pools;
+        it is then left open on ``close``.
+        """
+        self.refresh_interval = refresh_interval
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.headers = {"Authorization": f"Bearer {api_key}"}
+        self._owns_http_client = http_client is None
+        self.http = http_client or httpx.AsyncClient(
+            base_url=base_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=10)
+        )
+        self.bundle: Optional[Bundle] = None
+        self._etag: Optional[str] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.events = EventBuffer(
+            self.send_events,
+            batch_size=event_batch_size,
+            flush_interval=flush_interval,
+            max_queue_size=max_queue_size,
+            is_retryable=is_retryable
+        )
+
+    async def __aenter__(self) -> "ExperimentationClient":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def start(self) -> None:
+        await self.refresh()
+        self.events.start()
+        if self._refresh_task is None and self.refresh_interval > 0:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def close(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+        try:
+            await self.events.stop()
+        finally:
+            if self._owns_http_client:
+                await self.http.aclose()
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        headers = {**self.headers, **kwargs.pop("headers", {})}
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await self.http.request(method, url, headers=headers, **kwargs)
+            except httpx.TransportError:
+                if attempt == self.max_retries:
+                    raise
+            else:
+                if response.status_code not in RETRYABLE_STATUS_CODES or attempt == self.max_retries:
+                    if response.is_error:
+                        response.raise_for_status()
+                    return response
+            await asyncio.sleep(backoff_delay(attempt, self.retry_base_delay, self.retry_max_delay))
+
+    async def refresh(self) -> bool:
+        """Fetch the bundle if it changed; returns True when a new one was loaded."""
+        headers = {"If-None-Match": self._etag} if self._etag else {}
+        response = await self.request("GET", "/api/experiments/bundle", headers=headers)
+        if response.status_code == 304:
+            return False
+        self.bundle = Bundle.from_document(response.json())
+        self._etag = response.headers.get("etag")
+        return True
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Keep assigning from the last bundle until the server is reachable again
+                logger.warning(f"Config bundle refresh failed: {e}")
+
+    def get_assignments(
+        self,
+        user_id: str,
+        experiment_ids: Iterable[int],
+        attributes: Optional[Attributes] = None,
+        segment_ids: Collection[int] = ()
+    ) -> Dict[int, int]:
+        """experiment ID -> variant ID for each experiment the user is eligible for.
+
+        ``attributes`` are the user's fields that segment rules match against
+        (``country_code``, ``is_premium``, ...). ``segment_ids`` are segments
+        the user was explicitly assigned to, which the bundle doesn't carry.
+        """
+        if self.bundle is None:
+            raise RuntimeError("The config bundle isn't loaded; call start() first")
+        return self.bundle.assign(user_id, experiment_ids, attributes, segment_ids)
+
+    def get_variant(
+        self,
+        user_id: str,
+        experiment_id: int,
+        attributes: Optional[Attributes] = None,
+        segment_ids: Collection[int] = ()
+    ) -> Optional[int]:
+        return self.get_assignments(user_id, (experiment_id,), attributes, segment_ids).get(experiment_id)
+
+    def track(
+        self,
+        user_id: str,
+        type: str,
+        experiment_id: Optional[int] = None,
+        variant_id: Optional[int] = None,
+        properties: Optional[Dict[str, Any]] = None
+    ) -> bool:
+        """Queue an event for the next batch; False if the queue is full and it was dropped."""
+        return self.events.add({
+            "user_id": user_id,
+            "experiment_id": experiment_id,
+            "variant_id": variant_id,
+            "type": type,
+            "properties": properties
+        })
+
+    async def flush(self) -> int:
+        return await self.events.flush()
+
+    async def send_events(self, events: List[Dict[str, Any]]) -> None:
+        response = await self.request("POST", "/api/events/batch", json={"events": events})
+        rejected = response.json()["rejected"]
+        if rejected:
+            # Rejected events failed validation; sending them again would not help
+            logger.warning(f"{rejected} of {len(events)} events were rejected by the server")
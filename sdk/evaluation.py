@@ -0,0 +1,269 @@
+"""Local variant assignment from a config bundle (``GET /api/experiments/bundle``).
+
+Mirrors the server: ``hash_bucket`` and ``pick_variant`` from
+``src/services/utils.py``, ``ExperimentConfig`` from
+``src/services/config_snapshot.py`` and the segment rule semantics of
+``src/services/rules.py``, evaluated over a plain dict of user attributes.
+Nothing here imports the server, so the SDK can be embedded without its
+dependencies; the hashing parameters come from the bundle itself.
+"""
+from bisect import bisect_right
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Collection, Dict, Iterable, Mapping, Optional, Sequence, Tuple
+import hashlib
+import logging
+import operator
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_BUNDLE_FORMAT = 1
+
+Attributes = Mapping[str, Any]
+Predicate = Callable[[Attributes], bool]
+
+COMPARISONS = {
+    "eq": operator.eq,
+    "ne": operator.ne,
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+}
+MEMBERSHIP = ("in", "not_in")
+
+
+class BundleError(ValueError):
+    pass
+
+
+class RuleError(ValueError):
+    pass
+
+
+def coerce(value: Any, operand: Any) -> Any:
+    # JSON has no dates; datetime attributes are compared against ISO 8601 strings
+    if isinstance(value, datetime) and isinstance(operand, str):
+        try:
+            return datetime.fromisoformat(operand)
+        except ValueError:
+            return operand
+    return operand
+
+
+def compile_comparison(attribute: str, op: str, operand: Any) -> Predicate:
+    if op in MEMBERSHIP:
+        if not isinstance(operand, list):
+            raise RuleError(f"'{op}' on '{attribute}' expects a list")
+
+        def contains(attributes: Attributes) -> bool:
+            value = attributes.get(attribute)
+            return any(value == coerce(value, candidate) for candidate in operand)
+
+        if op == "in":
+            return contains
+        return lambda attributes: not contains(attributes)
+
+    compare = COMPARISONS.get(op)
+    if compare is None:
+        raise RuleError(f"Unknown operator '{op}' on '{attribute}'")
+    if isinstance(operand, (dict, list)):
+        raise RuleError(f"'{op}' on '{attribute}' expects a scalar value")
+
+    if op in ("eq", "ne"):
+        return lambda attributes: compare(attributes.get(attribute), coerce(attributes.get(attribute), operand))
+
+    def predicate(attributes: Attributes) -> bool:
+        value = attributes.get(attribute)
+        if value is None:
+            return False
+        try:
+            return compare(value, coerce(value, operand))
+        except TypeError:
+            return False
+
+    return predicate
+
+
+def compile_attribute(attribute: str, condition: Any) -> Predicate:
+    if not isinstance(condition, dict):
+        return compile_comparison(attribute, "eq", condition)
+    if not condition:
+        raise RuleError(f"Empty condition on '{attribute}'")
+    return all_of([compile_comparison(attribute, op, operand) for op, operand in condition.items()])
+
+
+def compile_node(node: Any) -> Predicate:
+    if not isinstance(node, dict):
+        raise RuleError("Rules must be a JSON object")
+
+    predicates = []
+    for key, value in node.items():
+        if key == "not":
+            inner = compile_node(value)
+            predicates.append(lambda attributes, inner=inner: not inner(attributes))
+        elif key in ("and", "or"):
+            if not isinstance(value, list) or not value:
+                raise RuleError(f"'{key}' expects a non-empty list of rules")
+            children = [compile_node(child) for child in value]
+            predicates.append(all_of(children) if key == "and" else any_of(children))
+        else:
+            predicates.append(compile_attribute(key, value))
+    return all_of(predicates)
+
+
+def all_of(predicates) -> Predicate:
+    if len(predicates) == 1:
+        return predicates[0]
+    predicates = tuple(predicates)
+    return lambda attributes: all(predicate(attributes) for predicate in predicates)
+
+
+def any_of(predicates) -> Predicate:
+    if len(predicates) == 1:
+        return predicates[0]
+    predicates = tuple(predicates)
+    return lambda attributes: any(predicate(attributes) for predicate in predicates)
+
+
+def compile_rules(rules: Optional[Dict[str, Any]]) -> Optional[Predicate]:
+    """Predicate over user attributes; ``None`` for segments that only have assigned users."""
+    if not rules:
+        return None
+    return compile_node(rules)
+
+
+@dataclass(frozen=True)
+class Hashing:
+    hex_prefix_length: int
+    bucket_count: int
+    ranged_bucket_count: int
+
+    def bucket(self, user_id: str, experiment_id: int, bucket_count: int) -> int:
+        hash_digest = hashlib.sha256(f"{user_id}:{experiment_id}".encode('utf-8')).hexdigest()
+        return int(hash_digest[:self.hex_prefix_length], 16) % bucket_count
+
+
+def pick_variant(bucket: int, variant_ids: Sequence[int], boundaries: Sequence[float]) -> Optional[int]:
+    if not variant_ids:
+        return None
+
+    # First variant whose cumulative allocation is above the bucket; unallocated buckets go to the last one
+    index = bisect_right(boundaries, bucket)
+    return variant_ids[min(index, len(variant_ids) - 1)]
+
+
+@dataclass(frozen=True)
+class SegmentRules:
+    id: int
+    predicate: Optional[Predicate]
+
+    def matches(self, attributes: Attributes, segment_ids: Collection[int]) -> bool:
+        if self.id in segment_ids:
+            return True
+        return self.predicate is not None and self.predicate(attributes)
+
+
+@dataclass(frozen=True)
+class LocalExperiment:
+    id: int
+    name: str
+    status: str
+    variant_ids: Tuple[int, ...]
+    boundaries: Tuple[float, ...]
+    segments: Tuple[SegmentRules, ...]
+    # Ranged bucketing only: (start, end, variant ID), sorted by start
+    bucket_ranges: Optional[Tuple[Tuple[int, int, int], ...]] = None
+
+    def is_eligible(self, attributes: Attributes, segment_ids: Collection[int]) -> bool:
+        # Experiments without segments are open to everyone
+        if not self.segments:
+            return True
+        return any(segment.matches(attributes, segment_ids) for segment in self.segments)
+
+    def assign_variant(self, user_id: str, hashing: Hashing) -> Optional[int]:
+        if self.bucket_ranges is not None:
+            bucket = hashing.bucket(user_id, self.id, hashing.ranged_bucket_count)
+            index = bisect_right(self.bucket_ranges, (bucket, float("inf"))) - 1
+            if index >= 0:
+                start, end, variant_id = self.bucket_ranges[index]
+                if start <= bucket < end:
+                    return variant_id
+            # Users in unallocated buckets stay out of the experiment
+            return None
+        return pick_variant(hashing.bucket(user_id, self.id, hashing.bucket_count), self.variant_ids, self.boundaries)
+
+
+@dataclass(frozen=True)
+class Bundle:
+    version: str
+    hashing: Hashing
+    experiments: Mapping[int, LocalExperiment]
+
+    @classmethod
+    def from_document(cls, document: Dict[str, Any]) -> "Bundle":
+        if document.get("format") != SUPPORTED_BUNDLE_FORMAT:
+            raise BundleError(f"Unsupported bundle format {document.get('format')!r}")
+        hashing = document["hashing"]
+        if hashing.get("algorithm") != "sha256" or hashing.get("input") != "{user_id}:{experiment_id}":
+            raise BundleError("Unsupported hashing scheme")
+
+        segments = {}
+        for segment in document["segments"]:
+            try:
+                predicate = compile_rules(segment["rules"])
+            except RuleError as e:
+                logger.warning(f"Segment {segment['id']} has invalid rules ({e}); it only matches assigned users")
+                predicate = None
+            segments[segment["id"]] = SegmentRules(id=segment["id"], predicate=predicate)
+
+        experiments = {}
+        for experiment in document["experiments"]:
+            variants = experiment["variants"]
+            bucket_ranges = None
+            if experiment["bucketing"] == "ranged":
+                bucket_ranges = tuple(sorted(
+                    (start, end, variant["id"])
+                    for variant in variants
+                    for start, end in variant["bucket_ranges"] or ()
+                ))
+            experiments[experiment["id"]] = LocalExperiment(
+                id=experiment["id"],
+                name=experiment["name"],
+                status=experiment["status"],
+                variant_ids=tuple(variant["id"] for variant in variants),
+                boundaries=tuple(experiment["boundaries"]),
+                segments=tuple(
+                    segments[segment_id] for segment_id in experiment["segment_ids"] if segment_id in segments
+                ),
+                bucket_ranges=bucket_ranges
+            )
+
+        return cls(
+            version=document["version"],
+            hashing=Hashing(
+                hex_prefix_length=hashing["hex_prefix_length"],
+                bucket_count=hashing["bucket_count"],
+                ranged_bucket_count=hashing["ranged_bucket_count"]
+            ),
+            experiments=experiments
+        )
+
+    def assign(
+        self,
+        user_id: str,
+        experiment_ids: Iterable[int],
+        attributes: Optional[Attributes] = None,
+        segment_ids: Collection[int] = ()
+    ) -> Dict[int, int]:
+        """experiment ID -> variant ID for the experiments the user is eligible for, like check-eligibility."""
+        attributes = attributes or {}
+        assignments = {}
+        for experiment_id in experiment_ids:
+            experiment = self.experiments.get(experiment_id)
+            if experiment is None or not experiment.is_eligible(attributes, segment_ids):
+                continue
+            variant_id = experiment.assign_variant(user_id, self.hashing)
+            if variant_id is not None:
+                assignments[experiment_id] = variant_id
+        return assignments
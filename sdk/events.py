@@ -0,0 +1,121 @@
+"""Buffered event tracking for the SDK.
+
+``track`` only appends to an in-memory queue. A background task sends the
+queue to ``POST /api/events/batch`` every ``flush_interval`` seconds, or as
+soon as a full batch is waiting, so a busy caller makes one request per batch
+instead of one per event.
+
+A batch that fails with a retryable error stays queued for the next flush.
+Any other failure means the server will never accept it, so it is logged,
+counted in ``dropped`` and discarded.
+"""
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# The server accepts at most 1000 events per batch (MAX_EVENT_BATCH_SIZE)
+DEFAULT_EVENT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL_SECONDS = 5.0
+DEFAULT_MAX_QUEUE_SIZE = 10_000
+
+SendBatch = Callable[[List[Dict[str, Any]]], Awaitable[None]]
+IsRetryable = Callable[[Exception], bool]
+
+
+def always_retryable(error: Exception) -> bool:
+    return True
+
+
+class EventBuffer:
+    def __init__(
+        self,
+        send: SendBatch,
+        batch_size: int = DEFAULT_EVENT_BATCH_SIZE,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL_SECONDS,
+        max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+        is_retryable: IsRetryable = always_retryable
+    ):
+        self.send = send
+        self.is_retryable = is_retryable
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.dropped = 0
+        self._queue: Deque[Dict[str, Any]] = deque()
+        self._lock = asyncio.Lock()
+        self._batch_ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def add(self, event: Dict[str, Any]) -> bool:
+        """Queue an event; returns False (and drops it) when the queue is full."""
+        if len(self._queue) >= self.max_queue_size:
+            self.dropped += 1
+            return False
+        self._queue.append(event)
+        if len(self._queue) >= self.batch_size:
+            self._batch_ready.set()
+        return True
+
+    async def flush(self) -> int:
+        """Send everything queued so far in batches; returns the number of events sent."""
+        sent = 0
+        async with self._lock:
+            self._batch_ready.clear()
+            while self._queue:
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                try:
+                    await self.send(batch)
+                except Exception as e:
+                    if not self.is_retryable(e):
+                        self.dropped += len(batch)
+                        logger.error(f"Dropped {len(batch)} events the server will not accept: {e}")
+                        continue
+                    self._requeue(batch)
+                    raise
+                except BaseException:
+                    # Cancelled mid-send: the batch may not have arrived, so keep it
+                    self._requeue(batch)
+                    raise
+                sent += len(batch)
+        return sent
+
+    def _requeue(self, batch: List[Dict[str, Any]]) -> None:
+        # Keep the batch for the next flush, ahead of anything queued since
+        room = max(self.max_queue_size - len(self._queue), 0)
+        self._queue.extendleft(reversed(batch[:room]))
+        self.dropped += len(batch) - min(room, len(batch))
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        # Let a send in progress finish rather than cancelling it, then send the rest
+        if self._task is not None:
+            self._stopping = True
+            self._batch_ready.set()
+            await self._task
+            self._task = None
+        if self._queue:
+            await self.flush()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            if self._stopping:
+                break
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"Event flush failed, {len(self._queue)} events kept for the next attempt: {e}")
@@ -0,0 +1,211 @@
+"""Compressed bitmap over non-negative integers (user ordinals).
+
+Values are split by their high 16 bits into containers, as in Roaring bitmaps:
+a container with up to ``ARRAY_MAX`` values is a sorted ``uint16`` array, a
+denser one is a 65,536-bit bitset (1024 ``uint64`` words). Membership is one
+dict lookup plus a binary search or a bit test.
+"""
+from typing import Dict, Iterable, Iterator, Tuple
+import numpy as np
+
+ARRAY_MAX = 4096
+BITSET_WORDS = 1024
+
+_ARRAY = 0
+_BITSET = 1
+
+
+def _bitset_from_array(values: np.ndarray) -> np.ndarray:
+    words = np.zeros(BITSET_WORDS, dtype=np.uint64)
+    values = values.astype(np.uint64)
+    np.bitwise_or.at(words, (values >> np.uint64(6)).astype(np.intp), np.uint64(1) << (values & np.uint64(63)))
+    return words
+
+
+def _array_from_bitset(words: np.ndarray) -> np.ndarray:
+    bits = np.unpackbits(words.view(np.uint8), bitorder="little")
+    return np.flatnonzero(bits).astype(np.uint16)
+
+
+def _bitset_cardinality(words: np.ndarray) -> int:
+    return int(np.unpackbits(words.view(np.uint8)).sum())
+
+
+class Bitmap:
+    __slots__ = ("_containers", "_cardinality")
+
+    def __init__(self):
+        # high 16 bits -> (kind, uint16 array or uint64 bitset words)
+        self._containers: Dict[int, Tuple[int, np.ndarray]] = {}
+        self._cardinality = 0
+
+    @classmethod
+    def from_values(cls, values: Iterable[int]) -> "Bitmap":
+        values = np.unique(np.fromiter(values, dtype=np.int64) if not isinstance(values, np.ndarray) else values)
+        bitmap = cls()
+        if len(values) == 0:
+            return bitmap
+        if values[0] < 0:
+            raise ValueError("Bitmaps hold non-negative integers only")
+
+        highs = values >> 16
+        boundaries = np.flatnonzero(np.diff(highs)) + 1
+        for chunk in np.split(values, boundaries):
+            bitmap._set_container(int(chunk[0] >> 16), (chunk & 0xFFFF).astype(np.uint16))
+        return bitmap
+
+    def _set_container(self, key: int, low: np.ndarray, kind: int = _ARRAY) -> None:
+        # Normalizes to the cheaper representation and keeps the cardinality in step
+        old = self._containers.pop(key, None)
+        if old is not None:
+            self._cardinality -= self._container_cardinality(old)
+
+        if kind == _BITSET:
+            cardinality = _bitset_cardinality(low)
+            container = (_BITSET, low) if cardinality > ARRAY_MAX else (_ARRAY, _array_from_bitset(low))
+        else:
+            cardinality = len(low)
+            container = (_ARRAY, low) if cardinality <= ARRAY_MAX else (_BITSET, _bitset_from_array(low))
+
+        if cardinality:
+            self._containers[key] = container
+            self._cardinality += cardinality
+
+    @staticmethod
+    def _container_cardinality(container: Tuple[int, np.ndarray]) -> int:
+        kind, data = container
+        return len(data) if kind == _ARRAY else _bitset_cardinality(data)
+
+    @staticmethod
+    def _as_bitset(container: Tuple[int, np.ndarray]) -> np.ndarray:
+        kind, data = container
+        return data if kind == _BITSET else _bitset_from_array(data)
+
+    def __contains__(self, value: int) -> bool:
+        container = self._containers.get(value >> 16)
+        if container is None:
+            return False
+        kind, data = container
+        low = value & 0xFFFF
+        if kind == _ARRAY:
+            index = int(np.searchsorted(data, low))
+            return index < len(data) and int(data[index]) == low
+        return bool((int(data[low >> 6]) >> (low & 63)) & 1)
+
+    def __len__(self) -> int:
+        return self._cardinality
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.to_array().tolist())
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Bitmap) and np.array_equal(self.to_array(), other.to_array())
+
+    def add(self, value: int) -> None:
+        if value < 0:
+            raise ValueError("Bitmaps hold non-negative integers only")
+        if value in self:
+            return
+        key, low = value >> 16, value & 0xFFFF
+        container = self._containers.get(key)
+        if container is None:
+            self._set_container(key, np.array([low], dtype=np.uint16))
+        elif container[0] == _ARRAY:
+            data = container[1]
+            self._set_container(key, np.insert(data, int(np.searchsorted(data, low)), low).astype(np.uint16))
+        else:
+            container[1][low >> 6] |= np.uint64(1) << np.uint64(low & 63)
+            self._cardinality += 1
+
+    def discard(self, value: int) -> None:
+        if value < 0 or value not in self:
+            return
+        key, low = value >> 16, value & 0xFFFF
+        kind, data = self._containers[key]
+        if kind == _ARRAY:
+            self._set_container(key, data[data != low])
+        else:
+            words = data.copy()
+            words[low >> 6] &= ~(np.uint64(1) << np.uint64(low & 63))
+            self._set_container(key, words, _BITSET)
+
+    def update(self, values: Iterable[int]) -> None:
+        merged = self | Bitmap.from_values(values)
+        self._containers, self._cardinality = merged._containers, merged._cardinality
+
+    def difference_update(self, values: Iterable[int]) -> None:
+        remaining = self - Bitmap.from_values(values)
+        self._containers, self._cardinality = remaining._containers, remaining._cardinality
+
+    def __or__(self, other: "Bitmap") -> "Bitmap":
+        result = Bitmap()
+        for key in self._containers.keys() | other._containers.keys():
+            left, right = self._containers.get(key), other._containers.get(key)
+            if left is None or right is None:
+                kind, data = left or right
+                result._set_container(key, data.copy(), kind)
+            elif left[0] == _ARRAY and right[0] == _ARRAY:
+                result._set_container(key, np.union1d(left[1], right[1]).astype(np.uint16))
+            else:
+                result._set_container(key, self._as_bitset(left) | self._as_bitset(right), _BITSET)
+        return result
+
+    def __and__(self, other: "Bitmap") -> "Bitmap":
+        result = Bitmap()
+        for key in self._containers.keys() & other._containers.keys():
+            left, right = self._containers[key], other._containers[key]
+            if left[0] == _ARRAY and right[0] == _ARRAY:
+                result._set_container(key, np.intersect1d(left[1], right[1], assume_unique=True).astype(np.uint16))
+            else:
+                result._set_container(key, self._as_bitset(left) & self._as_bitset(right), _BITSET)
+        return result
+
+    def __sub__(self, other: "Bitmap") -> "Bitmap":
+        result = Bitmap()
+        for key, left in self._containers.items():
+            right = other._containers.get(key)
+            if right is None:
+                result._set_container(key, left[1].copy(), left[0])
+            elif left[0] == _ARRAY and right[0] == _ARRAY:
+                result._set_container(key, np.setdiff1d(left[1], right[1], assume_unique=True).astype(np.uint16))
+            else:
+                result._set_container(key, self._as_bitset(left) & ~self._as_bitset(right), _BITSET)
+        return result
+
+    def to_array(self) -> np.ndarray:
+        chunks = []
+        for key in sorted(self._containers):
+            kind, data = self._containers[key]
+            low = data if kind == _ARRAY else _array_from_bitset(data)
+            chunks.append((np.int64(key) << 16) | low.astype(np.int64))
+        return np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int64)
+
+    def serialize(self) -> Dict[str, np.ndarray]:
+        """Containers as flat arrays, for ``np.savez``."""
+        keys = sorted(self._containers)
+        kinds = np.array([self._containers[key][0] for key in keys], dtype=np.uint8)
+        arrays = [self._containers[key][1] for key in keys if self._containers[key][0] == _ARRAY]
+        bitsets = [self._containers[key][1] for key in keys if self._containers[key][0] == _BITSET]
+        return {
+            "keys": np.array(keys, dtype=np.int64),
+            "kinds": kinds,
+            "array_lengths": np.array([len(data) for data in arrays], dtype=np.int64),
+            "array_values": np.concatenate(arrays) if arrays else np.empty(0, dtype=np.uint16),
+            "bitset_words": np.concatenate(bitsets) if bitsets else np.empty(0, dtype=np.uint64),
+        }
+
+    @classmethod
+    def deserialize(cls, parts: Dict[str, np.ndarray]) -> "Bitmap":
+        bitmap = cls()
+        array_offsets = np.concatenate([[0], np.cumsum(parts["array_lengths"])])
+        array_index = bitset_index = 0
+        for key, kind in zip(parts["keys"].tolist(), parts["kinds"].tolist()):
+            if kind == _ARRAY:
+                start, end = array_offsets[array_index], array_offsets[array_index + 1]
+                bitmap._set_container(key, parts["array_values"][start:end].copy())
+                array_index += 1
+            else:
+                start = bitset_index * BITSET_WORDS
+                bitmap._set_container(key, parts["bitset_words"][start:start + BITSET_WORDS].copy(), _BITSET)
+                bitset_index += 1
+        return bitmap
@@ -1,12 +1,100 @@
-from cachetools import TTLCache
+from cachetools import LRUCache, TTLCache
+from collections import defaultdict
 from functools import wraps
-from typing import Callable, Any
+from pydantic import BaseModel
+from typing import Callable, Any, Dict, Iterable, Optional, Set, Type
 import hashlib
+import inspect
 import json
 
-experiment_cache = TTLCache(maxsize=1000, ttl=300)
-segment_cache = TTLCache(maxsize=1000, ttl=60)
-variant_assignment_cache = TTLCache(maxsize=10000, ttl=86400)
+
+class TaggedTTLCache(TTLCache):
+    """TTLCache with a secondary index from entity tags (e.g. ``experiment:42``)
+    to the keys whose values depend on that entity."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self._keys_by_tag: Dict[str, Set[Any]] = defaultdict(set)
+        self._tags_by_key: Dict[Any, Set[str]] = {}
+
+    def set(self, key, value, tags: Iterable[str] = ()) -> None:
+        self[key] = value
+        self._forget(key)
+        tags = set(tags)
+        if tags:
+            self._tags_by_key[key] = tags
+            for tag in tags:
+                self._keys_by_tag[tag].add(key)
+
+    def invalidate_tag(self, tag: str) -> int:
+        keys = self._keys_by_tag.pop(tag, set())
+        for key in keys:
+            self.pop(key, None)
+            self._forget(key)
+        return len(keys)
+
+    def _forget(self, key) -> None:
+        for tag in self._tags_by_key.pop(key, ()):
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
+
+    # Keep the index in step with evictions and expirations
+    def __delitem__(self, key):
+        try:
+            super().__delitem__(key)
+        finally:
+            self._forget(key)
+
+    def expire(self, time=None):
+        # cachetools >= 5.4 returns the expired (key, value) pairs
+        expired = super().expire(time)
+        for key, _ in expired:
+            self._forget(key)
+        return expired
+
+    def clear(self) -> None:
+        super().clear()
+        self._keys_by_tag.clear()
+        self._tags_by_key.clear()
+
+
+experiment_cache = TaggedTTLCache(maxsize=1000, ttl=300)
+segment_cache = TaggedTTLCache(maxsize=1000, ttl=60)
+# (user_id, experiment_id) -> assigned variant_id, or None when the user isn't eligible
+variant_assignment_cache = TaggedTTLCache(maxsize=10000, ttl=86400)
+
+TAGGED_CACHES = (experiment_cache, segment_cache, variant_assignment_cache)
+
+# Validated API keys by token
+api_key_cache = TTLCache(maxsize=10000, ttl=60)
+
+# segment_id -> (rules_version, compiled predicate)
+compiled_rules_cache = LRUCache(maxsize=10000)
+
+EXPERIMENT_LIST_TAG = "experiments"
+SEGMENT_LIST_TAG = "segments"
+
+# Hit/miss counts per cached function name
+cache_stats: Dict[str, Dict[str, int]] = {}
+
+# Bumped whenever experiments, variants or segment targeting change; compiled
+# configuration snapshots built at an older version are rebuilt on next use
+config_version = 0
+
+
+def experiment_tag(experiment_id: int) -> str:
+    return f"experiment:{experiment_id}"
+
+
+def segment_tag(segment_id: int) -> str:
+    return f"segment:{segment_id}"
+
+
+def user_tag(user_id: str) -> str:
+    return f"user:{user_id}"
 
 
 def make_cache_key(*args, **kwargs) -> str:
@@ -16,60 +104,142 @@ def make_cache_key(*args, **kwargs) -> str:
     return hashlib.md5(key_string.encode()).hexdigest()
 
 
-def cached(cache: TTLCache):
+def make_snapshot(result: Any, snapshot: Optional[Type[BaseModel]]) -> Any:
+    # Cache detached copies, never ORM instances bound to the request's session
+    if snapshot is None:
+        return result
+    if isinstance(result, (list, tuple)):
+        return tuple(snapshot.model_validate(item) for item in result)
+    return snapshot.model_validate(result)
+
+
+def cached(
+    cache: TTLCache,
+    ignore: Iterable[str] = ("db",),
+    snapshot: Optional[Type[BaseModel]] = None,
+    tags: Optional[Callable[..., Iterable[str]]] = None
+):
+    """Cache a service function's result.
+
+    Arguments named in ``ignore`` (the per-request session by default) are left out
+    of the key. When ``snapshot`` is given, the result is stored as that Pydantic
+    model (a tuple of them for list results); callers must treat it as read-only.
+    ``tags`` is called as ``tags(result, **arguments)`` and returns the entity tags
+    the entry depends on, so writes can invalidate it with ``invalidate_tags``.
+    """
+    ignored = frozenset(ignore)
+
     def decorator(func: Callable) -> Callable:
+        signature = inspect.signature(func)
+        stats = cache_stats.setdefault(func.__name__, {"hits": 0, "misses": 0})
+
+        def bind_arguments(args, kwargs) -> Dict[str, Any]:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return {
+                name: value for name, value in bound.arguments.items()
+                if name not in ignored
+            }
+
+        def store(cache_key: str, result: Any, arguments: Dict[str, Any]) -> None:
+            if tags is not None and isinstance(cache, TaggedTTLCache):
+                cache.set(cache_key, result, tags(result, **arguments))
+            else:
+                cache[cache_key] = result
+
         @wraps(func)
         async def async_wrapper(*args, **kwargs):
-            cache_key = f"{func.__name__}:{make_cache_key(*args, **kwargs)}"
+            arguments = bind_arguments(args, kwargs)
+            cache_key = f"{func.__name__}:{make_cache_key(**arguments)}"
 
             if cache_key in cache:
+                stats["hits"] += 1
                 return cache[cache_key]
 
-            result = await func(*args, **kwargs)
-            cache[cache_key] = result
+            stats["misses"] += 1
+            result = make_snapshot(await func(*args, **kwargs), snapshot)
+            store(cache_key, result, arguments)
             return result
 
         @wraps(func)
         def sync_wrapper(*args, **kwargs):
-            cache_key = f"{func.__name__}:{make_cache_key(*args, **kwargs)}"
+            arguments = bind_arguments(args, kwargs)
+            cache_key = f"{func.__name__}:{make_cache_key(**arguments)}"
 
             if cache_key in cache:
+                stats["hits"] += 1
                 return cache[cache_key]
 
-            result = func(*args, **kwargs)
-            cache[cache_key] = result
+            stats["misses"] += 1
+            result = make_snapshot(func(*args, **kwargs), snapshot)
+            store(cache_key, result, arguments)
             return result
 
-        import asyncio
-        if asyncio.iscoroutinefunction(func):
+        if inspect.iscoroutinefunction(func):
             return async_wrapper
         return sync_wrapper
 
     return decorator
 
 
+def get_cache_stats() -> Dict[str, Dict[str, int]]:
+    return {name: dict(counts) for name, counts in cache_stats.items()}
+
+
+def invalidate_tags(*tags: str) -> int:
+    removed = 0
+    for cache in TAGGED_CACHES:
+        for tag in tags:
+            removed += cache.invalidate_tag(tag)
+    return removed
+
+
 def invalidate_experiment_cache(experiment_id: int):
-    keys_to_remove = [key for key in experiment_cache.keys() if str(experiment_id) in key]
-    for key in keys_to_remove:
-        experiment_cache.pop(key, None)
+    invalidate_tags(experiment_tag(experiment_id))
+
+
+def invalidate_experiment_list_cache():
+    invalidate_tags(EXPERIMENT_LIST_TAG)
 
 
 def invalidate_segment_cache(segment_id: int):
-    keys_to_remove = [key for key in segment_cache.keys() if str(segment_id) in key]
-    for key in keys_to_remove:
-        segment_cache.pop(key, None)
+    invalidate_tags(segment_tag(segment_id))
+
+
+def invalidate_segment_list_cache():
+    invalidate_tags(SEGMENT_LIST_TAG)
 
 
 def invalidate_variant_assignment(user_id: str, experiment_id: int):
-    keys_to_remove = [
-        key for key in variant_assignment_cache.keys()
-        if str(user_id) in key and str(experiment_id) in key
-    ]
-    for key in keys_to_remove:
-        variant_assignment_cache.pop(key, None)
+    variant_assignment_cache.pop((user_id, experiment_id), None)
+
+
+def invalidate_user_assignments(user_id: str):
+    invalidate_tags(user_tag(user_id))
+
+
+def invalidate_api_key(key: str):
+    api_key_cache.pop(key, None)
+
+
+def invalidate_compiled_rules(segment_id: int):
+    compiled_rules_cache.pop(segment_id, None)
+
+
+def bump_config_version() -> int:
+    global config_version
+    config_version += 1
+    return config_version
+
+
+def get_config_version() -> int:
+    return config_version
 
 
 def clear_all_caches():
     experiment_cache.clear()
     segment_cache.clear()
     variant_assignment_cache.clear()
+    api_key_cache.clear()
+    compiled_rules_cache.clear()
+    bump_config_version()
@@ -26,5 +26,9 @@ async def get_db():
 
 
 async def init_db():
+    # Avoid circular import - migrations reads the models registered on Base
+    from src.migrations import upgrade_schema
+
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade_schema)
@@ -1,6 +1,10 @@
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from .database import init_db
+from .services.events import event_buffer
+from .services.auth import api_key_usage
+from .services.segment_membership import segment_materializer
+from .services.segment_index import segment_index
 
 from .routes import experiments_router, segments_router, events_router, users_router, auth_router
 
@@ -22,6 +26,17 @@ app.include_router(users_router)
 @app.on_event("startup")
 async def startup_event():
     await init_db()
+    api_key_usage.start()
+    segment_materializer.start()
+    segment_index.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await event_buffer.stop()
+    await api_key_usage.stop()
+    await segment_materializer.stop()
+    await segment_index.stop()
 
 
 @app.get("/")
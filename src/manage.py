@@ -0,0 +1,73 @@
+"""Maintenance commands.
+
+    python -m src.manage migrate
+    python -m src.manage rebuild-counters [--experiment-id ID]
+    python -m src.manage check-counters [--experiment-id ID]
+    python -m src.manage materialize-segments [--segment-id ID]
+"""
+from src.database import AsyncSessionLocal, init_db
+from src.services.counters import rebuild_variant_event_counters, check_variant_event_counters
+from src.services.segment_membership import materialize_segment, segment_materializer
+from src import models  # noqa: F401 - registers the tables on Base.metadata
+import argparse
+import asyncio
+import logging
+
+
+async def migrate(args) -> int:
+    await init_db()
+    print("Schema up to date")
+    return 0
+
+
+async def rebuild_counters(args) -> int:
+    async with AsyncSessionLocal() as db:
+        rows = await rebuild_variant_event_counters(db, args.experiment_id)
+    print(f"Rebuilt {rows} variant event counter(s)")
+    return 0
+
+
+async def check_counters(args) -> int:
+    async with AsyncSessionLocal() as db:
+        mismatches = await check_variant_event_counters(db, args.experiment_id)
+
+    for mismatch in mismatches:
+        print(
+            f"experiment={mismatch['experiment_id']} variant={mismatch['variant_id']} "
+            f"type={mismatch['event_type']}: expected {mismatch['expected']}, counter has {mismatch['actual']}"
+        )
+    print(f"{len(mismatches)} mismatched counter(s)")
+    return 1 if mismatches else 0
+
+
+async def materialize_segments(args) -> int:
+    if args.segment_id is None:
+        segment_ids = await segment_materializer.run_once()
+    else:
+        async with AsyncSessionLocal() as db:
+            segment_ids = [args.segment_id] if await materialize_segment(db, args.segment_id) else []
+    print(f"Materialized {len(segment_ids)} segment(s)")
+    return 0
+
+
+COMMANDS = {
+    "migrate": migrate,
+    "rebuild-counters": rebuild_counters,
+    "check-counters": check_counters,
+    "materialize-segments": materialize_segments,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Experimentation server maintenance commands")
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    parser.add_argument("--experiment-id", type=int, default=None, help="Limit counter commands to one experiment")
+    parser.add_argument("--segment-id", type=int, default=None, help="Rebuild one segment, even if it is up to date")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    raise SystemExit(asyncio.run(COMMANDS[args.command](args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+from sqlalchemy import inspect
+from sqlalchemy.engine import Connection
+from sqlalchemy.schema import CreateColumn
+from src.database import Base
+from src.models import MEMBERSHIP_VERSION_DDL
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Indexes that earlier versions created and no query uses any more
+OBSOLETE_INDEXES = {
+    # Statistics read variant_event_counters instead of aggregating events
+    "events": ["ix_events_variant_type"],
+}
+
+
+def add_missing_columns(conn: Connection) -> list[str]:
+    # New NOT NULL columns need a server_default so existing rows get a value
+    inspector = inspect(conn)
+    added = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                logger.info(f"Adding column {column.name} to {table.name}")
+                ddl = CreateColumn(column).compile(dialect=conn.dialect)
+                conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {ddl}")
+                added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def create_missing_indexes(conn: Connection) -> list[str]:
+    # create_all() skips tables that already exist, including their indexes
+    inspector = inspect(conn)
+    created = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                logger.info(f"Creating index {index.name} on {table.name}")
+                index.create(conn)
+                created.append(index.name)
+    return created
+
+
+def drop_obsolete_indexes(conn: Connection) -> list[str]:
+    inspector = inspect(conn)
+    dropped = []
+    for table_name, index_names in OBSOLETE_INDEXES.items():
+        if not inspector.has_table(table_name):
+            continue
+
+        existing = {index["name"] for index in inspector.get_indexes(table_name)}
+        for index_name in index_names:
+            if index_name in existing:
+                logger.info(f"Dropping obsolete index {index_name} on {table_name}")
+                conn.exec_driver_sql(f"DROP INDEX {index_name}")
+                dropped.append(index_name)
+    return dropped
+
+
+def create_membership_version_triggers(conn: Connection) -> None:
+    # Every statement is idempotent (IF NOT EXISTS / OR IGNORE)
+    for statement in MEMBERSHIP_VERSION_DDL:
+        conn.exec_driver_sql(statement)
+
+
+def upgrade_schema(conn: Connection) -> list[str]:
+    """Bring an existing database up to date with the models. Safe to run repeatedly."""
+    add_missing_columns(conn)
+    create_membership_version_triggers(conn)
+    drop_obsolete_indexes(conn)
+    return create_missing_indexes(conn)
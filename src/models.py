@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, ForeignKey, Enum, JSON, UniqueConstraint, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, Float, ForeignKey, Enum, JSON, UniqueConstraint, Boolean, Index, event
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from src.database import Base
@@ -13,6 +13,13 @@ class ExperimentStatus(enum.Enum):
     COMPLETED = "completed"
 
 
+class BucketingMode(enum.Enum):
+    # 100 hash buckets split by cumulative percent_allocated in variant ID order
+    PERCENT = "percent"
+    # 10,000 hash buckets with explicit bucket ranges stored per variant
+    RANGED = "ranged"
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -28,6 +35,11 @@ class User(Base):
     events = relationship("Event", back_populates="user")
     segment_assignments = relationship("UserSegment", back_populates="user")
 
+    __table_args__ = (
+        # Keyset pagination order for listing users
+        Index('ix_users_created_at_id', 'created_at', 'id'),
+    )
+
 
 class Segment(Base):
     __tablename__ = "segments"
@@ -39,6 +51,12 @@ class Segment(Base):
     # Property-based rules stored as JSON
     # Example: {"is_premium": 1} or {"country_code": "US"}
     rules = Column(JSON, nullable=True)
+    # Bumped whenever rules change; keys the compiled predicate cache
+    rules_version = Column(Integer, default=1, server_default="1", nullable=False)
+    # rules_version that rule_segment_members currently reflects; NULL until first materialized
+    materialized_version = Column(Integer, nullable=True)
+    # Bumped by changes to the segment itself, not its members; served as the ETag
+    config_version = Column(Integer, default=1, server_default="1", nullable=False)
 
     created_at = Column(DateTime, default=datetime.utcnow)
 
@@ -53,9 +71,17 @@ class Experiment(Base):
     name = Column(String, unique=True, index=True, nullable=False)
     description = Column(String, nullable=True)
     status = Column(Enum(ExperimentStatus), default=ExperimentStatus.DRAFT, nullable=False)
+    bucketing = Column(
+        Enum(BucketingMode),
+        default=BucketingMode.PERCENT,
+        server_default=BucketingMode.PERCENT.name,
+        nullable=False
+    )
     created_at = Column(DateTime, default=datetime.utcnow)
     started_at = Column(DateTime, nullable=True)
     ended_at = Column(DateTime, nullable=True)
+    # Bumped by every change to the experiment, its variants or its segments; served as the ETag
+    config_version = Column(Integer, default=1, server_default="1", nullable=False)
 
     variants = relationship("Variant", back_populates="experiment", cascade="all, delete-orphan")
     segment_assignments = relationship("ExperimentSegment", back_populates="experiment")
@@ -68,6 +94,8 @@ class Variant(Base):
     experiment_id = Column(Integer, ForeignKey("experiments.id"), nullable=False)
     name = Column(String, nullable=False)
     percent_allocated = Column(Float, nullable=False, default=0.0)
+    # Ranged bucketing only: [start, end) bucket ranges in the order they were claimed
+    bucket_ranges = Column(JSON, nullable=True)
     enabled = Column(Boolean, default=True, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
 
@@ -109,9 +137,53 @@ class UserSegment(Base):
 
     __table_args__ = (
         UniqueConstraint('user_id', 'segment_id', name='uq_user_segment'),
+        Index('ix_user_segments_segment_user', 'segment_id', 'user_id'),
+    )
+
+
+class RuleSegmentMember(Base):
+    __tablename__ = "rule_segment_members"
+
+    # Users matching a segment's rules, materialized by services.segment_membership
+    id = Column(Integer, primary_key=True, index=True)
+    segment_id = Column(Integer, ForeignKey("segments.id"), nullable=False)
+    user_id = Column(String, ForeignKey("users.id"), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint('segment_id', 'user_id', name='uq_rule_segment_member'),
+        Index('ix_rule_segment_members_user', 'user_id'),
     )
 
 
+class MembershipVersion(Base):
+    __tablename__ = "membership_version"
+
+    # Single row (id 1), bumped by triggers on every write to user_segments and rule_segment_members
+    # in the writing transaction; the segment index compares it to detect membership changes
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0, server_default="0")
+
+
+MEMBERSHIP_TABLES = ("user_segments", "rule_segment_members")
+
+MEMBERSHIP_VERSION_DDL = [
+    "INSERT OR IGNORE INTO membership_version (id, version) VALUES (1, 0)",
+    *(
+        f"CREATE TRIGGER IF NOT EXISTS trg_{table}_{operation.lower()}_version "
+        f"AFTER {operation} ON {table} "
+        f"BEGIN UPDATE membership_version SET version = version + 1 WHERE id = 1; END"
+        for table in MEMBERSHIP_TABLES
+        for operation in ("INSERT", "UPDATE", "DELETE")
+    ),
+]
+
+
+@event.listens_for(Base.metadata, "after_create")
+def create_membership_version_triggers(target, connection, **kw):
+    for statement in MEMBERSHIP_VERSION_DDL:
+        connection.exec_driver_sql(statement)
+
+
 class ExperimentSegment(Base):
     __tablename__ = "experiment_segments"
 
@@ -151,3 +223,25 @@ class Event(Base):
     properties = Column(JSON, nullable=True)
 
     user = relationship("User", back_populates="events")
+
+    __table_args__ = (
+        # Event queries and counter rebuilds: variant / type within an experiment
+        Index('ix_events_experiment_variant_type', 'experiment_id', 'variant_id', 'type'),
+        # Event queries: time ranges within an experiment
+        Index('ix_events_experiment_timestamp', 'experiment_id', 'timestamp'),
+    )
+
+
+class VariantEventCounter(Base):
+    __tablename__ = "variant_event_counters"
+
+    # Rollup of events per (experiment, variant, type), maintained on ingestion
+    id = Column(Integer, primary_key=True, index=True)
+    experiment_id = Column(Integer, ForeignKey("experiments.id"), nullable=False)
+    variant_id = Column(Integer, ForeignKey("variants.id"), nullable=False)
+    event_type = Column(String, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint('experiment_id', 'variant_id', 'event_type', name='uq_variant_event_counter'),
+    )
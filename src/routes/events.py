@@ -1,10 +1,14 @@
 from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from src.database import get_db
-from src.schemas.events import EventCreate, EventResponse, EventFilterRequest
+from src.schemas.events import (
+    EventCreate, EventResponse, EventFilterRequest, EventsPage, EventBatchCreate, EventBatchResponse,
+    EventIngestionResponse
+)
 from src.services import events as event_service
 from .utils import verify_api_key
-from typing import List
+from typing import Literal
 
 router = APIRouter(prefix="/api/events", tags=["events"], dependencies=[Depends(verify_api_key)])
 
@@ -14,10 +18,37 @@ async def create_event(event: EventCreate, db: AsyncSession = Depends(get_db)):
     return await event_service.create_event(db, event)
 
 
-@router.post("/{experiment_id}", response_model=List[EventResponse])
+@router.post("/batch", response_model=EventBatchResponse)
+async def create_events_batch(batch: EventBatchCreate, db: AsyncSession = Depends(get_db)):
+    return await event_service.create_events_batch(db, batch.events)
+
+
+@router.post("/async", response_model=EventIngestionResponse, status_code=202)
+async def enqueue_event(event: EventCreate):
+    return EventIngestionResponse(ingestion_id=event_service.enqueue_event(event))
+
+
+@router.post("/{experiment_id}", response_model=EventsPage)
 async def get_events(
     experiment_id: int,
     filters: EventFilterRequest = EventFilterRequest(),
     db: AsyncSession = Depends(get_db)
 ):
     return await event_service.get_events(db, experiment_id, filters)
+
+
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+@router.post("/{experiment_id}/export")
+async def export_events(
+    experiment_id: int,
+    filters: EventFilterRequest = EventFilterRequest(),
+    format: Literal["ndjson", "csv"] = "ndjson",
+    db: AsyncSession = Depends(get_db)
+):
+    return StreamingResponse(
+        event_service.export_events(db, experiment_id, filters, format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="experiment-{experiment_id}-events.{format}"'}
+    )
@@ -1,16 +1,21 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Header, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from src.database import get_db
 from src.schemas.experiments import (
     ExperimentCreate, ExperimentResponse, ExperimentDetailResponse,
     VariantCreate, VariantUpdate, VariantResponse,
-    EligibilityCheckRequest, EligibilityCheckResponse
+    EligibilityCheckRequest, EligibilityCheckResponse,
+    BulkEligibilityCheckRequest, BulkEligibilityCheckResponse,
+    ChangesResponse, DEFAULT_CHANGES_TIMEOUT_SECONDS, MAX_CHANGES_TIMEOUT_SECONDS
 )
 from src.schemas.statistics import ExperimentStatisticsResponse, StatisticsRequest
 from src.services import experiments as experiment_service
 from src.services.statistics import get_experiment_statistics
-from .utils import verify_api_key
-from typing import List
+from src.services.changes import poll_changes, stream_changes
+from src.services.config_bundle import get_config_bundle
+from .utils import verify_api_key, versioned_etag, conditional_response, not_modified
+from typing import List, Optional
 
 router = APIRouter(prefix="/api/experiments", tags=["experiments"], dependencies=[Depends(verify_api_key)])
 
@@ -21,13 +26,51 @@ async def create_experiment(experiment: ExperimentCreate, db: AsyncSession = Dep
 
 
 @router.get("/", response_model=List[ExperimentResponse])
-async def get_experiments(db: AsyncSession = Depends(get_db)):
-    return await experiment_service.get_experiments(db)
+async def get_experiments(request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    etag = versioned_etag(await experiment_service.get_experiment_list_versions(db))
+    return await conditional_response(request, response, etag, lambda: experiment_service.get_experiments(db))
+
+
+@router.get("/bundle")
+async def get_bundle(request: Request, db: AsyncSession = Depends(get_db)):
+    bundle = await get_config_bundle(db)
+    headers = {"ETag": bundle.etag, "Vary": "Accept-Encoding"}
+    if not_modified(request, bundle.etag):
+        return Response(status_code=304, headers=headers)
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        return Response(bundle.gzipped, media_type="application/json", headers={**headers, "Content-Encoding": "gzip"})
+    return Response(bundle.body, media_type="application/json", headers=headers)
+
+
+@router.get("/changes", response_model=ChangesResponse)
+async def get_changes(
+    request: Request,
+    since: Optional[int] = None,
+    timeout: float = Query(DEFAULT_CHANGES_TIMEOUT_SECONDS, ge=0, le=MAX_CHANGES_TIMEOUT_SECONDS),
+    last_event_id: Optional[int] = Header(None)
+):
+    # EventSource reconnects with Last-Event-ID instead of the original query string
+    since = since if since is not None else last_event_id
+    if "text/event-stream" in request.headers.get("accept", ""):
+        return StreamingResponse(
+            stream_changes(since),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    return await poll_changes(since, timeout)
 
 
 @router.get("/{experiment_id}", response_model=ExperimentDetailResponse)
-async def get_experiment(experiment_id: int, db: AsyncSession = Depends(get_db)):
-    return await experiment_service.get_experiment_by_id(db, experiment_id)
+async def get_experiment(
+    experiment_id: int,
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_db)
+):
+    etag = versioned_etag(await experiment_service.get_experiment_versions(db, experiment_id))
+    return await conditional_response(
+        request, response, etag, lambda: experiment_service.get_experiment_by_id(db, experiment_id)
+    )
 
 
 @router.post("/{experiment_id}/variants", response_model=VariantResponse)
@@ -58,6 +101,17 @@ async def check_user_eligibility(
     return EligibilityCheckResponse(eligible_experiment_ids=eligible_experiments)
 
 
+@router.post("/check-eligibility/bulk", response_model=BulkEligibilityCheckResponse)
+async def check_users_eligibility(
+    request: BulkEligibilityCheckRequest,
+    db: AsyncSession = Depends(get_db)
+):
+    assignments, missing_user_ids = await experiment_service.check_users_eligibility(
+        db, request.user_ids, request.experiment_ids
+    )
+    return BulkEligibilityCheckResponse(assignments=assignments, missing_user_ids=missing_user_ids)
+
+
 @router.post("/{experiment_id}/results", response_model=ExperimentStatisticsResponse)
 async def get_experiment_results(
     experiment_id: int,
@@ -1,13 +1,16 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from src.database import get_db
 from src.schemas.segments import (
     SegmentCreate, SegmentUpdate, SegmentResponse,
-    UserSegmentAssign, ExperimentSegmentAssign, SegmentDetailResponse
+    UserSegmentAssign, ExperimentSegmentAssign, SegmentDetailResponse, SegmentUsersPage,
+    BulkUserSegmentAssign, BulkUserSegmentAssignResponse,
+    DEFAULT_SEGMENT_USERS_PAGE_SIZE, MAX_SEGMENT_USERS_PAGE_SIZE
 )
 from src.services import segments as segment_service
-from .utils import verify_api_key
-from typing import List
+from src.services.uploads import parse_user_id_upload
+from .utils import verify_api_key, versioned_etag, conditional_response
+from typing import List, Optional
 
 router = APIRouter(prefix="/api/segments", tags=["segments"], dependencies=[Depends(verify_api_key)])
 
@@ -18,8 +21,9 @@ async def create_segment(segment: SegmentCreate, db: AsyncSession = Depends(get_
 
 
 @router.get("/", response_model=List[SegmentResponse])
-async def get_segments(db: AsyncSession = Depends(get_db)):
-    return await segment_service.get_segments(db)
+async def get_segments(request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    etag = versioned_etag(await segment_service.get_segment_list_versions(db))
+    return await conditional_response(request, response, etag, lambda: segment_service.get_segments(db))
 
 
 @router.get("/{segment_id}", response_model=SegmentDetailResponse)
@@ -27,6 +31,16 @@ async def get_segment(segment_id: int, db: AsyncSession = Depends(get_db)):
     return await segment_service.get_segment_by_id(db, segment_id)
 
 
+@router.get("/{segment_id}/users", response_model=SegmentUsersPage)
+async def get_segment_users(
+    segment_id: int,
+    after: Optional[str] = None,
+    limit: int = Query(DEFAULT_SEGMENT_USERS_PAGE_SIZE, ge=1, le=MAX_SEGMENT_USERS_PAGE_SIZE),
+    db: AsyncSession = Depends(get_db)
+):
+    return await segment_service.get_segment_users(db, segment_id, after, limit)
+
+
 @router.put("/{segment_id}", response_model=SegmentResponse)
 async def update_segment(
     segment_id: int,
@@ -42,6 +56,17 @@ async def assign_user_to_segment(assignment: UserSegmentAssign, db: AsyncSession
     return {"message": "User assigned to segment successfully"}
 
 
+@router.post("/assign-users", response_model=BulkUserSegmentAssignResponse)
+async def assign_users_to_segment(assignment: BulkUserSegmentAssign, db: AsyncSession = Depends(get_db)):
+    return await segment_service.bulk_assign_users_to_segment(db, assignment.segment_id, assignment.user_ids)
+
+
+@router.post("/{segment_id}/users/import", response_model=BulkUserSegmentAssignResponse)
+async def import_segment_users(segment_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    user_ids = parse_user_id_upload(request.stream(), request.headers.get("content-type"))
+    return await segment_service.bulk_assign_users_to_segment(db, segment_id, user_ids)
+
+
 @router.post("/assign-experiment")
 async def assign_segment_to_experiment(assignment: ExperimentSegmentAssign, db: AsyncSession = Depends(get_db)):
     await segment_service.assign_segment_to_experiment(db, assignment.experiment_id, assignment.segment_id)
@@ -1,10 +1,13 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from src.database import get_db
-from src.schemas.users import UserCreate, UserUpdate, UserResponse
+from src.schemas.users import (
+    UserCreate, UserUpdate, UserResponse, UsersPage, DEFAULT_USERS_PAGE_SIZE, MAX_USERS_PAGE_SIZE
+)
 from src.services import users as user_service
 from .utils import verify_api_key
-from typing import List
+from typing import Literal, Optional
 
 router = APIRouter(prefix="/api/users", tags=["users"], dependencies=[Depends(verify_api_key)])
 
@@ -14,9 +17,16 @@ async def create_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
     return await user_service.create_user(db, user)
 
 
-@router.get("/", response_model=List[UserResponse])
-async def get_users(db: AsyncSession = Depends(get_db)):
-    return await user_service.get_users(db)
+@router.get("/", response_model=UsersPage)
+async def get_users(
+    after: Optional[str] = None,
+    limit: int = Query(DEFAULT_USERS_PAGE_SIZE, ge=1, le=MAX_USERS_PAGE_SIZE),
+    format: Literal["json", "ndjson"] = "json",
+    db: AsyncSession = Depends(get_db)
+):
+    if format == "ndjson":
+        return StreamingResponse(user_service.stream_users(db, after), media_type="application/x-ndjson")
+    return await user_service.get_users(db, after, limit)
 
 
 @router.get("/{user_id}", response_model=UserResponse)
@@ -1,10 +1,14 @@
-from fastapi import Depends, HTTPException, Security
+from fastapi import Depends, HTTPException, Request, Response, Security
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from src.database import get_db
 from src.models import ApiKey
-from datetime import datetime
+from src.schemas.auth import ApiKeyResponse
+from src.cache import api_key_cache
+from src.services.auth import record_api_key_use
+from typing import Any, Awaitable, Callable, Iterable, Tuple
+import hashlib
 
 security = HTTPBearer(auto_error=False)
 
@@ -18,17 +22,48 @@ async def verify_api_key(
 
     token = credentials.credentials
 
-    result = await db.execute(select(ApiKey).filter(ApiKey.key == token))
-    api_key = result.scalar_one_or_none()
+    api_key = api_key_cache.get(token)
+    if api_key is None:
+        result = await db.execute(select(ApiKey).filter(ApiKey.key == token))
+        db_api_key = result.scalar_one_or_none()
 
-    if not api_key:
-        raise HTTPException(status_code=401, detail="Invalid API key")
+        if not db_api_key:
+            raise HTTPException(status_code=401, detail="Invalid API key")
 
-    if not api_key.is_active:
-        raise HTTPException(status_code=401, detail="API key is inactive")
+        if not db_api_key.is_active:
+            raise HTTPException(status_code=401, detail="API key is inactive")
 
-    # Update last_used_at
-    api_key.last_used_at = datetime.utcnow()
-    await db.commit()
+        api_key = ApiKeyResponse.model_validate(db_api_key)
+        api_key_cache[token] = api_key
+
+    # last_used_at is written in batches by the usage tracker
+    record_api_key_use(api_key.id)
 
     return api_key
+
+
+def versioned_etag(versions: Iterable[Tuple[str, int, int]]) -> str:
+    """Strong ETag over the ``(type, id, config_version)`` of every entity in a response."""
+    key = "|".join(f"{kind}:{entity_id}:{version}" for kind, entity_id, version in versions)
+    return f'"{hashlib.md5(key.encode()).hexdigest()}"'
+
+
+def not_modified(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = {candidate.strip().removeprefix("W/") for candidate in header.split(",")}
+    return etag in candidates or "*" in candidates
+
+
+async def conditional_response(
+    request: Request,
+    response: Response,
+    etag: str,
+    load: Callable[[], Awaitable[Any]]
+) -> Any:
+    # 304 without loading the body when the client already holds this version
+    if not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return await load()
@@ -1,22 +1,33 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
 from datetime import datetime
 
 
+# Largest value a 64-bit integer column holds; larger ids fail the whole INSERT
+MAX_ROW_ID = 2**63 - 1
+
+
 class EventCreate(BaseModel):
     user_id: str
-    experiment_id: Optional[int] = None
-    variant_id: Optional[int] = None
+    experiment_id: Optional[int] = Field(None, ge=1, le=MAX_ROW_ID)
+    variant_id: Optional[int] = Field(None, ge=1, le=MAX_ROW_ID)
     type: str
     properties: Optional[dict] = None
 
 
+DEFAULT_EVENTS_PAGE_SIZE = 1000
+MAX_EVENTS_PAGE_SIZE = 10000
+
+
 class EventFilterRequest(BaseModel):
     start_time: Optional[datetime] = None
     end_time: Optional[datetime] = None
     variant_id: Optional[int] = None
     event_types: Optional[List[str]] = None
     user_ids: Optional[List[str]] = None
+    # Keyset cursor from a previous page's next_after; exports resume from it too
+    after: Optional[str] = None
+    limit: int = Field(DEFAULT_EVENTS_PAGE_SIZE, ge=1, le=MAX_EVENTS_PAGE_SIZE)
 
 
 class EventResponse(BaseModel):
@@ -30,3 +41,33 @@ class EventResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class EventsPage(BaseModel):
+    events: List[EventResponse]
+    # Pass as ``after`` to fetch the next page; None on the last page
+    next_after: Optional[str] = None
+
+
+MAX_EVENT_BATCH_SIZE = 1000
+
+
+class EventBatchCreate(BaseModel):
+    events: List[EventCreate] = Field(..., min_length=1, max_length=MAX_EVENT_BATCH_SIZE)
+
+
+class EventBatchItemResult(BaseModel):
+    index: int
+    accepted: bool
+    id: Optional[int] = None
+    error: Optional[str] = None
+
+
+class EventBatchResponse(BaseModel):
+    accepted: int
+    rejected: int
+    results: List[EventBatchItemResult]
+
+
+class EventIngestionResponse(BaseModel):
+    ingestion_id: str
@@ -1,7 +1,7 @@
-from pydantic import BaseModel
-from typing import Optional, List
+from pydantic import BaseModel, Field
+from typing import Optional, List, Dict
 from datetime import datetime
-from src.models import ExperimentStatus
+from src.models import ExperimentStatus, BucketingMode
 
 
 class VariantCreate(BaseModel):
@@ -20,6 +20,7 @@ class VariantResponse(BaseModel):
     experiment_id: int
     name: str
     percent_allocated: float
+    bucket_ranges: Optional[List[List[int]]] = None
     enabled: bool
     created_at: datetime
 
@@ -30,6 +31,7 @@ class VariantResponse(BaseModel):
 class ExperimentCreate(BaseModel):
     name: str
     description: Optional[str] = None
+    bucketing: BucketingMode = BucketingMode.PERCENT
 
 
 class ExperimentResponse(BaseModel):
@@ -37,6 +39,8 @@ class ExperimentResponse(BaseModel):
     name: str
     description: Optional[str]
     status: ExperimentStatus
+    bucketing: BucketingMode = BucketingMode.PERCENT
+    config_version: int = 1
     created_at: datetime
     started_at: Optional[datetime]
     ended_at: Optional[datetime]
@@ -58,11 +62,46 @@ class EligibilityCheckResponse(BaseModel):
     eligible_experiment_ids: dict[int, ExperimentVariantInfo]
 
 
+MAX_BULK_ELIGIBILITY_USERS = 1000
+
+
+class BulkEligibilityCheckRequest(BaseModel):
+    user_ids: List[str] = Field(..., min_length=1, max_length=MAX_BULK_ELIGIBILITY_USERS)
+    experiment_ids: List[int]
+
+
+class BulkEligibilityCheckResponse(BaseModel):
+    # user_id -> experiment_id -> assigned variant, for eligible experiments only
+    assignments: Dict[str, Dict[int, ExperimentVariantInfo]]
+    missing_user_ids: List[str] = []
+
+
+DEFAULT_CHANGES_TIMEOUT_SECONDS = 30
+MAX_CHANGES_TIMEOUT_SECONDS = 60
+
+
+class ChangeResponse(BaseModel):
+    version: int
+    # "experiment.created", "variant.created", "variant.updated", "segment.updated",
+    # "segment.attached" or "segment.detached"
+    type: str
+    data: dict
+
+
+class ChangesResponse(BaseModel):
+    version: int
+    # The requested version can't be replayed; refetch the full configuration
+    reset: bool = False
+    changes: List[ChangeResponse] = []
+
+
 class ExperimentDetailResponse(BaseModel):
     id: int
     name: str
     description: Optional[str]
     status: ExperimentStatus
+    bucketing: BucketingMode = BucketingMode.PERCENT
+    config_version: int = 1
     created_at: datetime
     started_at: Optional[datetime]
     ended_at: Optional[datetime]
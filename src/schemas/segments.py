@@ -1,7 +1,12 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
 from datetime import datetime
 
+DEFAULT_SEGMENT_USERS_PAGE_SIZE = 100
+MAX_SEGMENT_USERS_PAGE_SIZE = 1000
+MAX_BULK_SEGMENT_USERS = 100_000
+MAX_REPORTED_MISSING_USER_IDS = 1000
+
 
 class SegmentCreate(BaseModel):
     name: str
@@ -20,6 +25,7 @@ class SegmentResponse(BaseModel):
     name: str
     description: Optional[str]
     rules: Optional[dict]
+    config_version: int = 1
     created_at: datetime
 
     class Config:
@@ -31,6 +37,19 @@ class UserSegmentAssign(BaseModel):
     segment_id: int
 
 
+class BulkUserSegmentAssign(BaseModel):
+    segment_id: int
+    user_ids: List[str] = Field(..., min_length=1, max_length=MAX_BULK_SEGMENT_USERS)
+
+
+class BulkUserSegmentAssignResponse(BaseModel):
+    assigned: int
+    already_assigned: int
+    missing_count: int
+    # Only the first MAX_REPORTED_MISSING_USER_IDS are listed
+    missing_user_ids: List[str] = []
+
+
 class ExperimentSegmentAssign(BaseModel):
     experiment_id: int
     segment_id: int
@@ -41,13 +60,20 @@ class SegmentDetailResponse(BaseModel):
     name: str
     description: Optional[str]
     rules: Optional[dict]
+    config_version: int = 1
     created_at: datetime
-    users: List['UserResponse'] = []
+    member_count: int = 0
 
     class Config:
         from_attributes = True
 
 
+class SegmentUsersPage(BaseModel):
+    users: List['UserResponse']
+    # Pass as ``after`` to fetch the next page; None on the last page
+    next_after: Optional[str] = None
+
+
 # Avoid circular import - this will be resolved when schemas are imported
 from src.schemas.users import UserResponse
-SegmentDetailResponse.model_rebuild()
+SegmentUsersPage.model_rebuild()
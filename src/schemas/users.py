@@ -1,7 +1,10 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 
+DEFAULT_USERS_PAGE_SIZE = 100
+MAX_USERS_PAGE_SIZE = 1000
+
 
 class UserCreate(BaseModel):
     first_name: str
@@ -30,3 +33,9 @@ class UserResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class UsersPage(BaseModel):
+    users: List[UserResponse]
+    # Pass as ``after`` to fetch the next page; None on the last page
+    next_after: Optional[str] = None
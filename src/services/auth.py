@@ -1,10 +1,20 @@
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy import select, update, bindparam
 from fastapi import HTTPException
+from src.database import AsyncSessionLocal
 from src.models import ApiKey
-from typing import List
+from src.cache import invalidate_api_key
+from datetime import datetime
+from typing import Dict, List, Optional
+import asyncio
+import logging
+import os
 import secrets
 
+logger = logging.getLogger(__name__)
+
+API_KEY_USAGE_FLUSH_INTERVAL_SECONDS = float(os.getenv("API_KEY_USAGE_FLUSH_INTERVAL_SECONDS", "30"))
+
 
 async def create_api_key(db: AsyncSession, name: str) -> ApiKey:
     key = secrets.token_urlsafe(32)
@@ -33,4 +43,81 @@ async def delete_api_key(db: AsyncSession, key_id: int) -> None:
         raise HTTPException(status_code=404, detail="API key not found")
 
     await db.delete(api_key)
-    await db.commit()
\ No newline at end of file
+    await db.commit()
+
+    invalidate_api_key(api_key.key)
+    api_key_usage.discard(key_id)
+
+
+class ApiKeyUsageTracker:
+    """Collects last_used_at per API key in memory and writes them in one
+    statement every flush interval, so authentication never commits."""
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker,
+        flush_interval_seconds: float = API_KEY_USAGE_FLUSH_INTERVAL_SECONDS
+    ):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval_seconds
+        self._last_used: Dict[int, datetime] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+
+    def record(self, key_id: int) -> None:
+        self._last_used[key_id] = datetime.utcnow()
+
+    def discard(self, key_id: int) -> None:
+        self._last_used.pop(key_id, None)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._stopping = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def flush(self) -> int:
+        pending, self._last_used = self._last_used, {}
+        if not pending:
+            return 0
+
+        try:
+            async with self.session_factory() as db:
+                # Core executemany: keys deleted since they were used simply match no row
+                api_keys = ApiKey.__table__
+                await db.execute(
+                    update(api_keys)
+                    .where(api_keys.c.id == bindparam("key_id"))
+                    .values(last_used_at=bindparam("used_at")),
+                    [{"key_id": key_id, "used_at": used_at} for key_id, used_at in pending.items()]
+                )
+                await db.commit()
+        except Exception:
+            logger.exception(f"Failed to record usage of {len(pending)} API keys")
+            # Keep the newest timestamps for the next attempt
+            for key_id, used_at in pending.items():
+                if self._last_used.get(key_id, used_at) <= used_at:
+                    self._last_used[key_id] = used_at
+            return 0
+        return len(pending)
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+
+api_key_usage = ApiKeyUsageTracker(AsyncSessionLocal)
+
+
+def record_api_key_use(key_id: int) -> None:
+    api_key_usage.record(key_id)
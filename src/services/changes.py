@@ -0,0 +1,129 @@
+"""In-process log of configuration changes, pushed to SDKs by the change stream.
+
+Writes in ``services/experiments.py`` and ``services/segments.py`` record a
+compact delta here once committed. Every subscriber waits on the same event,
+so one write wakes all connected clients at once and each reads its deltas
+from the ring buffer without touching the database.
+"""
+from src.schemas.experiments import ChangesResponse
+from dataclasses import dataclass, field
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional
+import asyncio
+import itertools
+import json
+import os
+import time
+
+CHANGE_LOG_SIZE = int(os.getenv("CHANGE_LOG_SIZE", "1000"))
+CHANGE_STREAM_HEARTBEAT_SECONDS = float(os.getenv("CHANGE_STREAM_HEARTBEAT_SECONDS", "15"))
+
+
+@dataclass(frozen=True)
+class Change:
+    version: int
+    type: str
+    data: Dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"version": self.version, "type": self.type, "data": self.data}
+
+
+class ChangeLog:
+    def __init__(self, max_size: int = CHANGE_LOG_SIZE):
+        self._changes: Deque[Change] = deque(maxlen=max_size)
+        # Versions start from the boot time in milliseconds, so they keep increasing across
+        # restarts and a version from before a restart is simply too old to replay
+        self.version = int(time.time() * 1000)
+        self._appended: Optional[asyncio.Event] = None
+
+    def reset(self) -> None:
+        self._changes.clear()
+        self._appended = None
+
+    def record(self, type: str, data: Dict[str, Any]) -> Change:
+        self.version += 1
+        change = Change(self.version, type, data)
+        self._changes.append(change)
+        if self._appended is not None:
+            self._appended.set()
+            self._appended = None
+        return change
+
+    def since(self, version: int) -> Optional[List[Change]]:
+        """Changes after ``version``, or None if they are no longer (or never were) in the log."""
+        if version > self.version:
+            return None
+        if version == self.version:
+            return []
+        if not self._changes or self._changes[0].version > version + 1:
+            return None
+        # Versions in the log are consecutive, so the first change to send is at a known offset
+        return list(itertools.islice(self._changes, version + 1 - self._changes[0].version, None))
+
+    async def wait(self, version: int, timeout: float) -> Optional[List[Change]]:
+        """Like ``since``, but waits up to ``timeout`` seconds for a change after ``version``."""
+        if version == self.version:
+            if self._appended is None:
+                self._appended = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._appended.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.since(version)
+
+
+change_log = ChangeLog()
+
+
+def record_change(type: str, data: Dict[str, Any]) -> Change:
+    return change_log.record(type, data)
+
+
+async def poll_changes(since: Optional[int], timeout: float) -> ChangesResponse:
+    if since is None:
+        return ChangesResponse(version=change_log.version, reset=True)
+    changes = await change_log.wait(since, timeout)
+    if changes is None:
+        return ChangesResponse(version=change_log.version, reset=True)
+    return ChangesResponse(
+        version=changes[-1].version if changes else since,
+        changes=[change.to_dict() for change in changes]
+    )
+
+
+def sse_event(event: str, data: Dict[str, Any], event_id: Optional[int] = None) -> bytes:
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event}", f"data: {json.dumps(data, separators=(',', ':'))}"]
+    return ("\n".join(lines) + "\n\n").encode()
+
+
+async def stream_changes(
+    since: Optional[int],
+    log: Optional[ChangeLog] = None,
+    heartbeat_seconds: float = CHANGE_STREAM_HEARTBEAT_SECONDS
+) -> AsyncIterator[bytes]:
+    """Server-sent events for every change after ``since``.
+
+    Without ``since``, or when the client is too far behind for the log to
+    replay, a ``reset`` event carrying the current version is sent first; the
+    client should then refetch the full configuration.
+    """
+    log = log or change_log
+    version = log.version if since is None else since
+    if since is None or log.since(since) is None:
+        version = log.version
+        yield sse_event("reset", {"version": version}, version)
+
+    while True:
+        changes = await log.wait(version, heartbeat_seconds)
+        if changes is None:
+            version = log.version
+            yield sse_event("reset", {"version": version}, version)
+        elif not changes:
+            # Comment line: keeps proxies from closing an idle connection
+            yield b": keep-alive\n\n"
+        else:
+            for change in changes:
+                yield sse_event("change", change.to_dict(), change.version)
+            version = changes[-1].version
@@ -0,0 +1,99 @@
+"""Serialized configuration bundle for clients that assign variants locally.
+
+The bundle carries everything ``ExperimentConfig`` uses to decide a user's
+variant: each experiment's variants and cumulative boundaries (or bucket
+ranges), the rules of the segments it targets and the hashing parameters of
+``hash_bucket``. It is built once per config version and kept as ready-to-send
+JSON and gzip bytes.
+"""
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+from src.models import Experiment, ExperimentSegment, Segment
+from .config_snapshot import VersionedStore
+from .utils import BUCKET_COUNT, RANGED_BUCKET_COUNT, cumulative_boundaries
+from dataclasses import dataclass
+from typing import Any, Dict
+import gzip
+import hashlib
+import json
+
+BUNDLE_FORMAT = 1
+
+# Mirrors hash_bucket: int(sha256(f"{user_id}:{experiment_id}").hexdigest()[:8], 16) % bucket_count
+HASHING = {
+    "algorithm": "sha256",
+    "input": "{user_id}:{experiment_id}",
+    "hex_prefix_length": 8,
+    "bucket_count": BUCKET_COUNT,
+    "ranged_bucket_count": RANGED_BUCKET_COUNT,
+}
+
+
+@dataclass(frozen=True)
+class ConfigBundle:
+    config_version: int
+    etag: str
+    body: bytes
+    gzipped: bytes
+
+
+async def build_bundle_document(db: AsyncSession) -> Dict[str, Any]:
+    result = await db.execute(select(Experiment).options(selectinload(Experiment.variants)).order_by(Experiment.id))
+    experiments = result.scalars().all()
+
+    result = await db.execute(select(ExperimentSegment.experiment_id, ExperimentSegment.segment_id))
+    segment_ids_by_experiment: Dict[int, list] = {}
+    for experiment_id, segment_id in result.all():
+        segment_ids_by_experiment.setdefault(experiment_id, []).append(segment_id)
+
+    targeted = {segment_id for segment_ids in segment_ids_by_experiment.values() for segment_id in segment_ids}
+    result = await db.execute(
+        select(Segment.id, Segment.name, Segment.rules).filter(Segment.id.in_(targeted)).order_by(Segment.id)
+    )
+    segments = [{"id": segment_id, "name": name, "rules": rules} for segment_id, name, rules in result.all()]
+
+    documents = []
+    for experiment in experiments:
+        variant_ids, boundaries = cumulative_boundaries(experiment.variants)
+        variants = {variant.id: variant for variant in experiment.variants}
+        documents.append({
+            "id": experiment.id,
+            "name": experiment.name,
+            "status": experiment.status.value,
+            "bucketing": experiment.bucketing.value,
+            # In ID order, matching boundaries
+            "variants": [
+                {
+                    "id": variant_id,
+                    "name": variants[variant_id].name,
+                    "bucket_ranges": variants[variant_id].bucket_ranges,
+                }
+                for variant_id in variant_ids
+            ],
+            "boundaries": list(boundaries),
+            "segment_ids": sorted(segment_ids_by_experiment.get(experiment.id, ())),
+        })
+
+    return {"format": BUNDLE_FORMAT, "hashing": HASHING, "experiments": documents, "segments": segments}
+
+
+async def build_config_bundle(db: AsyncSession, config_version: int) -> ConfigBundle:
+    document = await build_bundle_document(db)
+    content = json.dumps(document, separators=(",", ":"), sort_keys=True)
+    # Derived from the content, so every process serving the same config agrees on it
+    version = hashlib.sha256(content.encode()).hexdigest()[:16]
+    body = json.dumps({"version": version, **document}, separators=(",", ":"), sort_keys=True).encode()
+    return ConfigBundle(
+        config_version=config_version,
+        etag=f'"{version}"',
+        body=body,
+        gzipped=gzip.compress(body, mtime=0)
+    )
+
+
+config_bundle_store: VersionedStore[ConfigBundle] = VersionedStore(build_config_bundle)
+
+
+async def get_config_bundle(db: AsyncSession) -> ConfigBundle:
+    return await config_bundle_store.get(db)
@@ -0,0 +1,166 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+from src.models import Experiment, ExperimentSegment, ExperimentStatus, BucketingMode, Segment
+from src.cache import compiled_rules_cache, get_config_version
+from .rules import Predicate, RuleError, compile_rules
+from .utils import RANGED_BUCKET_COUNT, build_bucket_lookup, cumulative_boundaries, hash_bucket, pick_variant
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Awaitable, Callable, Dict, Generic, Mapping, Optional, Tuple, TypeVar
+import logging
+import numpy as np
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on how long a snapshot is trusted, for writes made by other processes
+CONFIG_SNAPSHOT_TTL_SECONDS = float(os.getenv("CONFIG_SNAPSHOT_TTL_SECONDS", "30"))
+
+T = TypeVar("T")
+
+
+def get_compiled_rules(segment_id: int, rules_version: int, rules: Optional[Dict[str, Any]]) -> Optional[Predicate]:
+    entry = compiled_rules_cache.get(segment_id)
+    if entry is None or entry[0] != rules_version:
+        try:
+            predicate = compile_rules(rules)
+        except RuleError as e:
+            # Rules saved before validation existed; like the old equality check, they never match
+            logger.warning(f"Segment {segment_id} has invalid rules ({e}); it only matches assigned users")
+            predicate = None
+        entry = (rules_version, predicate)
+        compiled_rules_cache[segment_id] = entry
+    return entry[1]
+
+
+@dataclass(frozen=True)
+class SegmentConfig:
+    id: int
+    rules_predicate: Optional[Predicate]
+    # Rule matches are in rule_segment_members for the current rules
+    materialized: bool = False
+
+    def matches(self, user, user_segment_ids) -> bool:
+        if self.id in user_segment_ids:
+            return True
+        if self.materialized:
+            return False
+        return self.rules_predicate is not None and self.rules_predicate(user)
+
+
+@dataclass(frozen=True)
+class ExperimentConfig:
+    id: int
+    status: ExperimentStatus
+    variant_ids: Tuple[int, ...]
+    boundaries: Tuple[float, ...]
+    segments: Tuple[SegmentConfig, ...]
+    # Ranged bucketing only: read-only bucket -> variant ID array, 0 where unallocated
+    bucket_lookup: Optional[np.ndarray] = None
+
+    def is_eligible(self, user, user_segment_ids) -> bool:
+        # Experiments without segments are open to everyone
+        if not self.segments:
+            return True
+        return any(segment.matches(user, user_segment_ids) for segment in self.segments)
+
+    def assign_variant(self, user_id: str) -> Optional[int]:
+        if self.bucket_lookup is not None:
+            # Users in unallocated buckets stay out of the experiment
+            return int(self.bucket_lookup[hash_bucket(user_id, self.id, RANGED_BUCKET_COUNT)]) or None
+        return pick_variant(hash_bucket(user_id, self.id), self.variant_ids, self.boundaries)
+
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    version: int
+    experiments: Mapping[int, ExperimentConfig]
+
+
+async def build_config_snapshot(db: AsyncSession, version: int) -> ConfigSnapshot:
+    result = await db.execute(select(Experiment).options(selectinload(Experiment.variants)))
+    experiments = result.scalars().all()
+
+    result = await db.execute(select(ExperimentSegment.experiment_id, ExperimentSegment.segment_id))
+    segment_ids_by_experiment: Dict[int, list] = {}
+    for experiment_id, segment_id in result.all():
+        segment_ids_by_experiment.setdefault(experiment_id, []).append(segment_id)
+
+    result = await db.execute(
+        select(Segment.id, Segment.rules, Segment.rules_version, Segment.materialized_version)
+    )
+    segments = {
+        segment_id: SegmentConfig(
+            id=segment_id,
+            rules_predicate=get_compiled_rules(segment_id, rules_version, rules),
+            materialized=materialized_version == rules_version
+        )
+        for segment_id, rules, rules_version, materialized_version in result.all()
+    }
+
+    configs = {}
+    for experiment in experiments:
+        variant_ids, boundaries = cumulative_boundaries(experiment.variants)
+        bucket_lookup = None
+        if experiment.bucketing == BucketingMode.RANGED:
+            bucket_lookup = build_bucket_lookup((v.id, v.bucket_ranges) for v in experiment.variants)
+        configs[experiment.id] = ExperimentConfig(
+            id=experiment.id,
+            status=experiment.status,
+            variant_ids=variant_ids,
+            boundaries=boundaries,
+            segments=tuple(
+                segments[segment_id]
+                for segment_id in sorted(segment_ids_by_experiment.get(experiment.id, ()))
+                if segment_id in segments
+            ),
+            bucket_lookup=bucket_lookup
+        )
+
+    return ConfigSnapshot(version=version, experiments=MappingProxyType(configs))
+
+
+class VersionedStore(Generic[T]):
+    """Holds the value ``build(db, version)`` made for the current config version.
+
+    It is rebuilt once ``bump_config_version`` moves the version on, and at
+    least every ``ttl_seconds`` to pick up writes made by other processes.
+    """
+
+    def __init__(
+        self,
+        build: Callable[[AsyncSession, int], Awaitable[T]],
+        ttl_seconds: float = CONFIG_SNAPSHOT_TTL_SECONDS
+    ):
+        self.build = build
+        self.ttl_seconds = ttl_seconds
+        self._value: Optional[T] = None
+        self._version: Optional[int] = None
+        self._built_at = 0.0
+
+    def is_current(self) -> bool:
+        return (
+            self._value is not None
+            and self._version == get_config_version()
+            and time.monotonic() - self._built_at < self.ttl_seconds
+        )
+
+    async def get(self, db: AsyncSession) -> T:
+        if self.is_current():
+            return self._value
+
+        version = get_config_version()
+        value = await self.build(db, version)
+        # Don't publish a value that a concurrent write has already made stale
+        if version == get_config_version():
+            self._value, self._version, self._built_at = value, version, time.monotonic()
+        return value
+
+
+config_snapshot_store: VersionedStore[ConfigSnapshot] = VersionedStore(build_config_snapshot)
+
+
+async def get_config_snapshot(db: AsyncSession) -> ConfigSnapshot:
+    return await config_snapshot_store.get(db)
@@ -0,0 +1,112 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, delete, func
+from sqlalchemy.dialects.sqlite import insert
+from src.models import Event, VariantEventCounter
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+CounterKey = Tuple[int, int, str]
+
+
+def counter_keys(events: Iterable) -> Counter:
+    # Only events attributed to both an experiment and a variant are rolled up
+    return Counter(
+        (event.experiment_id, event.variant_id, event.type)
+        for event in events
+        if event.experiment_id is not None and event.variant_id is not None
+    )
+
+
+async def increment_variant_event_counters(db: AsyncSession, events: Iterable) -> None:
+    increments = counter_keys(events)
+    if not increments:
+        return
+
+    statement = insert(VariantEventCounter)
+    statement = statement.on_conflict_do_update(
+        index_elements=["experiment_id", "variant_id", "event_type"],
+        set_={"count": VariantEventCounter.count + statement.excluded.count}
+    )
+    await db.execute(
+        statement,
+        [
+            {"experiment_id": experiment_id, "variant_id": variant_id, "event_type": event_type, "count": count}
+            for (experiment_id, variant_id, event_type), count in increments.items()
+        ]
+    )
+
+
+async def get_variant_event_counts(
+    db: AsyncSession,
+    experiment_id: int,
+    event_types: List[str]
+) -> Dict[Tuple[int, str], int]:
+    result = await db.execute(
+        select(VariantEventCounter.variant_id, VariantEventCounter.event_type, VariantEventCounter.count)
+        .filter(
+            VariantEventCounter.experiment_id == experiment_id,
+            VariantEventCounter.event_type.in_(event_types)
+        )
+    )
+    return {(variant_id, event_type): count for variant_id, event_type, count in result.all()}
+
+
+def _raw_counts_query(experiment_id: Optional[int] = None):
+    query = (
+        select(Event.experiment_id, Event.variant_id, Event.type, func.count(Event.id))
+        .filter(Event.experiment_id.is_not(None), Event.variant_id.is_not(None))
+        .group_by(Event.experiment_id, Event.variant_id, Event.type)
+    )
+    if experiment_id is not None:
+        query = query.filter(Event.experiment_id == experiment_id)
+    return query
+
+
+async def rebuild_variant_event_counters(db: AsyncSession, experiment_id: Optional[int] = None) -> int:
+    clear = delete(VariantEventCounter)
+    if experiment_id is not None:
+        clear = clear.filter(VariantEventCounter.experiment_id == experiment_id)
+    await db.execute(clear)
+
+    result = await db.execute(
+        insert(VariantEventCounter).from_select(
+            ["experiment_id", "variant_id", "event_type", "count"],
+            _raw_counts_query(experiment_id)
+        )
+    )
+    await db.commit()
+    return result.rowcount
+
+
+async def check_variant_event_counters(db: AsyncSession, experiment_id: Optional[int] = None) -> List[dict]:
+    result = await db.execute(_raw_counts_query(experiment_id))
+    expected: Dict[CounterKey, int] = {
+        (exp_id, variant_id, event_type): count
+        for exp_id, variant_id, event_type, count in result.all()
+    }
+
+    query = select(
+        VariantEventCounter.experiment_id,
+        VariantEventCounter.variant_id,
+        VariantEventCounter.event_type,
+        VariantEventCounter.count
+    )
+    if experiment_id is not None:
+        query = query.filter(VariantEventCounter.experiment_id == experiment_id)
+    result = await db.execute(query)
+    actual: Dict[CounterKey, int] = {
+        (exp_id, variant_id, event_type): count
+        for exp_id, variant_id, event_type, count in result.all()
+    }
+
+    mismatches = []
+    for key in sorted(expected.keys() | actual.keys(), key=str):
+        if expected.get(key, 0) != actual.get(key, 0):
+            mismatches.append({
+                "experiment_id": key[0],
+                "variant_id": key[1],
+                "event_type": key[2],
+                "expected": expected.get(key, 0),
+                "actual": actual.get(key, 0)
+            })
+    return mismatches
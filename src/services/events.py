@@ -1,9 +1,30 @@
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy import select, insert, tuple_, Select
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
 from fastapi import HTTPException
+from src.database import AsyncSessionLocal
 from src.models import User, Event
-from src.schemas.events import EventCreate, EventFilterRequest
-from typing import List, Optional
+from src.schemas.events import (
+    EventCreate, EventFilterRequest, EventResponse, EventsPage, EventBatchItemResult, EventBatchResponse
+)
+from .counters import increment_variant_event_counters
+from .pagination import encode_cursor, decode_cursor, stream_csv, stream_ndjson
+from datetime import datetime
+from collections import deque
+from typing import AsyncIterator, List, Optional, Tuple
+import asyncio
+import logging
+import os
+import random
+import uuid
+
+logger = logging.getLogger(__name__)
+
+EVENT_BUFFER_MAX_SIZE = int(os.getenv("EVENT_BUFFER_MAX_SIZE", "100000"))
+EVENT_BUFFER_FLUSH_INTERVAL_MS = int(os.getenv("EVENT_BUFFER_FLUSH_INTERVAL_MS", "250"))
+EVENT_BUFFER_FLUSH_BATCH_SIZE = int(os.getenv("EVENT_BUFFER_FLUSH_BATCH_SIZE", "1000"))
+EVENT_BUFFER_MAX_RETRY_DELAY_MS = int(os.getenv("EVENT_BUFFER_MAX_RETRY_DELAY_MS", "30000"))
+EVENT_BUFFER_MAX_RETRIES = int(os.getenv("EVENT_BUFFER_MAX_RETRIES", "20"))
 
 
 async def create_event(db: AsyncSession, event_data: EventCreate) -> Event:
@@ -23,18 +44,69 @@ async def create_event(db: AsyncSession, event_data: EventCreate) -> Event:
     )
 
     db.add(db_event)
+    await increment_variant_event_counters(db, [db_event])
 
     await db.commit()
     await db.refresh(db_event)
     return db_event
 
 
-async def get_events(
-    db: AsyncSession,
-    experiment_id: int,
-    filters: EventFilterRequest
-) -> List[Event]:
-    query = select(Event).filter(Event.experiment_id == experiment_id)
+async def create_events_batch(db: AsyncSession, events: List[EventCreate]) -> EventBatchResponse:
+    user_ids = {event.user_id for event in events}
+    result = await db.execute(select(User.id).filter(User.id.in_(user_ids)))
+    known_user_ids = set(result.scalars().all())
+
+    results: List[EventBatchItemResult] = []
+    accepted_events: List[EventCreate] = []
+    rows = []
+    for index, event in enumerate(events):
+        if event.user_id not in known_user_ids:
+            results.append(EventBatchItemResult(index=index, accepted=False, error="User not found"))
+            continue
+
+        accepted_events.append(event)
+        rows.append({
+            "user_id": event.user_id,
+            "experiment_id": event.experiment_id,
+            "variant_id": event.variant_id,
+            "type": event.type,
+            "properties": event.properties
+        })
+        results.append(EventBatchItemResult(index=index, accepted=True))
+
+    if rows:
+        # One multi-row INSERT for the whole batch; ids come back in parameter order
+        result = await db.execute(
+            insert(Event).returning(Event.id, sort_by_parameter_order=True),
+            rows
+        )
+        inserted_ids = iter(result.scalars().all())
+        for item in results:
+            if item.accepted:
+                item.id = next(inserted_ids)
+
+        await increment_variant_event_counters(db, accepted_events)
+        await db.commit()
+
+    accepted = len(rows)
+    return EventBatchResponse(
+        accepted=accepted,
+        rejected=len(events) - accepted,
+        results=results
+    )
+
+
+def build_events_query(experiment_id: int, filters: EventFilterRequest) -> Select:
+    # Keyset order is (timestamp, id), served by ix_events_experiment_timestamp
+    query = (
+        select(Event.__table__)
+        .filter(Event.experiment_id == experiment_id)
+        .order_by(Event.timestamp, Event.id)
+    )
+
+    if filters.after is not None:
+        timestamp, event_id = decode_cursor(filters.after, datetime, int)
+        query = query.filter(tuple_(Event.timestamp, Event.id) > tuple_(timestamp, event_id))
 
     if filters.start_time:
         query = query.filter(Event.timestamp >= filters.start_time)
@@ -51,6 +123,216 @@ async def get_events(
     if filters.user_ids:
         query = query.filter(Event.user_id.in_(filters.user_ids))
 
-    result = await db.execute(query)
-    events = result.scalars().all()
-    return events
+    return query
+
+
+async def get_events(
+    db: AsyncSession,
+    experiment_id: int,
+    filters: EventFilterRequest
+) -> EventsPage:
+    result = await db.execute(build_events_query(experiment_id, filters).limit(filters.limit + 1))
+    rows = result.all()
+    has_more = len(rows) > filters.limit
+    rows = rows[:filters.limit]
+    return EventsPage(
+        events=[EventResponse.model_validate(row) for row in rows],
+        next_after=encode_cursor(rows[-1].timestamp, rows[-1].id) if has_more else None
+    )
+
+
+def export_events(
+    db: AsyncSession,
+    experiment_id: int,
+    filters: EventFilterRequest,
+    format: str = "ndjson"
+) -> AsyncIterator[bytes]:
+    """Every matching event as NDJSON or CSV, read in fixed-size partitions; ``limit`` is ignored."""
+    query = build_events_query(experiment_id, filters)
+    if format == "csv":
+        return stream_csv(db, query, EventResponse)
+    return stream_ndjson(db, query, EventResponse)
+
+
+def is_transient(error: Exception) -> bool:
+    """Whether a failed write may succeed if retried as is (locked or unreachable database)."""
+    if isinstance(error, DBAPIError):
+        return error.connection_invalidated or isinstance(error, (OperationalError, InterfaceError))
+    return isinstance(error, (OSError, asyncio.TimeoutError))
+
+
+class EventBuffer:
+    """Bounded in-process queue of accepted events, written to the database in bulk
+    by a background task every flush interval or once a full batch is waiting.
+
+    Events have already been acknowledged with 202. A batch that fails for a
+    transient reason goes back to the front of the queue and is retried with
+    jittered exponential backoff, up to ``max_retries`` times. A batch that fails
+    for any other reason is split until the events that can never be written are
+    isolated; those are logged as dead letters and the rest are written.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker,
+        max_size: int = EVENT_BUFFER_MAX_SIZE,
+        flush_interval_ms: int = EVENT_BUFFER_FLUSH_INTERVAL_MS,
+        flush_batch_size: int = EVENT_BUFFER_FLUSH_BATCH_SIZE,
+        max_retry_delay_ms: int = EVENT_BUFFER_MAX_RETRY_DELAY_MS,
+        max_retries: int = EVENT_BUFFER_MAX_RETRIES
+    ):
+        self.session_factory = session_factory
+        self.max_size = max_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_batch_size = flush_batch_size
+        self.max_retry_delay = max_retry_delay_ms / 1000
+        self.max_retries = max_retries
+        self.failures = 0
+        self.dead_lettered = 0
+        self._pending: deque[Tuple[str, EventCreate]] = deque()
+        self._batch_ready: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._batch_ready = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        # Let the flusher finish its current batch, then drain whatever is left
+        self._stopping = True
+        if self._task is not None:
+            self._batch_ready.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        if self._pending:
+            logger.error(f"Shutting down with {len(self._pending)} buffered events that could not be written")
+
+    def enqueue(self, event_data: EventCreate) -> str:
+        if self._stopping:
+            raise HTTPException(status_code=503, detail="Event buffer is shutting down")
+
+        if len(self._pending) >= self.max_size:
+            raise HTTPException(status_code=429, detail="Event buffer is full, retry later")
+
+        self.start()
+
+        ingestion_id = uuid.uuid4().hex
+        self._pending.append((ingestion_id, event_data))
+        # While backing off after a failed write, only stop() wakes the flusher early
+        if len(self._pending) >= self.flush_batch_size and not self.failures:
+            self._batch_ready.set()
+        return ingestion_id
+
+    async def flush(self) -> int:
+        """Write queued events in batches; stops at the first transient failure, which stays queued."""
+        written = 0
+        while self._pending:
+            batch = [
+                self._pending.popleft()
+                for _ in range(min(self.flush_batch_size, len(self._pending)))
+            ]
+            try:
+                written += await self._write(batch)
+            except Exception as e:
+                if not is_transient(e):
+                    count, batch = await self._write_apart(batch, e)
+                    written += count
+                    if not batch:
+                        self.failures = 0
+                        continue
+                self.failures += 1
+                if self.failures > self.max_retries:
+                    self._dead_letter(batch, f"still failing after {self.max_retries} retries")
+                    self.failures = 0
+                    continue
+                self._requeue(batch)
+                logger.exception(
+                    f"Failed to flush {len(batch)} buffered events (attempt {self.failures}); "
+                    f"{len(self._pending)} events kept for retry"
+                )
+                break
+            self.failures = 0
+        return written
+
+    async def _write_apart(
+        self,
+        batch: List[Tuple[str, EventCreate]],
+        error: Exception
+    ) -> Tuple[int, List[Tuple[str, EventCreate]]]:
+        """Write a batch that failed for a non-transient reason in ever smaller parts.
+
+        Single events that still fail are dead-lettered. Returns the number of
+        events written and, if a transient failure interrupted the split, the
+        events not yet attempted.
+        """
+        if len(batch) == 1:
+            self._dead_letter(batch, str(error))
+            return 0, []
+
+        logger.warning(f"Splitting a batch of {len(batch)} buffered events that cannot be written as one: {error}")
+        written = 0
+        middle = len(batch) // 2
+        parts = deque([batch[:middle], batch[middle:]])
+        while parts:
+            part = parts.popleft()
+            try:
+                written += await self._write(part)
+            except Exception as e:
+                if is_transient(e):
+                    return written, [event for rest in (part, *parts) for event in rest]
+                if len(part) == 1:
+                    self._dead_letter(part, str(e))
+                else:
+                    middle = len(part) // 2
+                    parts.extendleft([part[middle:], part[:middle]])
+        return written, []
+
+    def _dead_letter(self, batch: List[Tuple[str, EventCreate]], reason: str) -> None:
+        # Logged in full so the events can be replayed once the cause is fixed
+        self.dead_lettered += len(batch)
+        for ingestion_id, event in batch:
+            logger.error(f"Dead-lettered buffered event {ingestion_id} ({reason}): {event.model_dump_json()}")
+
+    def _requeue(self, batch: List[Tuple[str, EventCreate]]) -> None:
+        # Back at the front, in order; enqueue may have filled the queue in the meantime
+        room = max(self.max_size - len(self._pending), 0)
+        self._pending.extendleft(reversed(batch[:room]))
+        for ingestion_id, _ in batch[room:]:
+            logger.error(f"Dropped buffered event {ingestion_id}: event buffer is full")
+
+    def retry_delay(self) -> float:
+        # Full jitter over an exponentially growing cap
+        return random.uniform(0, min(self.max_retry_delay, self.flush_interval * 2 ** self.failures))
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            delay = self.retry_delay() if self.failures else self.flush_interval
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            await self.flush()
+
+    async def _write(self, batch: List[Tuple[str, EventCreate]]) -> int:
+        async with self.session_factory() as db:
+            response = await create_events_batch(db, [event for _, event in batch])
+
+        for item in response.results:
+            if not item.accepted:
+                logger.warning(f"Dropped buffered event {batch[item.index][0]}: {item.error}")
+        return response.accepted
+
+
+event_buffer = EventBuffer(AsyncSessionLocal)
+
+
+def enqueue_event(event_data: EventCreate) -> str:
+    return event_buffer.enqueue(event_data)
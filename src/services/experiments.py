@@ -1,21 +1,41 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, update, tuple_
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.orm import selectinload
 from fastapi import HTTPException
-from src.models import Experiment, Variant, ExperimentSegment, User, UserSegment, UserVariantAssignment
+from src.models import (
+    Experiment, Variant, Segment, ExperimentSegment, User, UserVariantAssignment, BucketingMode
+)
 from src.schemas.experiments import (
     ExperimentCreate, VariantCreate, VariantUpdate,
-    EligibilityCheckRequest, ExperimentVariantInfo
+    EligibilityCheckRequest, ExperimentVariantInfo,
+    ExperimentResponse, ExperimentDetailResponse, VariantResponse
+)
+from .config_snapshot import ConfigSnapshot, get_config_snapshot
+from .segment_index import get_user_segment_ids
+from .changes import record_change
+from .utils import RANGED_BUCKET_COUNT, percent_to_buckets, resize_bucket_ranges
+from src.cache import (
+    cached, cache_stats, experiment_cache, variant_assignment_cache,
+    invalidate_experiment_cache, invalidate_experiment_list_cache,
+    bump_config_version, experiment_tag, segment_tag, user_tag, EXPERIMENT_LIST_TAG
 )
-from .utils import assign_variant_by_hash
-from src.cache import cached, experiment_cache, invalidate_experiment_cache
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+
+_MISSING = object()
+
+# (entity type, id, config_version) of everything a response serializes; the routes' ETag source
+EntityVersions = Tuple[Tuple[str, int, int], ...]
+
+# Users answered entirely from variant_assignment_cache vs. sent to the database
+assignment_cache_stats = cache_stats.setdefault("variant_assignments", {"hits": 0, "misses": 0})
 
 
 async def create_experiment(db: AsyncSession, experiment_data: ExperimentCreate) -> Experiment:
     db_experiment = Experiment(
         name=experiment_data.name,
-        description=experiment_data.description
+        description=experiment_data.description,
+        bucketing=experiment_data.bucketing
     )
     db.add(db_experiment)
     await db.flush()
@@ -23,24 +43,49 @@ async def create_experiment(db: AsyncSession, experiment_data: ExperimentCreate)
     control_variant = Variant(
         experiment_id=db_experiment.id,
         name="control",
-        percent_allocated=100.0
+        percent_allocated=100.0,
+        bucket_ranges=(
+            [[0, RANGED_BUCKET_COUNT]] if experiment_data.bucketing == BucketingMode.RANGED else None
+        )
     )
     db.add(control_variant)
 
     await db.commit()
     await db.refresh(db_experiment)
+
+    invalidate_experiment_list_cache()
+    bump_config_version()
+    record_change("experiment.created", ExperimentResponse.model_validate(db_experiment).model_dump(mode="json"))
+
     return db_experiment
 
 
-@cached(experiment_cache)
-async def get_experiments(db: AsyncSession) -> List[Experiment]:
+@cached(
+    experiment_cache,
+    snapshot=ExperimentResponse,
+    tags=lambda experiments: [EXPERIMENT_LIST_TAG, *(experiment_tag(e.id) for e in experiments)]
+)
+async def get_experiments(db: AsyncSession) -> List[ExperimentResponse]:
     result = await db.execute(select(Experiment))
     experiments = result.scalars().all()
     return experiments
 
 
-@cached(experiment_cache)
-async def get_experiment_by_id(db: AsyncSession, experiment_id: int) -> Experiment:
+@cached(
+    experiment_cache,
+    tags=lambda versions: [EXPERIMENT_LIST_TAG, *(experiment_tag(experiment_id) for _, experiment_id, _ in versions)]
+)
+async def get_experiment_list_versions(db: AsyncSession) -> EntityVersions:
+    result = await db.execute(select(Experiment.id, Experiment.config_version).order_by(Experiment.id))
+    return tuple(("Experiment", experiment_id, version) for experiment_id, version in result.all())
+
+
+@cached(
+    experiment_cache,
+    snapshot=ExperimentDetailResponse,
+    tags=lambda experiment, experiment_id: [experiment_tag(experiment_id), *(segment_tag(s.id) for s in experiment.segments)]
+)
+async def get_experiment_by_id(db: AsyncSession, experiment_id: int) -> ExperimentDetailResponse:
     result = await db.execute(
         select(Experiment)
         .options(selectinload(Experiment.variants))
@@ -56,6 +101,49 @@ async def get_experiment_by_id(db: AsyncSession, experiment_id: int) -> Experime
     return experiment
 
 
+@cached(
+    experiment_cache,
+    tags=lambda versions, experiment_id: [
+        experiment_tag(experiment_id),
+        *(segment_tag(segment_id) for kind, segment_id, _ in versions if kind == "Segment")
+    ]
+)
+async def get_experiment_versions(db: AsyncSession, experiment_id: int) -> EntityVersions:
+    result = await db.execute(
+        select(Experiment.config_version, Segment.id, Segment.config_version)
+        .outerjoin(ExperimentSegment, ExperimentSegment.experiment_id == Experiment.id)
+        .outerjoin(Segment, Segment.id == ExperimentSegment.segment_id)
+        .filter(Experiment.id == experiment_id)
+        .order_by(Segment.id)
+    )
+    rows = result.all()
+    if not rows:
+        raise HTTPException(status_code=404, detail="Experiment not found")
+
+    return (
+        ("Experiment", experiment_id, rows[0][0]),
+        *(("Segment", segment_id, version) for _, segment_id, version in rows if segment_id is not None)
+    )
+
+
+async def bump_experiment_version(db: AsyncSession, experiment_id: int) -> None:
+    await db.execute(
+        update(Experiment)
+        .where(Experiment.id == experiment_id)
+        .values(config_version=Experiment.config_version + 1)
+    )
+
+
+def claim_bucket_ranges(ranges, other_variants: List[Variant], percent_allocated: float) -> List[List[int]]:
+    """A ranged variant's bucket ranges after resizing it to ``percent_allocated``."""
+    other_ranges = [bucket_range for other in other_variants for bucket_range in other.bucket_ranges or ()]
+    try:
+        resized = resize_bucket_ranges(ranges, other_ranges, percent_to_buckets(percent_allocated))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return [list(bucket_range) for bucket_range in resized]
+
+
 async def create_variant(
     db: AsyncSession,
     experiment_id: int,
@@ -76,16 +164,24 @@ async def create_variant(
             detail=f"Total allocation would exceed 100%. Current: {total_allocated}%, Attempting to add: {variant_data.percent_allocated}%"
         )
 
+    bucket_ranges = None
+    if experiment.bucketing == BucketingMode.RANGED:
+        bucket_ranges = claim_bucket_ranges([], existing_variants, variant_data.percent_allocated)
+
     db_variant = Variant(
         experiment_id=experiment_id,
         name=variant_data.name,
-        percent_allocated=variant_data.percent_allocated
+        percent_allocated=variant_data.percent_allocated,
+        bucket_ranges=bucket_ranges
     )
     db.add(db_variant)
+    await bump_experiment_version(db, experiment_id)
     await db.commit()
     await db.refresh(db_variant)
 
     invalidate_experiment_cache(experiment_id)
+    bump_config_version()
+    record_change("variant.created", VariantResponse.model_validate(db_variant).model_dump(mode="json"))
 
     return db_variant
 
@@ -137,113 +233,188 @@ async def update_variant(
                 status_code=400,
                 detail=f"Total allocation would exceed 100%. Current allocation from other variants: {total_allocated}%, Attempting to set: {variant_update.percent_allocated}%"
             )
+        result = await db.execute(select(Experiment.bucketing).filter(Experiment.id == experiment_id))
+        if result.scalar_one() == BucketingMode.RANGED:
+            variant.bucket_ranges = claim_bucket_ranges(
+                variant.bucket_ranges or [], other_variants, variant_update.percent_allocated
+            )
         variant.percent_allocated = variant_update.percent_allocated
 
     if variant_update.enabled is not None:
         variant.enabled = variant_update.enabled
 
+    await bump_experiment_version(db, experiment_id)
     await db.commit()
     await db.refresh(variant)
 
     invalidate_experiment_cache(experiment_id)
+    bump_config_version()
+    record_change("variant.updated", VariantResponse.model_validate(variant).model_dump(mode="json"))
 
     return variant
 
 
-async def check_user_eligibility(
+def get_cached_assignments(user_id: str, experiment_ids: List[int]) -> Optional[Dict[int, Optional[int]]]:
+    """Sticky outcomes for the user from ``variant_assignment_cache``, or None on any miss."""
+    outcomes = {}
+    for experiment_id in experiment_ids:
+        outcome = variant_assignment_cache.get((user_id, experiment_id), _MISSING)
+        if outcome is _MISSING:
+            assignment_cache_stats["misses"] += 1
+            return None
+        outcomes[experiment_id] = outcome
+    assignment_cache_stats["hits"] += 1
+    return outcomes
+
+
+def cache_assignments(snapshot: ConfigSnapshot, user_id: str, outcomes: Dict[int, Optional[int]]) -> None:
+    for experiment_id, variant_id in outcomes.items():
+        tags = [user_tag(user_id)]
+        if variant_id is None:
+            # "Not eligible" depends on the experiment's variants and targeting
+            experiment = snapshot.experiments.get(experiment_id)
+            if experiment is None:
+                tags.append(EXPERIMENT_LIST_TAG)
+            else:
+                tags.append(experiment_tag(experiment_id))
+                tags.extend(segment_tag(segment.id) for segment in experiment.segments)
+        variant_assignment_cache.set((user_id, experiment_id), variant_id, tags)
+
+
+async def assign_users(
     db: AsyncSession,
-    request: EligibilityCheckRequest
-) -> Dict[int, ExperimentVariantInfo]:
-    result = await db.execute(select(User).filter(User.id == request.user_id))
-    user = result.scalar_one_or_none()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    user_ids: List[str],
+    experiment_ids: List[int]
+) -> Tuple[Dict[str, Dict[int, Optional[int]]], List[str]]:
+    result = await db.execute(select(User).filter(User.id.in_(user_ids)))
+    users = {user.id: user for user in result.scalars().all()}
+    missing_user_ids = [user_id for user_id in user_ids if user_id not in users]
 
-    result = await db.execute(
-        select(UserSegment).filter(UserSegment.user_id == request.user_id)
-    )
-    user_segment_ids = {us.segment_id for us in result.scalars().all()}
+    if not users or not experiment_ids:
+        return {user_id: {} for user_id in users}, missing_user_ids
 
-    eligible_experiments = {}
+    found: Dict[str, Dict[int, Optional[int]]] = {
+        user_id: dict.fromkeys(experiment_ids) for user_id in users
+    }
 
-    for experiment_id in request.experiment_ids:
-        # Check if user already has an assignment for this experiment
-        result = await db.execute(
-            select(UserVariantAssignment).filter(
-                UserVariantAssignment.user_id == request.user_id,
-                UserVariantAssignment.experiment_id == experiment_id
-            )
+    result = await db.execute(
+        select(
+            UserVariantAssignment.user_id,
+            UserVariantAssignment.experiment_id,
+            UserVariantAssignment.variant_id
+        ).filter(
+            UserVariantAssignment.user_id.in_(users),
+            UserVariantAssignment.experiment_id.in_(experiment_ids)
         )
-        existing_assignment = result.scalar_one_or_none()
+    )
+    # Users already assigned keep their assignment
+    for user_id, experiment_id, variant_id in result.all():
+        found[user_id][experiment_id] = variant_id
+
+    snapshot = await get_config_snapshot(db)
+    experiments = [
+        snapshot.experiments[experiment_id]
+        for experiment_id in experiment_ids
+        if experiment_id in snapshot.experiments
+    ]
+
+    # Explicit assignments plus materialized rule matches, from the membership index when loaded
+    user_segment_ids = await get_user_segment_ids(
+        db, list(users), {segment.id for experiment in experiments for segment in experiment.segments}
+    )
 
-        if existing_assignment:
-            # User already assigned, return existing assignment
-            eligible_experiments[experiment_id] = ExperimentVariantInfo(variant_id=existing_assignment.variant_id)
-            continue
+    new_assignments = []
+    for user_id, user in users.items():
+        assigned = found[user_id]
+        for experiment in experiments:
+            if assigned[experiment.id] is not None or not experiment.is_eligible(user, user_segment_ids[user_id]):
+                continue
 
-        result = await db.execute(
-            select(Experiment)
-            .options(selectinload(Experiment.variants))
-            .filter(Experiment.id == experiment_id)
-        )
-        experiment = result.scalar_one_or_none()
-        if not experiment:
-            continue
-
-        result = await db.execute(
-            select(ExperimentSegment)
-            .options(selectinload(ExperimentSegment.segment))
-            .filter(ExperimentSegment.experiment_id == experiment_id)
-        )
-        experiment_segments = result.scalars().all()
-
-        if not experiment_segments:
-            variant_id = assign_variant_by_hash(request.user_id, experiment_id, experiment.variants)
+            variant_id = experiment.assign_variant(user_id)
             if variant_id:
-                # Create persistent assignment
-                assignment = UserVariantAssignment(
-                    user_id=request.user_id,
-                    experiment_id=experiment_id,
-                    variant_id=variant_id
+                assigned[experiment.id] = variant_id
+                new_assignments.append(
+                    {"user_id": user_id, "experiment_id": experiment.id, "variant_id": variant_id}
                 )
-                db.add(assignment)
-                eligible_experiments[experiment_id] = ExperimentVariantInfo(variant_id=variant_id)
-            continue
 
-        is_eligible = False
-        for exp_segment in experiment_segments:
-            segment = exp_segment.segment
+    if new_assignments:
+        result = await db.execute(
+            insert(UserVariantAssignment)
+            .on_conflict_do_nothing(index_elements=["user_id", "experiment_id"])
+            .returning(UserVariantAssignment.user_id, UserVariantAssignment.experiment_id),
+            new_assignments
+        )
+        inserted = set(result.tuples().all())
+        # A concurrent check persisted these first; report the stored variant, not ours
+        conflicts = [
+            (row["user_id"], row["experiment_id"]) for row in new_assignments
+            if (row["user_id"], row["experiment_id"]) not in inserted
+        ]
+        if conflicts:
+            result = await db.execute(
+                select(
+                    UserVariantAssignment.user_id,
+                    UserVariantAssignment.experiment_id,
+                    UserVariantAssignment.variant_id
+                ).filter(tuple_(UserVariantAssignment.user_id, UserVariantAssignment.experiment_id).in_(conflicts))
+            )
+            for user_id, experiment_id, variant_id in result.all():
+                found[user_id][experiment_id] = variant_id
+        await db.commit()
 
-            if segment.id in user_segment_ids:
-                is_eligible = True
-                break
+    for user_id, outcomes in found.items():
+        cache_assignments(snapshot, user_id, outcomes)
 
-            if segment.rules:
-                matches_rules = True
-                for rule_key, rule_value in segment.rules.items():
-                    user_value = getattr(user, rule_key, None)
+    return found, missing_user_ids
 
-                    if user_value != rule_value:
-                        matches_rules = False
-                        break
 
-                if matches_rules:
-                    is_eligible = True
-                    break
+async def check_users_eligibility(
+    db: AsyncSession,
+    user_ids: List[str],
+    experiment_ids: List[int]
+) -> Tuple[Dict[str, Dict[int, ExperimentVariantInfo]], List[str]]:
+    """Assign every user to every experiment they are eligible for.
+
+    Returns the assignments per user and the IDs of users that don't exist.
+    Outcomes are read from ``variant_assignment_cache`` first; users with any
+    miss go through a fixed number of set-based queries plus one bulk insert,
+    however many users and experiments are requested.
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    experiment_ids = list(dict.fromkeys(experiment_ids))
+
+    found: Dict[str, Dict[int, Optional[int]]] = {}
+    pending_user_ids = []
+    for user_id in user_ids:
+        outcomes = get_cached_assignments(user_id, experiment_ids) if experiment_ids else None
+        if outcomes is None:
+            pending_user_ids.append(user_id)
+        else:
+            found[user_id] = outcomes
+
+    missing_user_ids = []
+    if pending_user_ids:
+        computed, missing_user_ids = await assign_users(db, pending_user_ids, experiment_ids)
+        found.update(computed)
+
+    assignments = {
+        user_id: {
+            experiment_id: ExperimentVariantInfo(variant_id=variant_id)
+            for experiment_id, variant_id in found[user_id].items()
+            if variant_id is not None
+        }
+        for user_id in user_ids
+        if user_id in found
+    }
+    return assignments, missing_user_ids
 
-        if is_eligible:
-            variant_id = assign_variant_by_hash(request.user_id, experiment_id, experiment.variants)
-            if variant_id:
-                # Create persistent assignment
-                assignment = UserVariantAssignment(
-                    user_id=request.user_id,
-                    experiment_id=experiment_id,
-                    variant_id=variant_id
-                )
-                db.add(assignment)
-                eligible_experiments[experiment_id] = ExperimentVariantInfo(variant_id=variant_id)
 
-    # Commit all new assignments
-    await db.commit()
+async def check_user_eligibility(
+    db: AsyncSession,
+    request: EligibilityCheckRequest
+) -> Dict[int, ExperimentVariantInfo]:
+    assignments, missing_user_ids = await check_users_eligibility(db, [request.user_id], request.experiment_ids)
+    if missing_user_ids:
+        raise HTTPException(status_code=404, detail="User not found")
 
-    return eligible_experiments
+    return assignments[request.user_id]
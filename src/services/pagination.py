@@ -0,0 +1,83 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+from fastapi import HTTPException
+from pydantic import BaseModel
+from datetime import datetime
+from typing import Any, AsyncIterator, Sequence, Type
+import base64
+import binascii
+import csv
+import io
+import json
+
+# Rows fetched per round trip when streaming a result from a server-side cursor
+STREAM_PARTITION_SIZE = 1000
+
+
+def encode_cursor(*values: Any) -> str:
+    """Opaque keyset cursor for the sort key of the last row on a page."""
+    payload = json.dumps([value.isoformat() if isinstance(value, datetime) else value for value in values])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, *types: type) -> tuple:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError
+        return tuple(
+            datetime.fromisoformat(value) if kind is datetime else kind(value)
+            for value, kind in zip(values, types)
+        )
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def stream_partitions(
+    db: AsyncSession,
+    query: Select,
+    partition_size: int = STREAM_PARTITION_SIZE
+) -> AsyncIterator[Sequence]:
+    """Rows of ``query`` from a server-side cursor, ``partition_size`` at a time.
+
+    Used as the body of a streaming response, which outlives the request's
+    dependencies, so the session is closed here once the stream ends.
+    """
+    try:
+        result = await db.stream(query.execution_options(yield_per=partition_size))
+        async for rows in result.partitions():
+            yield rows
+    finally:
+        await db.close()
+
+
+async def stream_ndjson(
+    db: AsyncSession,
+    query: Select,
+    schema: Type[BaseModel],
+    partition_size: int = STREAM_PARTITION_SIZE
+) -> AsyncIterator[bytes]:
+    # One chunk per partition: rows are serialized and dropped before the next fetch
+    async for rows in stream_partitions(db, query, partition_size):
+        yield "".join(schema.model_validate(row).model_dump_json() + "\n" for row in rows).encode()
+
+
+async def stream_csv(
+    db: AsyncSession,
+    query: Select,
+    schema: Type[BaseModel],
+    partition_size: int = STREAM_PARTITION_SIZE
+) -> AsyncIterator[bytes]:
+    """Rows as CSV with a header of the schema's fields; nested values are JSON-encoded."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(schema.model_fields)
+    yield buffer.getvalue().encode()
+
+    async for rows in stream_partitions(db, query, partition_size):
+        buffer.seek(0)
+        buffer.truncate()
+        for row in rows:
+            values = schema.model_validate(row).model_dump(mode="json").values()
+            writer.writerow(json.dumps(value) if isinstance(value, (dict, list)) else value for value in values)
+        yield buffer.getvalue().encode()
@@ -0,0 +1,206 @@
+"""Segment rule compiler.
+
+``Segment.rules`` is a JSON object matched against user attributes::
+
+    {"country_code": "US"}                                  equality (the original form)
+    {"country_code": {"in": ["US", "CA"]}}                  membership
+    {"created_at": {"gte": "2024-01-01", "lt": "2025-01-01"}}  ranges
+    {"not": {"is_premium": true}}                           negation
+    {"or": [{"country_code": "US"}, {"is_premium": true}]}  boolean combinators
+
+Keys of one object are combined with AND. Operator objects accept ``eq``,
+``ne``, ``in``, ``not_in``, ``gt``, ``gte``, ``lt`` and ``lte``; several
+operators on one attribute must all hold. Comparisons against a missing value
+or a value of another type never match.
+
+``compile_rules`` builds a predicate for one user; ``rules_to_clause`` builds
+the equivalent WHERE clause over the users table for set-based evaluation.
+"""
+from sqlalchemy import DateTime, and_, or_, not_, true, false
+from sqlalchemy.sql.elements import ColumnElement
+from src.models import User
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Optional
+import operator
+
+Predicate = Callable[[Any], bool]
+
+COMBINATORS = ("and", "or", "not")
+
+COMPARISONS = {
+    "eq": operator.eq,
+    "ne": operator.ne,
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+}
+MEMBERSHIP = ("in", "not_in")
+
+
+class RuleError(ValueError):
+    pass
+
+
+def coerce_operand(attribute: str, value: Any) -> Any:
+    # JSON has no dates; compare DateTime columns against ISO 8601 strings
+    column = User.__table__.columns.get(attribute)
+    if column is not None and isinstance(column.type, DateTime) and isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            raise RuleError(f"'{attribute}' expects an ISO 8601 datetime, got '{value}'")
+    return value
+
+
+def compile_comparison(attribute: str, op: str, operand: Any) -> Predicate:
+    if op in MEMBERSHIP:
+        if not isinstance(operand, list):
+            raise RuleError(f"'{op}' on '{attribute}' expects a list")
+        try:
+            values = frozenset(coerce_operand(attribute, value) for value in operand)
+        except TypeError:
+            raise RuleError(f"'{op}' on '{attribute}' expects a list of scalar values")
+        if op == "in":
+            return lambda user: getattr(user, attribute, None) in values
+        return lambda user: getattr(user, attribute, None) not in values
+
+    compare = COMPARISONS.get(op)
+    if compare is None:
+        raise RuleError(f"Unknown operator '{op}' on '{attribute}'")
+    if isinstance(operand, (dict, list)):
+        raise RuleError(f"'{op}' on '{attribute}' expects a scalar value")
+    operand = coerce_operand(attribute, operand)
+
+    if op in ("eq", "ne"):
+        return lambda user: compare(getattr(user, attribute, None), operand)
+
+    def predicate(user) -> bool:
+        value = getattr(user, attribute, None)
+        if value is None:
+            return False
+        try:
+            return compare(value, operand)
+        except TypeError:
+            return False
+
+    return predicate
+
+
+def compile_attribute(attribute: str, condition: Any) -> Predicate:
+    if not isinstance(condition, dict):
+        return compile_comparison(attribute, "eq", condition)
+    if not condition:
+        raise RuleError(f"Empty condition on '{attribute}'")
+    return all_of([compile_comparison(attribute, op, operand) for op, operand in condition.items()])
+
+
+def compile_node(node: Any) -> Predicate:
+    if not isinstance(node, dict):
+        raise RuleError("Rules must be a JSON object")
+
+    predicates = []
+    for key, value in node.items():
+        if key == "not":
+            inner = compile_node(value)
+            predicates.append(lambda user, inner=inner: not inner(user))
+        elif key in ("and", "or"):
+            if not isinstance(value, list) or not value:
+                raise RuleError(f"'{key}' expects a non-empty list of rules")
+            children = [compile_node(child) for child in value]
+            predicates.append(all_of(children) if key == "and" else any_of(children))
+        else:
+            predicates.append(compile_attribute(key, value))
+    return all_of(predicates)
+
+
+def all_of(predicates) -> Predicate:
+    if len(predicates) == 1:
+        return predicates[0]
+    predicates = tuple(predicates)
+    return lambda user: all(predicate(user) for predicate in predicates)
+
+
+def any_of(predicates) -> Predicate:
+    if len(predicates) == 1:
+        return predicates[0]
+    predicates = tuple(predicates)
+    return lambda user: any(predicate(user) for predicate in predicates)
+
+
+def compile_rules(rules: Optional[Dict[str, Any]]) -> Optional[Predicate]:
+    """Compile segment rules into a predicate over a user.
+
+    Segments without rules only match their explicitly assigned users (``None``).
+    Raises ``RuleError`` for malformed rules.
+    """
+    if not rules:
+        return None
+    return compile_node(rules)
+
+
+def comparable(column, operand: Any) -> bool:
+    # SQLite compares across storage classes where Python would not match (or would raise)
+    python_type = column.type.python_type
+    if isinstance(operand, (int, float)):
+        return issubclass(python_type, (int, float))
+    return isinstance(operand, python_type)
+
+
+def clause_comparison(attribute: str, op: str, operand: Any) -> ColumnElement:
+    column = User.__table__.columns.get(attribute)
+    if column is None:
+        # Not a user column: the attribute is always missing, so the result is constant
+        return true() if compile_comparison(attribute, op, operand)(SimpleNamespace()) else false()
+
+    # Written so the clause is never NULL, keeping NOT and OR in line with the predicate
+    if op in MEMBERSHIP:
+        values = [coerce_operand(attribute, value) for value in operand]
+        present = [value for value in values if value is not None and comparable(column, value)]
+        clause = and_(column.is_not(None), column.in_(present))
+        if None in values:
+            clause = or_(column.is_(None), clause)
+        return clause if op == "in" else not_(clause)
+
+    operand = coerce_operand(attribute, operand)
+    if operand is not None and not comparable(column, operand):
+        return true() if op == "ne" else false()
+    if op == "eq":
+        return column.is_not_distinct_from(operand)
+    if op == "ne":
+        return column.is_distinct_from(operand)
+    if operand is None:
+        return false()
+    return and_(column.is_not(None), COMPARISONS[op](column, operand))
+
+
+def clause_attribute(attribute: str, condition: Any) -> ColumnElement:
+    if not isinstance(condition, dict):
+        return clause_comparison(attribute, "eq", condition)
+    return and_(*(clause_comparison(attribute, op, operand) for op, operand in condition.items()))
+
+
+def clause_node(node: Dict[str, Any]) -> ColumnElement:
+    clauses = []
+    for key, value in node.items():
+        if key == "not":
+            clauses.append(not_(clause_node(value)))
+        elif key == "and":
+            clauses.append(and_(*(clause_node(child) for child in value)))
+        elif key == "or":
+            clauses.append(or_(*(clause_node(child) for child in value)))
+        else:
+            clauses.append(clause_attribute(key, value))
+    return and_(*clauses)
+
+
+def rules_to_clause(rules: Optional[Dict[str, Any]]) -> Optional[ColumnElement]:
+    """The WHERE clause over ``users`` matching the same users as ``compile_rules``.
+
+    Returns ``None`` for segments without rules. Raises ``RuleError`` for
+    malformed rules.
+    """
+    if compile_rules(rules) is None:
+        return None
+    return clause_node(rules)
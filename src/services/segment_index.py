@@ -0,0 +1,387 @@
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy import select, update, func, union
+from src.database import AsyncSessionLocal
+from src.models import UserSegment, RuleSegmentMember, MembershipVersion
+from src.bitmap import Bitmap
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+import asyncio
+import logging
+import numpy as np
+import os
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_INDEX_SNAPSHOT_PATH = os.getenv("SEGMENT_INDEX_SNAPSHOT_PATH", "./data/segment_index.npz")
+SEGMENT_INDEX_REFRESH_INTERVAL_SECONDS = float(os.getenv("SEGMENT_INDEX_REFRESH_INTERVAL_SECONDS", "60"))
+
+# membership_version.version: triggers bump it in the same transaction as every
+# write to user_segments and rule_segment_members, from any process
+Watermark = int
+# Watermarks read at the start and end of one write transaction; every bump in
+# between was made by that transaction
+WatermarkRange = Tuple[Watermark, Watermark]
+
+EXPLICIT = "explicit"
+RULES = "rules"
+
+
+async def get_membership_watermark(db: AsyncSession) -> Watermark:
+    result = await db.execute(select(MembershipVersion.version).filter(MembershipVersion.id == 1))
+    return result.scalar_one_or_none() or 0
+
+
+async def lock_membership_watermark(db: AsyncSession) -> Watermark:
+    """The watermark, read by a no-op write so the transaction holds the write lock from here on.
+
+    Call before a transaction's membership writes; with ``get_membership_watermark``
+    just before the commit, the two bound exactly that transaction's bumps.
+    """
+    result = await db.execute(
+        update(MembershipVersion)
+        .where(MembershipVersion.id == 1)
+        .values(version=MembershipVersion.version)
+        .returning(MembershipVersion.version)
+    )
+    return result.scalar_one_or_none() or 0
+
+
+class SegmentMembershipIndex:
+    """Segment membership as compressed bitmaps over dense user ordinals.
+
+    Explicit assignments (``user_segments``) and materialized rule matches
+    (``rule_segment_members``) are kept in separate bitmaps so either can
+    change without touching the other; a user is a member if they are in either.
+    """
+
+    def __init__(self, user_ids: Iterable[str] = (), watermark: Optional[Watermark] = None):
+        self.user_ids: List[str] = list(user_ids)
+        self.ordinals: Dict[str, int] = {user_id: i for i, user_id in enumerate(self.user_ids)}
+        self.bitmaps: Dict[str, Dict[int, Bitmap]] = {EXPLICIT: {}, RULES: {}}
+        self.watermark = watermark
+
+    def ordinal(self, user_id: str) -> int:
+        ordinal = self.ordinals.get(user_id)
+        if ordinal is None:
+            ordinal = self.ordinals[user_id] = len(self.user_ids)
+            self.user_ids.append(user_id)
+        return ordinal
+
+    def ordinals_of(self, user_ids: Iterable[str]) -> np.ndarray:
+        return np.fromiter((self.ordinal(user_id) for user_id in user_ids), dtype=np.int64)
+
+    def add(self, kind: str, segment_id: int, user_ids: Iterable[str]) -> None:
+        ordinals = self.ordinals_of(user_ids)
+        bitmap = self.bitmaps[kind].get(segment_id)
+        if bitmap is None:
+            self.bitmaps[kind][segment_id] = Bitmap.from_values(ordinals)
+        else:
+            bitmap.update(ordinals)
+
+    def remove(self, kind: str, segment_id: int, user_ids: Iterable[str]) -> None:
+        bitmap = self.bitmaps[kind].get(segment_id)
+        if bitmap is not None:
+            known = [self.ordinals[user_id] for user_id in user_ids if user_id in self.ordinals]
+            bitmap.difference_update(known)
+
+    def replace(self, kind: str, segment_id: int, user_ids: Iterable[str]) -> None:
+        self.bitmaps[kind][segment_id] = Bitmap.from_values(self.ordinals_of(user_ids))
+
+    def remove_user(self, user_id: str) -> None:
+        ordinal = self.ordinals.get(user_id)
+        if ordinal is None:
+            return
+        for bitmaps in self.bitmaps.values():
+            for bitmap in bitmaps.values():
+                bitmap.discard(ordinal)
+
+    def contains(self, segment_id: int, user_id: str) -> bool:
+        ordinal = self.ordinals.get(user_id)
+        if ordinal is None:
+            return False
+        return any(
+            ordinal in bitmaps[segment_id]
+            for bitmaps in self.bitmaps.values()
+            if segment_id in bitmaps
+        )
+
+    def segments_of(self, user_id: str, segment_ids: Iterable[int]) -> Set[int]:
+        """The subset of ``segment_ids`` the user belongs to."""
+        return {segment_id for segment_id in segment_ids if self.contains(segment_id, user_id)}
+
+    def is_member_of_any(self, user_id: str, segment_ids: Iterable[int]) -> bool:
+        return any(self.contains(segment_id, user_id) for segment_id in segment_ids)
+
+    def members(self, segment_id: int) -> Bitmap:
+        explicit = self.bitmaps[EXPLICIT].get(segment_id) or Bitmap()
+        rules = self.bitmaps[RULES].get(segment_id) or Bitmap()
+        return explicit | rules
+
+    def count(self, segment_id: int) -> int:
+        return len(self.members(segment_id))
+
+    def save(self, path: str) -> None:
+        arrays = {
+            "user_ids": np.array(self.user_ids, dtype=str),
+            "membership_version": np.array([self.watermark or 0], dtype=np.int64),
+        }
+        for kind, bitmaps in self.bitmaps.items():
+            for segment_id, bitmap in bitmaps.items():
+                for part, values in bitmap.serialize().items():
+                    arrays[f"{kind}/{segment_id}/{part}"] = values
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Write then rename so a crash never leaves a truncated snapshot behind
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "SegmentMembershipIndex":
+        with np.load(path, allow_pickle=False) as data:
+            # Snapshots without a membership_version predate the change counter and can't be trusted
+            index = cls(data["user_ids"].tolist(), int(data["membership_version"][0]))
+            parts: Dict[Tuple[str, int], Dict[str, np.ndarray]] = defaultdict(dict)
+            for name in data.files:
+                if name.count("/") == 2:
+                    kind, segment_id, part = name.split("/")
+                    parts[(kind, int(segment_id))][part] = data[name]
+        for (kind, segment_id), bitmap_parts in parts.items():
+            index.bitmaps[kind][segment_id] = Bitmap.deserialize(bitmap_parts)
+        return index
+
+
+async def build_segment_index(db: AsyncSession, partition_size: int = 10000) -> SegmentMembershipIndex:
+    # Read the watermark first: writes racing with the build show up as a change next time
+    index = SegmentMembershipIndex(watermark=await get_membership_watermark(db))
+
+    for kind, model in ((EXPLICIT, UserSegment), (RULES, RuleSegmentMember)):
+        ordinals_by_segment: Dict[int, List[int]] = defaultdict(list)
+        result = await db.stream(select(model.segment_id, model.user_id))
+        async for rows in result.partitions(partition_size):
+            for segment_id, user_id in rows:
+                ordinals_by_segment[segment_id].append(index.ordinal(user_id))
+            # Large builds run in the app's event loop; let requests through between partitions
+            await asyncio.sleep(0)
+        for segment_id, ordinals in ordinals_by_segment.items():
+            index.bitmaps[kind][segment_id] = Bitmap.from_values(np.array(ordinals, dtype=np.int64))
+
+    return index
+
+
+def advancing_watermark(
+    change: Callable[[SegmentMembershipIndex], None],
+    versions: WatermarkRange
+) -> Callable[[SegmentMembershipIndex], None]:
+    before, after = versions
+
+    def apply(index: SegmentMembershipIndex) -> None:
+        change(index)
+        # Only this write happened since the index's watermark, so it is still current.
+        # Otherwise the watermark stays behind and the next refresh rebuilds.
+        if index.watermark == before:
+            index.watermark = after
+
+    return apply
+
+
+class SegmentIndexService:
+    """Owns the process-wide membership index.
+
+    On start it loads the on-disk snapshot if it still matches the database,
+    otherwise builds from the membership tables. Writes made by this process
+    update the index in place and advance its watermark; every refresh
+    interval the watermark is compared with the database so writes from other
+    processes trigger a rebuild, and the snapshot is rewritten. Local writes
+    alone only reach the snapshot on stop.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker,
+        snapshot_path: Optional[str] = SEGMENT_INDEX_SNAPSHOT_PATH,
+        refresh_interval_seconds: float = SEGMENT_INDEX_REFRESH_INTERVAL_SECONDS
+    ):
+        self.session_factory = session_factory
+        self.snapshot_path = snapshot_path
+        self.refresh_interval = refresh_interval_seconds
+        self.index: Optional[SegmentMembershipIndex] = None
+        # Local changes made while a rebuild is reading the tables, replayed on the new index
+        self._replay: Optional[List[Callable[[SegmentMembershipIndex], None]]] = None
+        self._saved_watermark: Optional[Watermark] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.index is not None
+
+    def reset(self) -> None:
+        self.index = None
+        self._replay = None
+        self._saved_watermark = None
+
+    def _apply(
+        self,
+        change: Callable[[SegmentMembershipIndex], None],
+        versions: Optional[WatermarkRange] = None
+    ) -> None:
+        if versions is not None:
+            change = advancing_watermark(change, versions)
+        if self.index is not None:
+            change(self.index)
+        if self._replay is not None:
+            self._replay.append(change)
+
+    def add_explicit(
+        self,
+        segment_id: int,
+        user_ids: Iterable[str],
+        versions: Optional[WatermarkRange] = None
+    ) -> None:
+        user_ids = list(user_ids)
+        self._apply(lambda index: index.add(EXPLICIT, segment_id, user_ids), versions)
+
+    def replace_rule_members(
+        self,
+        segment_id: int,
+        user_ids: Iterable[str],
+        versions: Optional[WatermarkRange] = None
+    ) -> None:
+        user_ids = list(user_ids)
+        self._apply(lambda index: index.replace(RULES, segment_id, user_ids), versions)
+
+    def update_rule_members(
+        self,
+        joined: Iterable[Tuple[int, str]],
+        left: Iterable[Tuple[int, str]],
+        versions: Optional[WatermarkRange] = None
+    ) -> None:
+        joined, left = list(joined), list(left)
+
+        def change(index: SegmentMembershipIndex) -> None:
+            for segment_id, user_id in left:
+                index.remove(RULES, segment_id, [user_id])
+            for segment_id, user_id in joined:
+                index.add(RULES, segment_id, [user_id])
+
+        self._apply(change, versions)
+
+    def remove_user(self, user_id: str, versions: Optional[WatermarkRange] = None) -> None:
+        self._apply(lambda index: index.remove_user(user_id), versions)
+
+    async def rebuild(self, db: AsyncSession) -> SegmentMembershipIndex:
+        self._replay = []
+        try:
+            index = await build_segment_index(db)
+            for change in self._replay:
+                change(index)
+        finally:
+            self._replay = None
+        self.index = index
+        return index
+
+    async def load(self) -> None:
+        async with self.session_factory() as db:
+            watermark = await get_membership_watermark(db)
+            if self.snapshot_path and os.path.exists(self.snapshot_path):
+                try:
+                    snapshot = SegmentMembershipIndex.load(self.snapshot_path)
+                    if snapshot.watermark == watermark:
+                        self.index = snapshot
+                        self._saved_watermark = watermark
+                        logger.info(f"Loaded segment index snapshot from {self.snapshot_path}")
+                        return
+                except Exception:
+                    logger.exception(f"Ignoring unreadable segment index snapshot {self.snapshot_path}")
+            await self.rebuild(db)
+        self.save()
+
+    async def refresh(self) -> bool:
+        """Rebuild if the membership tables changed since the last build; returns whether it did."""
+        async with self.session_factory() as db:
+            watermark = await get_membership_watermark(db)
+            if self.index is not None and watermark == self.index.watermark:
+                return False
+            await self.rebuild(db)
+        self.save()
+        return True
+
+    def save(self) -> None:
+        if not self.snapshot_path or self.index is None or self.index.watermark == self._saved_watermark:
+            return
+        try:
+            self.index.save(self.snapshot_path)
+            self._saved_watermark = self.index.watermark
+        except Exception:
+            logger.exception(f"Failed to write segment index snapshot {self.snapshot_path}")
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._stopping = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+        self.save()
+
+    async def _run(self) -> None:
+        try:
+            await self.load()
+        except Exception:
+            logger.exception("Failed to load the segment index; membership falls back to the database")
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.refresh_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Failed to refresh the segment index")
+
+
+segment_index = SegmentIndexService(AsyncSessionLocal)
+
+
+async def get_user_segment_ids(db: AsyncSession, user_ids: List[str], segment_ids: Iterable[int]) -> Dict[str, Set[int]]:
+    """Which of ``segment_ids`` each user belongs to, explicitly or through materialized rules."""
+    segment_ids = set(segment_ids)
+    memberships: Dict[str, Set[int]] = defaultdict(set)
+    if not segment_ids:
+        return memberships
+
+    if segment_index.ready:
+        for user_id in user_ids:
+            memberships[user_id] = segment_index.index.segments_of(user_id, segment_ids)
+        return memberships
+
+    result = await db.execute(
+        union(
+            select(UserSegment.user_id, UserSegment.segment_id)
+            .filter(UserSegment.user_id.in_(user_ids), UserSegment.segment_id.in_(segment_ids)),
+            select(RuleSegmentMember.user_id, RuleSegmentMember.segment_id)
+            .filter(RuleSegmentMember.user_id.in_(user_ids), RuleSegmentMember.segment_id.in_(segment_ids))
+        )
+    )
+    for user_id, segment_id in result.all():
+        memberships[user_id].add(segment_id)
+    return memberships
+
+
+async def count_segment_members(db: AsyncSession, segment_id: int) -> int:
+    if segment_index.ready:
+        return segment_index.index.count(segment_id)
+
+    members = union(
+        select(UserSegment.user_id).filter(UserSegment.segment_id == segment_id),
+        select(RuleSegmentMember.user_id).filter(RuleSegmentMember.segment_id == segment_id)
+    ).subquery()
+    result = await db.execute(select(func.count()).select_from(members))
+    return result.scalar_one()
@@ -0,0 +1,213 @@
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy import select, delete, update, exists, literal, or_, tuple_
+from sqlalchemy.dialects.sqlite import insert
+from src.database import AsyncSessionLocal
+from src.models import Segment, User, RuleSegmentMember
+from src.cache import invalidate_segment_cache, bump_config_version
+from .rules import RuleError, rules_to_clause
+from .segment_index import WatermarkRange, segment_index, get_membership_watermark, lock_membership_watermark
+from .config_snapshot import get_compiled_rules
+from typing import Iterable, List, NamedTuple, Optional, Set
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_MATERIALIZE_INTERVAL_SECONDS = float(os.getenv("SEGMENT_MATERIALIZE_INTERVAL_SECONDS", "5"))
+
+
+def segment_clause(segment_id: int, rules):
+    try:
+        return rules_to_clause(rules)
+    except RuleError as e:
+        logger.warning(f"Segment {segment_id} has invalid rules ({e}); materializing it as empty")
+        return None
+
+
+async def sync_rule_members(db: AsyncSession, segment_id: int, rules) -> None:
+    """Make rule_segment_members match the segment's rules.
+
+    Only the difference is written: members that stopped matching are deleted
+    and new matches inserted, each with one set-based statement.
+    """
+    clause = segment_clause(segment_id, rules)
+
+    stale = delete(RuleSegmentMember).where(RuleSegmentMember.segment_id == segment_id)
+    if clause is not None:
+        stale = stale.where(~exists(select(User.id).where(User.id == RuleSegmentMember.user_id, clause)))
+    await db.execute(stale)
+
+    if clause is None:
+        return
+
+    await db.execute(
+        insert(RuleSegmentMember)
+        .from_select(["segment_id", "user_id"], select(literal(segment_id), User.id).where(clause))
+        .on_conflict_do_nothing(index_elements=["segment_id", "user_id"])
+    )
+
+
+async def materialize_segment(db: AsyncSession, segment_id: int) -> bool:
+    result = await db.execute(
+        select(Segment.rules, Segment.rules_version).filter(Segment.id == segment_id)
+    )
+    row = result.one_or_none()
+    if row is None:
+        return False
+    rules, rules_version = row
+
+    watermark = await lock_membership_watermark(db)
+    await sync_rule_members(db, segment_id, rules)
+    members = await get_rule_member_ids(db, segment_id) if segment_index.ready else None
+    # Only mark the version that was evaluated; a concurrent rules change stays stale
+    await db.execute(
+        update(Segment)
+        .where(Segment.id == segment_id, Segment.rules_version == rules_version)
+        .values(materialized_version=rules_version)
+    )
+    versions = (watermark, await get_membership_watermark(db))
+    await db.commit()
+
+    if members is not None:
+        segment_index.replace_rule_members(segment_id, members, versions)
+    invalidate_segment_cache(segment_id)
+    bump_config_version()
+    return True
+
+
+async def get_stale_segment_ids(db: AsyncSession) -> List[int]:
+    result = await db.execute(
+        select(Segment.id).filter(
+            or_(Segment.materialized_version.is_(None), Segment.materialized_version != Segment.rules_version)
+        )
+    )
+    return list(result.scalars().all())
+
+
+class MembershipChanges(NamedTuple):
+    joined: Set[tuple]
+    left: Set[tuple]
+    versions: Optional[WatermarkRange] = None
+
+    @property
+    def segment_ids(self) -> Set[int]:
+        return {segment_id for segment_id, _ in self.joined | self.left}
+
+    def apply(self) -> None:
+        """Update the in-memory membership index; call once the changes are committed."""
+        segment_index.update_rule_members(self.joined, self.left, self.versions)
+
+
+async def refresh_user_memberships(db: AsyncSession, user_ids: Iterable[str]) -> MembershipChanges:
+    """Re-evaluate every rule segment for the given users, without committing.
+
+    Called when users are created or their attributes change. The compiled
+    predicates are evaluated in memory, so the write is one DELETE and one
+    multi-row INSERT however many rule segments exist. Returns the
+    (segment_id, user_id) pairs that joined and left rule segments.
+    """
+    user_ids = list(user_ids)
+    watermark = await lock_membership_watermark(db)
+    before = await get_rule_memberships(db, user_ids)
+
+    result = await db.execute(select(User).filter(User.id.in_(user_ids)))
+    users = result.scalars().all()
+    result = await db.execute(
+        select(Segment.id, Segment.rules_version, Segment.rules).filter(Segment.rules.is_not(None))
+    )
+    after = set()
+    for segment_id, rules_version, rules in result.all():
+        predicate = get_compiled_rules(segment_id, rules_version, rules)
+        if predicate is not None:
+            after.update((segment_id, user.id) for user in users if predicate(user))
+
+    joined, left = after - before, before - after
+    if left:
+        await db.execute(
+            delete(RuleSegmentMember)
+            .where(tuple_(RuleSegmentMember.segment_id, RuleSegmentMember.user_id).in_(left))
+        )
+    if joined:
+        await db.execute(
+            insert(RuleSegmentMember).on_conflict_do_nothing(index_elements=["segment_id", "user_id"]),
+            [{"segment_id": segment_id, "user_id": user_id} for segment_id, user_id in joined]
+        )
+    versions = (watermark, await get_membership_watermark(db))
+    return MembershipChanges(joined=joined, left=left, versions=versions)
+
+
+async def get_rule_member_ids(db: AsyncSession, segment_id: int) -> List[str]:
+    result = await db.execute(select(RuleSegmentMember.user_id).filter(RuleSegmentMember.segment_id == segment_id))
+    return list(result.scalars().all())
+
+
+async def get_rule_memberships(db: AsyncSession, user_ids: List[str]) -> Set[tuple]:
+    result = await db.execute(
+        select(RuleSegmentMember.segment_id, RuleSegmentMember.user_id)
+        .filter(RuleSegmentMember.user_id.in_(user_ids))
+    )
+    return set(result.all())
+
+
+class SegmentMaterializer:
+    """Background job that keeps rule_segment_members in step with segment rules.
+
+    Segments whose rules changed since they were last materialized are rebuilt
+    every interval, or straight away after ``wake()``.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker,
+        interval_seconds: float = SEGMENT_MATERIALIZE_INTERVAL_SECONDS
+    ):
+        self.session_factory = session_factory
+        self.interval = interval_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+        self._wake: Optional[asyncio.Event] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._stopping = asyncio.Event()
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    def wake(self) -> None:
+        if self._wake is not None:
+            self._wake.set()
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._stopping.set()
+            self._wake.set()
+            await self._task
+            self._task = None
+
+    async def run_once(self) -> List[int]:
+        materialized = []
+        async with self.session_factory() as db:
+            for segment_id in await get_stale_segment_ids(db):
+                try:
+                    if await materialize_segment(db, segment_id):
+                        materialized.append(segment_id)
+                except Exception:
+                    await db.rollback()
+                    logger.exception(f"Failed to materialize segment {segment_id}")
+        return materialized
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Segment materialization failed")
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+
+segment_materializer = SegmentMaterializer(AsyncSessionLocal)
@@ -1,14 +1,37 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, union
+from sqlalchemy.dialects.sqlite import insert
 from fastapi import HTTPException
-from src.models import User, Experiment, Segment, UserSegment, ExperimentSegment
-from src.schemas.segments import SegmentCreate, SegmentUpdate
-from src.cache import cached, segment_cache, invalidate_segment_cache, invalidate_experiment_cache
-from typing import List
+from src.models import User, Experiment, Segment, UserSegment, ExperimentSegment, RuleSegmentMember
+from src.schemas.segments import (
+    SegmentCreate, SegmentUpdate, SegmentResponse, SegmentDetailResponse, SegmentUsersPage,
+    BulkUserSegmentAssignResponse, DEFAULT_SEGMENT_USERS_PAGE_SIZE, MAX_REPORTED_MISSING_USER_IDS
+)
+from src.cache import (
+    cached, segment_cache, invalidate_segment_cache, invalidate_segment_list_cache, invalidate_experiment_cache,
+    invalidate_user_assignments, invalidate_compiled_rules, bump_config_version, segment_tag, SEGMENT_LIST_TAG
+)
+from .rules import RuleError, compile_rules
+from .segment_membership import segment_materializer
+from .segment_index import segment_index, count_segment_members, get_membership_watermark, lock_membership_watermark
+from .experiments import EntityVersions, bump_experiment_version
+from .changes import record_change
+from typing import AsyncIterable, AsyncIterator, Iterable, List, Optional, Union
+
+# User IDs validated and inserted per statement (and per commit) by bulk assignment
+SEGMENT_ASSIGN_CHUNK_SIZE = 5000
+
+
+def validate_rules(rules) -> None:
+    try:
+        compile_rules(rules)
+    except RuleError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid segment rules: {e}")
 
 
 async def create_segment(db: AsyncSession, segment_data: SegmentCreate) -> Segment:
+    validate_rules(segment_data.rules)
+
     db_segment = Segment(
         name=segment_data.name,
         description=segment_data.description,
@@ -17,32 +40,81 @@ async def create_segment(db: AsyncSession, segment_data: SegmentCreate) -> Segme
     db.add(db_segment)
     await db.commit()
     await db.refresh(db_segment)
+
+    invalidate_segment_list_cache()
+    if db_segment.rules:
+        segment_materializer.wake()
+
     return db_segment
 
 
-@cached(segment_cache)
-async def get_segments(db: AsyncSession) -> List[Segment]:
+@cached(
+    segment_cache,
+    snapshot=SegmentResponse,
+    tags=lambda segments: [SEGMENT_LIST_TAG, *(segment_tag(s.id) for s in segments)]
+)
+async def get_segments(db: AsyncSession) -> List[SegmentResponse]:
     result = await db.execute(select(Segment))
     segments = result.scalars().all()
     return segments
 
 
-@cached(segment_cache)
-async def get_segment_by_id(db: AsyncSession, segment_id: int) -> Segment:
-    result = await db.execute(
-        select(Segment)
-        .options(selectinload(Segment.user_assignments).selectinload(UserSegment.user))
-        .filter(Segment.id == segment_id)
-    )
+@cached(
+    segment_cache,
+    tags=lambda versions: [SEGMENT_LIST_TAG, *(segment_tag(segment_id) for _, segment_id, _ in versions)]
+)
+async def get_segment_list_versions(db: AsyncSession) -> EntityVersions:
+    result = await db.execute(select(Segment.id, Segment.config_version).order_by(Segment.id))
+    return tuple(("Segment", segment_id, version) for segment_id, version in result.all())
+
+
+@cached(
+    segment_cache,
+    snapshot=SegmentDetailResponse,
+    tags=lambda segment, segment_id: [segment_tag(segment_id)]
+)
+async def get_segment_by_id(db: AsyncSession, segment_id: int) -> SegmentDetailResponse:
+    result = await db.execute(select(Segment).filter(Segment.id == segment_id))
     segment = result.scalar_one_or_none()
     if not segment:
         raise HTTPException(status_code=404, detail="Segment not found")
 
-    segment.users = [assignment.user for assignment in segment.user_assignments]
-
+    segment.member_count = await count_segment_members(db, segment_id)
     return segment
 
 
+async def get_segment_users(
+    db: AsyncSession,
+    segment_id: int,
+    after: Optional[str] = None,
+    limit: int = DEFAULT_SEGMENT_USERS_PAGE_SIZE
+) -> SegmentUsersPage:
+    """One page of a segment's members, explicit and rule-matched, ordered by user ID."""
+    result = await db.execute(select(Segment.id).filter(Segment.id == segment_id))
+    if result.scalar_one_or_none() is None:
+        raise HTTPException(status_code=404, detail="Segment not found")
+
+    # Each membership table is read through its (segment_id, user_id) index, at most one page past ``after``
+    branches = []
+    for model in (UserSegment, RuleSegmentMember):
+        branch = select(model.user_id.label("user_id")).filter(model.segment_id == segment_id)
+        if after is not None:
+            branch = branch.filter(model.user_id > after)
+        branches.append(select(branch.order_by(model.user_id).limit(limit + 1).subquery()))
+    members = union(*branches).subquery()
+
+    result = await db.execute(select(members.c.user_id).order_by(members.c.user_id).limit(limit + 1))
+    user_ids = list(result.scalars().all())
+    has_more = len(user_ids) > limit
+    user_ids = user_ids[:limit]
+
+    result = await db.execute(select(User).filter(User.id.in_(user_ids)).order_by(User.id))
+    return SegmentUsersPage(
+        users=result.scalars().all(),
+        next_after=user_ids[-1] if has_more else None
+    )
+
+
 async def update_segment(db: AsyncSession, segment_id: int, segment_update: SegmentUpdate) -> Segment:
     result = await db.execute(select(Segment).filter(Segment.id == segment_id))
     segment = result.scalar_one_or_none()
@@ -69,12 +141,20 @@ async def update_segment(db: AsyncSession, segment_id: int, segment_update: Segm
         segment.description = segment_update.description
 
     if segment_update.rules is not None:
+        validate_rules(segment_update.rules)
         segment.rules = segment_update.rules
+        segment.rules_version += 1
 
+    segment.config_version = Segment.config_version + 1
     await db.commit()
     await db.refresh(segment)
 
     invalidate_segment_cache(segment_id)
+    invalidate_compiled_rules(segment_id)
+    bump_config_version()
+    record_change("segment.updated", SegmentResponse.model_validate(segment).model_dump(mode="json"))
+    if segment_update.rules is not None:
+        segment_materializer.wake()
 
     return segment
 
@@ -90,14 +170,87 @@ async def assign_user_to_segment(db: AsyncSession, user_id: str, segment_id: int
     if not segment:
         raise HTTPException(status_code=404, detail="Segment not found")
 
+    watermark = await lock_membership_watermark(db)
     db_assignment = UserSegment(
         user_id=user_id,
         segment_id=segment_id
     )
     db.add(db_assignment)
+    versions = (watermark, await get_membership_watermark(db))
     await db.commit()
 
+    segment_index.add_explicit(segment_id, [user_id], versions)
     invalidate_segment_cache(segment_id)
+    invalidate_user_assignments(user_id)
+
+
+async def iterate(values: Iterable[str]) -> AsyncIterator[str]:
+    for value in values:
+        yield value
+
+
+async def chunked(user_ids: Union[Iterable[str], AsyncIterable[str]], size: int) -> AsyncIterator[List[str]]:
+    if not isinstance(user_ids, AsyncIterable):
+        user_ids = iterate(user_ids)
+    chunk = []
+    async for user_id in user_ids:
+        chunk.append(user_id)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def bulk_assign_users_to_segment(
+    db: AsyncSession,
+    segment_id: int,
+    user_ids: Union[Iterable[str], AsyncIterable[str]]
+) -> BulkUserSegmentAssignResponse:
+    """Assign many users to a segment, reading ``user_ids`` one chunk at a time.
+
+    Each chunk is validated with one query and inserted with one statement that
+    skips users already in the segment, then committed, so a failed import can
+    simply be retried.
+    """
+    result = await db.execute(select(Segment.id).filter(Segment.id == segment_id))
+    if result.scalar_one_or_none() is None:
+        raise HTTPException(status_code=404, detail="Segment not found")
+
+    assigned = already_assigned = missing_count = 0
+    missing_user_ids = []
+    async for chunk in chunked(user_ids, SEGMENT_ASSIGN_CHUNK_SIZE):
+        chunk = list(dict.fromkeys(chunk))
+        result = await db.execute(select(User.id).filter(User.id.in_(chunk)))
+        existing = set(result.scalars().all())
+        valid = [user_id for user_id in chunk if user_id in existing]
+
+        missing = [user_id for user_id in chunk if user_id not in existing]
+        missing_count += len(missing)
+        missing_user_ids.extend(missing[:MAX_REPORTED_MISSING_USER_IDS - len(missing_user_ids)])
+        if not valid:
+            continue
+
+        watermark = await lock_membership_watermark(db)
+        result = await db.execute(
+            insert(UserSegment)
+            .values([{"user_id": user_id, "segment_id": segment_id} for user_id in valid])
+            .on_conflict_do_nothing(index_elements=["user_id", "segment_id"])
+        )
+        versions = (watermark, await get_membership_watermark(db))
+        await db.commit()
+
+        assigned += result.rowcount
+        already_assigned += len(valid) - result.rowcount
+        segment_index.add_explicit(segment_id, valid, versions)
+        invalidate_segment_cache(segment_id)
+
+    return BulkUserSegmentAssignResponse(
+        assigned=assigned,
+        already_assigned=already_assigned,
+        missing_count=missing_count,
+        missing_user_ids=missing_user_ids
+    )
 
 
 async def assign_segment_to_experiment(db: AsyncSession, experiment_id: int, segment_id: int) -> None:
@@ -118,10 +271,13 @@ async def assign_segment_to_experiment(db: AsyncSession, experiment_id: int, seg
     )
 
     db.add(db_assignment)
+    await bump_experiment_version(db, experiment_id)
     await db.commit()
 
     invalidate_experiment_cache(experiment_id)
     invalidate_segment_cache(segment_id)
+    bump_config_version()
+    record_change("segment.attached", {"experiment_id": experiment_id, "segment_id": segment_id})
 
 
 async def remove_segment_from_experiment(db: AsyncSession, experiment_id: int, segment_id: int) -> None:
@@ -138,7 +294,10 @@ async def remove_segment_from_experiment(db: AsyncSession, experiment_id: int, s
         raise HTTPException(status_code=404, detail="Segment assignment not found")
 
     await db.delete(assignment)
+    await bump_experiment_version(db, experiment_id)
     await db.commit()
 
     invalidate_experiment_cache(experiment_id)
     invalidate_segment_cache(segment_id)
+    bump_config_version()
+    record_change("segment.detached", {"experiment_id": experiment_id, "segment_id": segment_id})
@@ -1,8 +1,9 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
+from sqlalchemy import select
 from fastapi import HTTPException
-from src.models import Experiment, Variant, Event, UserVariantAssignment
+from src.models import Experiment, Variant
 from src.schemas.statistics import VariantResult, ConfidenceInterval, ExperimentStatisticsResponse, Winner
+from .counters import get_variant_event_counts
 from typing import Dict, List
 import math
 from scipy import stats
@@ -87,30 +88,17 @@ async def get_experiment_statistics(
     if not variants:
         raise HTTPException(status_code=400, detail="No variants found for this experiment")
 
+    # Counts come from the per-variant rollup maintained on event ingestion
+    event_counts = await get_variant_event_counts(db, experiment_id, ["page_view", conversion_event_type])
+
     # Temporary storage for raw variant data
     variant_data: Dict[int, Dict] = {}
 
     control_variant_data = None
     for variant in variants:
-        # Count total page_view events (sessions) for this variant
-        total_sessions_result = await db.execute(
-            select(func.count(Event.id))
-            .filter(
-                Event.variant_id == variant.id,
-                Event.type == "page_view"
-            )
-        )
-        total_sessions = total_sessions_result.scalar() or 0
-
-        # Count conversion events
-        conversions_result = await db.execute(
-            select(func.count(Event.id))
-            .filter(
-                Event.variant_id == variant.id,
-                Event.type == conversion_event_type
-            )
-        )
-        conversions = conversions_result.scalar() or 0
+        # page_view events are the sessions for this variant
+        total_sessions = event_counts.get((variant.id, "page_view"), 0)
+        conversions = event_counts.get((variant.id, conversion_event_type), 0)
 
         conversion_rate = (conversions / total_sessions * 100) if total_sessions > 0 else 0.0
 
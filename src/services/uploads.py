@@ -0,0 +1,77 @@
+from fastapi import HTTPException
+from typing import AsyncIterable, AsyncIterator, Optional
+import csv
+import json
+
+CSV_CONTENT_TYPES = ("text/csv",)
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+
+async def iter_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[str]:
+    """Split a streamed body into lines without holding more than one line in memory."""
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield decode_line(line)
+    if buffer:
+        yield decode_line(buffer)
+
+
+def decode_line(line: bytes) -> str:
+    try:
+        return line.decode("utf-8-sig").rstrip("\r")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Upload must be UTF-8 encoded")
+
+
+async def parse_csv_user_ids(lines: AsyncIterable[str]) -> AsyncIterator[str]:
+    # Reads the "user_id" column if the first row is a header naming it, otherwise the first column
+    column = None
+    async for line in lines:
+        if not line.strip():
+            continue
+        cells = next(csv.reader([line]))
+        if column is None:
+            header = [cell.strip() for cell in cells]
+            if "user_id" in header:
+                column = header.index("user_id")
+                continue
+            column = 0
+        if column < len(cells) and cells[column].strip():
+            yield cells[column].strip()
+
+
+async def parse_ndjson_user_ids(lines: AsyncIterable[str]) -> AsyncIterator[str]:
+    # Each line is a user ID string or an object with a "user_id" field
+    line_number = 0
+    async for line in lines:
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            value = json.loads(line)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Line {line_number} is not valid JSON")
+        if isinstance(value, dict):
+            value = value.get("user_id")
+        if not isinstance(value, str):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Line {line_number} must be a user ID string or an object with a 'user_id' string"
+            )
+        yield value
+
+
+def parse_user_id_upload(chunks: AsyncIterable[bytes], content_type: Optional[str]) -> AsyncIterator[str]:
+    """User IDs from a streamed CSV or NDJSON body, chosen by content type."""
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type in CSV_CONTENT_TYPES:
+        return parse_csv_user_ids(iter_lines(chunks))
+    if media_type in NDJSON_CONTENT_TYPES:
+        return parse_ndjson_user_ids(iter_lines(chunks))
+    raise HTTPException(
+        status_code=415,
+        detail=f"Upload must be one of {', '.join(CSV_CONTENT_TYPES + NDJSON_CONTENT_TYPES)}"
+    )
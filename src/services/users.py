@@ -1,9 +1,14 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, delete, tuple_
 from fastapi import HTTPException
-from src.models import User
-from src.schemas.users import UserCreate, UserUpdate
-from typing import List
+from src.models import User, RuleSegmentMember
+from src.schemas.users import UserCreate, UserUpdate, UserResponse, UsersPage, DEFAULT_USERS_PAGE_SIZE
+from src.cache import invalidate_user_assignments, invalidate_segment_cache
+from .segment_membership import refresh_user_memberships
+from .segment_index import segment_index, get_membership_watermark, lock_membership_watermark
+from .pagination import encode_cursor, decode_cursor, stream_ndjson
+from datetime import datetime
+from typing import AsyncIterator, Optional
 
 
 async def create_user(db: AsyncSession, user_data: UserCreate) -> User:
@@ -15,15 +20,41 @@ async def create_user(db: AsyncSession, user_data: UserCreate) -> User:
         country_code=user_data.country_code
     )
     db.add(db_user)
+    await db.flush()
+    changes = await refresh_user_memberships(db, [db_user.id])
     await db.commit()
     await db.refresh(db_user)
+
+    changes.apply()
+    for segment_id in changes.segment_ids:
+        invalidate_segment_cache(segment_id)
+
     return db_user
 
 
-async def get_users(db: AsyncSession) -> List[User]:
-    result = await db.execute(select(User))
-    users = result.scalars().all()
-    return users
+def users_after(after: Optional[str]):
+    # Keyset order is (created_at, id), served by ix_users_created_at_id
+    query = select(User.__table__).order_by(User.created_at, User.id)
+    if after is not None:
+        created_at, user_id = decode_cursor(after, datetime, str)
+        query = query.filter(tuple_(User.created_at, User.id) > tuple_(created_at, user_id))
+    return query
+
+
+async def get_users(db: AsyncSession, after: Optional[str] = None, limit: int = DEFAULT_USERS_PAGE_SIZE) -> UsersPage:
+    result = await db.execute(users_after(after).limit(limit + 1))
+    rows = result.all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return UsersPage(
+        users=[UserResponse.model_validate(row) for row in rows],
+        next_after=encode_cursor(rows[-1].created_at, rows[-1].id) if has_more else None
+    )
+
+
+def stream_users(db: AsyncSession, after: Optional[str] = None) -> AsyncIterator[bytes]:
+    """Every user after the cursor as NDJSON, read in fixed-size partitions."""
+    return stream_ndjson(db, users_after(after), UserResponse)
 
 
 async def get_user_by_id(db: AsyncSession, user_id: str) -> User:
@@ -67,8 +98,18 @@ async def update_user(db: AsyncSession, user_id: str, user_update: UserUpdate) -
     if user_update.country_code is not None:
         user.country_code = user_update.country_code
 
+    # Rule-based segment membership follows the new attributes in the same transaction
+    changes = await refresh_user_memberships(db, [user_id])
     await db.commit()
     await db.refresh(user)
+
+    changes.apply()
+    for segment_id in changes.segment_ids:
+        invalidate_segment_cache(segment_id)
+
+    # Cached "not eligible" outcomes may depend on the old attributes
+    invalidate_user_assignments(user_id)
+
     return user
 
 
@@ -78,5 +119,20 @@ async def delete_user(db: AsyncSession, user_id: str) -> None:
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
+    watermark = await lock_membership_watermark(db)
+    result = await db.execute(
+        delete(RuleSegmentMember)
+        .where(RuleSegmentMember.user_id == user_id)
+        .returning(RuleSegmentMember.segment_id)
+    )
+    changed_segment_ids = set(result.scalars().all())
     await db.delete(user)
+    await db.flush()
+    versions = (watermark, await get_membership_watermark(db))
     await db.commit()
+
+    segment_index.remove_user(user_id, versions)
+    for segment_id in changed_segment_ids:
+        invalidate_segment_cache(segment_id)
+
+    invalidate_user_assignments(user_id)
@@ -1,20 +1,163 @@
 import hashlib
-from typing import List
+import numpy as np
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Sequence, Tuple
 from src.models import Variant
 
+BUCKET_COUNT = 100
+# Ranged bucketing: 0.01% allocation precision, explicit bucket ranges per variant
+RANGED_BUCKET_COUNT = 10_000
 
-def assign_variant_by_hash(user_id: str, experiment_id: int, variants: List[Variant]) -> int:
+BucketRange = Tuple[int, int]
+
+
+def hash_bucket(user_id: str, experiment_id: int, bucket_count: int = BUCKET_COUNT) -> int:
     hash_input = f"{user_id}:{experiment_id}".encode('utf-8')
     hash_digest = hashlib.sha256(hash_input).hexdigest()
 
-    hash_bucket = int(hash_digest[:8], 16) % 100
+    return int(hash_digest[:8], 16) % bucket_count
 
+
+def cumulative_boundaries(variants: List[Variant]) -> Tuple[Tuple[int, ...], Tuple[float, ...]]:
+    """Variant IDs in ID order and the running total of their allocations."""
     sorted_variants = sorted(variants, key=lambda v: v.id)
 
+    boundaries = []
     cumulative_percent = 0.0
     for variant in sorted_variants:
         cumulative_percent += variant.percent_allocated
-        if hash_bucket < cumulative_percent:
-            return variant.id
+        # Running maximum keeps the boundaries sorted even with negative allocations,
+        # without changing which variant first exceeds a bucket
+        boundaries.append(max(cumulative_percent, boundaries[-1]) if boundaries else cumulative_percent)
+
+    return tuple(v.id for v in sorted_variants), tuple(boundaries)
+
+
+def pick_variant(bucket: int, variant_ids: Sequence[int], boundaries: Sequence[float]) -> Optional[int]:
+    if not variant_ids:
+        return None
+
+    # First variant whose cumulative allocation is above the bucket; unallocated buckets go to the last one
+    index = bisect_right(boundaries, bucket)
+    return variant_ids[min(index, len(variant_ids) - 1)]
+
+
+def assign_variant_by_hash(user_id: str, experiment_id: int, variants: List[Variant]) -> int:
+    variant_ids, boundaries = cumulative_boundaries(variants)
+    return pick_variant(hash_bucket(user_id, experiment_id), variant_ids, boundaries)
+
+
+@dataclass(frozen=True)
+class AllocationTable:
+    """An experiment's variants compiled for batch assignment."""
+    variant_ids: np.ndarray
+    boundaries: np.ndarray
+
+    @classmethod
+    def from_variants(cls, variants: List[Variant]) -> "AllocationTable":
+        variant_ids, boundaries = cumulative_boundaries(variants)
+        return cls.from_boundaries(variant_ids, boundaries)
+
+    @classmethod
+    def from_boundaries(cls, variant_ids: Sequence[int], boundaries: Sequence[float]) -> "AllocationTable":
+        if not variant_ids:
+            raise ValueError("An allocation table needs at least one variant")
+        return cls(np.asarray(variant_ids, dtype=np.int64), np.asarray(boundaries, dtype=np.float64))
+
+
+def hash_buckets(user_ids: Iterable[str], experiment_id: int, bucket_count: int = BUCKET_COUNT) -> np.ndarray:
+    """``hash_bucket`` for many users at once.
+
+    SHA-256 still runs once per user, but only the raw 4-byte digest prefix is
+    kept; decoding it as big-endian uint32 gives the same value as parsing the
+    first 8 hex characters.
+    """
+    suffix = f":{experiment_id}"
+    sha256 = hashlib.sha256
+    prefixes = b"".join(sha256(f"{user_id}{suffix}".encode('utf-8')).digest()[:4] for user_id in user_ids)
+    return np.frombuffer(prefixes, dtype=">u4").astype(np.int64) % bucket_count
+
+
+def assign_variants_by_hash(user_ids: Iterable[str], experiment_id: int, table: AllocationTable) -> np.ndarray:
+    """Vectorized ``assign_variant_by_hash``: the variant ID for each user, in input order."""
+    buckets = hash_buckets(user_ids, experiment_id)
+    # Same lookup as pick_variant: searchsorted(side="right") is bisect_right
+    indexes = np.searchsorted(table.boundaries, buckets, side="right")
+    np.minimum(indexes, len(table.variant_ids) - 1, out=indexes)
+    return table.variant_ids[indexes]
+
+
+def percent_to_buckets(percent_allocated: float) -> int:
+    return round(percent_allocated * RANGED_BUCKET_COUNT / 100)
+
+
+def count_buckets(ranges: Iterable[Sequence[int]]) -> int:
+    return sum(end - start for start, end in ranges)
+
+
+def free_bucket_ranges(allocated: Iterable[Sequence[int]]) -> List[BucketRange]:
+    """Buckets not held by any variant, lowest first."""
+    free = []
+    position = 0
+    for start, end in sorted(tuple(bucket_range) for bucket_range in allocated):
+        if start > position:
+            free.append((position, start))
+        position = max(position, end)
+    if position < RANGED_BUCKET_COUNT:
+        free.append((position, RANGED_BUCKET_COUNT))
+    return free
+
+
+def resize_bucket_ranges(
+    ranges: Sequence[Sequence[int]],
+    other_ranges: Iterable[Sequence[int]],
+    bucket_count: int
+) -> List[BucketRange]:
+    """Grow or shrink a variant's ranges to ``bucket_count`` buckets.
+
+    Growing only claims buckets from the unallocated pool (lowest first) and
+    shrinking gives back the most recently claimed buckets, so users only ever
+    move between a variant and the pool, never between variants. Ranges are
+    kept in the order they were claimed.
+    """
+    resized = [(start, end) for start, end in ranges]
+    missing = bucket_count - count_buckets(resized)
+
+    if missing > 0:
+        for start, end in free_bucket_ranges([*resized, *other_ranges]):
+            if missing == 0:
+                break
+            end = min(end, start + missing)
+            if resized and resized[-1][1] == start:
+                resized[-1] = (resized[-1][0], end)
+            else:
+                resized.append((start, end))
+            missing -= end - start
+        if missing > 0:
+            raise ValueError(f"Only {bucket_count - missing} of the {bucket_count} requested buckets are available")
+
+    while missing < 0:
+        start, end = resized.pop()
+        if end - start > -missing:
+            resized.append((start, end + missing))
+            missing = 0
+        else:
+            missing += end - start
+
+    return resized
+
+
+def build_bucket_lookup(variant_ranges: Iterable[Tuple[int, Sequence[Sequence[int]]]]) -> np.ndarray:
+    """Bucket -> variant ID for a ranged experiment; 0 marks unallocated buckets."""
+    lookup = np.zeros(RANGED_BUCKET_COUNT, dtype=np.int64)
+    for variant_id, ranges in variant_ranges:
+        for start, end in ranges or ():
+            lookup[start:end] = variant_id
+    lookup.flags.writeable = False
+    return lookup
+
 
-    return sorted_variants[-1].id if sorted_variants else None
+def assign_variants_by_lookup(user_ids: Iterable[str], experiment_id: int, lookup: np.ndarray) -> np.ndarray:
+    """Batch assignment for ranged experiments; 0 for users in the unallocated pool."""
+    return lookup[hash_buckets(user_ids, experiment_id, RANGED_BUCKET_COUNT)]
@@ -8,6 +8,9 @@ from typing import AsyncGenerator
 from src.database import Base, get_db
 from src.main import app
 from src.models import ApiKey
+from src.cache import clear_all_caches
+from src.services.segment_index import segment_index
+from src.services.changes import change_log
 import uuid
 
 TEST_DATABASE_URL = "sqlite+aiosqlite:///:memory:"
@@ -22,6 +25,15 @@ def event_loop():
     loop.close()
 
 
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Start every test with empty in-process caches, no membership index and an empty change log."""
+    clear_all_caches()
+    segment_index.reset()
+    change_log.reset()
+    yield
+
+
 @pytest.fixture(scope="function")
 async def test_engine():
     """Create a test database engine."""
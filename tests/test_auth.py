@@ -1,5 +1,10 @@
 import pytest
 from httpx import AsyncClient
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from src.cache import api_key_cache
+from src.models import ApiKey
+from src.services.auth import ApiKeyUsageTracker
 
 
 @pytest.mark.asyncio
@@ -45,3 +50,42 @@ class TestAuthAPI:
         list_response = await client_no_auth.get("/api/auth/keys")
         remaining_keys = list_response.json()
         assert not any(key["id"] == key_id for key in remaining_keys)
+
+
+    async def test_verified_key_is_cached(self, client: AsyncClient, test_session, test_api_key):
+        response = await client.get("/api/users/")
+        assert response.status_code == 200
+        assert test_api_key.key in api_key_cache
+
+        # Served from the cache without reading api_keys again
+        await test_session.execute(delete(ApiKey).filter(ApiKey.id == test_api_key.id))
+        await test_session.commit()
+        response = await client.get("/api/users/")
+        assert response.status_code == 200
+
+
+    async def test_deleted_key_is_rejected(self, client: AsyncClient, client_no_auth: AsyncClient):
+        create_response = await client_no_auth.post("/api/auth/keys", json={"name": "short_lived"})
+        key = create_response.json()
+        headers = {"Authorization": f"Bearer {key['key']}"}
+
+        response = await client.get("/api/users/", headers=headers)
+        assert response.status_code == 200
+
+        await client_no_auth.delete(f"/api/auth/keys/{key['id']}")
+        assert key["key"] not in api_key_cache
+
+        response = await client.get("/api/users/", headers=headers)
+        assert response.status_code == 401
+
+
+    async def test_usage_tracker_flushes_last_used_at(self, test_engine, test_session, test_api_key):
+        tracker = ApiKeyUsageTracker(async_sessionmaker(test_engine, class_=AsyncSession, expire_on_commit=False))
+        tracker.record(test_api_key.id)
+        tracker.record(test_api_key.id + 1000)
+
+        assert await tracker.flush() == 2
+        assert await tracker.flush() == 0
+
+        await test_session.refresh(test_api_key)
+        assert test_api_key.last_used_at is not None
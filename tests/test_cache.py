@@ -1,9 +1,11 @@
 import pytest
 from httpx import AsyncClient
 from src.cache import (
-    experiment_cache, segment_cache,
-    clear_all_caches, invalidate_experiment_cache, invalidate_segment_cache
+    experiment_cache, segment_cache, variant_assignment_cache,
+    clear_all_caches, invalidate_experiment_cache, invalidate_segment_cache,
+    cached, get_cache_stats, TaggedTTLCache
 )
+from src.schemas.experiments import ExperimentDetailResponse
 
 
 @pytest.mark.asyncio
@@ -197,3 +199,154 @@ async def test_segment_cache_invalidation_on_user_assignment(client: AsyncClient
     assert get_response2.json()["name"] == "User Assignment Cache Test Updated"
 
 
+
+
+@pytest.mark.asyncio
+async def test_cache_ignores_session_and_counts_hits(client: AsyncClient):
+    exp_response = await client.post(
+        "/api/experiments/",
+        json={"name": "Hit Counter Test", "description": "Test cache stats"}
+    )
+    experiment_id = exp_response.json()["id"]
+
+    before = get_cache_stats()["get_experiment_by_id"]
+
+    for _ in range(3):
+        response = await client.get(f"/api/experiments/{experiment_id}")
+        assert response.status_code == 200
+
+    after = get_cache_stats()["get_experiment_by_id"]
+    assert after["misses"] - before["misses"] == 1
+    assert after["hits"] - before["hits"] == 2
+    keys = [key for key in experiment_cache if key.startswith("get_experiment_by_id:")]
+    assert len(keys) == 1
+
+    cached_value = experiment_cache[keys[0]]
+    assert isinstance(cached_value, ExperimentDetailResponse)
+    assert cached_value.id == experiment_id
+
+
+@pytest.mark.asyncio
+async def test_cached_keys_skip_ignored_arguments():
+    calls = []
+
+    @cached(segment_cache, ignore=("db", "trace"))
+    def lookup(db, segment_id: int, trace: str = "") -> int:
+        calls.append(segment_id)
+        return segment_id * 2
+
+    assert lookup(object(), 7, trace="a") == 14
+    assert lookup(object(), segment_id=7, trace="b") == 14
+    assert lookup(object(), 8) == 16
+    assert calls == [7, 8]
+    assert get_cache_stats()["lookup"] == {"hits": 1, "misses": 2}
+
+
+@pytest.mark.asyncio
+async def test_invalidation_only_drops_tagged_entries(client: AsyncClient):
+    experiment_ids = []
+    for i in range(2):
+        exp_response = await client.post("/api/experiments/", json={"name": f"Tagged Experiment {i}"})
+        experiment_ids.append(exp_response.json()["id"])
+
+    segment_response = await client.post("/api/segments/", json={"name": "Tagged Segment"})
+    segment_id = segment_response.json()["id"]
+    await client.post(
+        "/api/segments/assign-experiment",
+        json={"experiment_id": experiment_ids[0], "segment_id": segment_id}
+    )
+
+    for experiment_id in experiment_ids:
+        await client.get(f"/api/experiments/{experiment_id}")
+    await client.get("/api/experiments/")
+    # Each response caches its body and the versions its ETag is built from
+    assert len(experiment_cache) == 6
+
+    invalidate_experiment_cache(experiment_ids[1])
+    # The list depends on every experiment; the other detail entries are untouched
+    assert len(experiment_cache) == 2
+
+    update_response = await client.put(f"/api/segments/{segment_id}", json={"name": "Renamed Segment"})
+    assert update_response.status_code == 200
+    assert len(experiment_cache) == 0
+
+    detail = await client.get(f"/api/experiments/{experiment_ids[0]}")
+    assert detail.json()["segments"][0]["name"] == "Renamed Segment"
+
+
+def test_tagged_cache_index_follows_evictions():
+    cache = TaggedTTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1, ["experiment:1"])
+    cache.set("b", 2, ["experiment:1", "segment:1"])
+    cache.set("c", 3, ["segment:1"])
+
+    assert "a" not in cache
+    assert cache.invalidate_tag("experiment:1") == 1
+    assert "b" not in cache
+    assert cache.invalidate_tag("segment:1") == 1
+    assert len(cache) == 0
+    assert cache.invalidate_tag("segment:1") == 0
+
+
+@pytest.mark.asyncio
+async def test_variant_assignment_cache_serves_repeat_checks(client: AsyncClient):
+    user_response = await client.post(
+        "/api/users/",
+        json={"first_name": "Sticky", "last_name": "User", "email": "sticky@example.com"}
+    )
+    user_id = user_response.json()["id"]
+
+    open_exp_id = (await client.post("/api/experiments/", json={"name": "Sticky Open"})).json()["id"]
+    targeted_exp_id = (await client.post("/api/experiments/", json={"name": "Sticky Targeted"})).json()["id"]
+    segment_response = await client.post("/api/segments/", json={"name": "Sticky Segment"})
+    segment_id = segment_response.json()["id"]
+    await client.post(
+        "/api/segments/assign-experiment",
+        json={"experiment_id": targeted_exp_id, "segment_id": segment_id}
+    )
+
+    request = {"user_id": user_id, "experiment_ids": [open_exp_id, targeted_exp_id]}
+    first = await client.post("/api/experiments/check-eligibility", json=request)
+    assert list(first.json()["eligible_experiment_ids"]) == [str(open_exp_id)]
+    variant_id = first.json()["eligible_experiment_ids"][str(open_exp_id)]["variant_id"]
+
+    # Positive and negative outcomes are both cached
+    assert variant_assignment_cache[(user_id, open_exp_id)] == variant_id
+    assert variant_assignment_cache[(user_id, targeted_exp_id)] is None
+
+    hits_before = get_cache_stats()["variant_assignments"]["hits"]
+    second = await client.post("/api/experiments/check-eligibility", json=request)
+    assert second.json() == first.json()
+    assert get_cache_stats()["variant_assignments"]["hits"] == hits_before + 1
+
+    # Joining the segment drops the user's cached outcomes
+    await client.post("/api/segments/assign-user", json={"user_id": user_id, "segment_id": segment_id})
+    assert (user_id, targeted_exp_id) not in variant_assignment_cache
+
+    third = await client.post("/api/experiments/check-eligibility", json=request)
+    assert set(third.json()["eligible_experiment_ids"]) == {str(open_exp_id), str(targeted_exp_id)}
+
+
+@pytest.mark.asyncio
+async def test_variant_change_keeps_sticky_assignments(client: AsyncClient):
+    user_response = await client.post(
+        "/api/users/",
+        json={"first_name": "Keep", "last_name": "User", "email": "keep@example.com"}
+    )
+    user_id = user_response.json()["id"]
+
+    exp_id = (await client.post("/api/experiments/", json={"name": "Sticky Variants"})).json()["id"]
+    detail = await client.get(f"/api/experiments/{exp_id}")
+    control_id = detail.json()["variants"][0]["id"]
+    other_exp_id = (await client.post("/api/experiments/", json={"name": "Sticky Other"})).json()["id"]
+
+    request = {"user_id": user_id, "experiment_ids": [exp_id, other_exp_id]}
+    await client.post("/api/experiments/check-eligibility", json=request)
+
+    await client.put(
+        f"/api/experiments/{exp_id}/variants/{control_id}",
+        json={"percent_allocated": 50.0}
+    )
+    # Assignments are persisted, so variant changes don't evict them
+    assert variant_assignment_cache[(user_id, exp_id)] == control_id
+    assert (user_id, other_exp_id) in variant_assignment_cache
@@ -1,6 +1,14 @@
 import pytest
+import asyncio
+import csv
+import io
+import json
 from httpx import AsyncClient
 from datetime import datetime, timedelta
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from src.schemas.events import EventCreate
+from src.services import events as event_service
 
 
 @pytest.mark.asyncio
@@ -71,7 +79,7 @@ class TestEventsAPI:
 
         response = await client.post(f"/api/events/{exp_id}", json={})
         assert response.status_code == 200
-        data = response.json()
+        data = response.json()["events"]
         assert len(data) == 3
 
 
@@ -128,13 +136,13 @@ class TestEventsAPI:
 
         response = await client.post(f"/api/events/{exp1_id}", json={})
         assert response.status_code == 200
-        data = response.json()
+        data = response.json()["events"]
         assert len(data) == 2
         assert all(e["experiment_id"] == exp1_id for e in data)
 
         response = await client.post(f"/api/events/{exp2_id}", json={})
         assert response.status_code == 200
-        data = response.json()
+        data = response.json()["events"]
         assert len(data) == 3
         assert all(e["experiment_id"] == exp2_id for e in data)
 
@@ -197,7 +205,7 @@ class TestEventsAPI:
             json={"variant_id": variant1_id}
         )
         assert response.status_code == 200
-        data = response.json()
+        data = response.json()["events"]
         assert len(data) == 3
         assert all(e["variant_id"] == variant1_id for e in data)
 
@@ -206,7 +214,7 @@ class TestEventsAPI:
             json={"variant_id": variant2_id}
         )
         assert response.status_code == 200
-        data = response.json()
+        data = response.json()["events"]
         assert len(data) == 2
         assert all(e["variant_id"] == variant2_id for e in data)
 
@@ -245,7 +253,7 @@ class TestEventsAPI:
             json={"event_types": ["click", "conversion"]}
         )
         assert response.status_code == 200
-        data = response.json()
+        data = response.json()["events"]
         assert len(data) == 4
         assert all(e["type"] in ["click", "conversion"] for e in data)
 
@@ -254,7 +262,7 @@ class TestEventsAPI:
             json={"event_types": ["view"]}
         )
         assert response.status_code == 200
-        data = response.json()
+        data = response.json()["events"]
         assert len(data) == 2
         assert all(e["type"] == "view" for e in data)
 
@@ -294,7 +302,7 @@ class TestEventsAPI:
             json={"user_ids": [user_ids[0], user_ids[2]]}
         )
         assert response.status_code == 200
-        data = response.json()
+        data = response.json()["events"]
         assert len(data) == 4
         assert all(e["user_id"] in [user_ids[0], user_ids[2]] for e in data)
 
@@ -303,7 +311,7 @@ class TestEventsAPI:
             json={"user_ids": [user_ids[1]]}
         )
         assert response.status_code == 200
-        data = response.json()
+        data = response.json()["events"]
         assert len(data) == 2
         assert all(e["user_id"] == user_ids[1] for e in data)
 
@@ -338,7 +346,7 @@ class TestEventsAPI:
             event_responses.append(response.json())
 
         all_events_response = await client.post(f"/api/events/{exp_id}", json={})
-        all_events = all_events_response.json()
+        all_events = all_events_response.json()["events"]
         assert len(all_events) == 5
 
         timestamps = [datetime.fromisoformat(e["timestamp"].replace("Z", "+00:00")) for e in all_events]
@@ -350,7 +358,7 @@ class TestEventsAPI:
             json={"start_time": mid_time}
         )
         assert response.status_code == 200
-        data = response.json()
+        data = response.json()["events"]
         assert len(data) >= 3
 
         response = await client.post(
@@ -358,7 +366,7 @@ class TestEventsAPI:
             json={"end_time": mid_time}
         )
         assert response.status_code == 200
-        data = response.json()
+        data = response.json()["events"]
         assert len(data) >= 2
 
 
@@ -454,7 +462,7 @@ class TestEventsAPI:
             }
         )
         assert response.status_code == 200
-        data = response.json()
+        data = response.json()["events"]
         assert len(data) == 2
         assert all(e["variant_id"] == variant1_id and e["type"] == "click" for e in data)
 
@@ -467,7 +475,7 @@ class TestEventsAPI:
             }
         )
         assert response.status_code == 200
-        data = response.json()
+        data = response.json()["events"]
         assert len(data) == 3
         assert all(
             e["user_id"] == user2_id and
@@ -484,6 +492,309 @@ class TestEventsAPI:
             }
         )
         assert response.status_code == 200
-        data = response.json()
+        data = response.json()["events"]
         assert len(data) == 2  # 1 conversion from user1 + 1 view from user2
         assert all(e["type"] in ["conversion", "view"] for e in data)
+
+
+    async def test_create_events_batch(self, client: AsyncClient):
+        user_response = await client.post(
+            "/api/users/",
+            json={
+                "first_name": "Batch",
+                "last_name": "User",
+                "email": "batch@example.com"
+            }
+        )
+        user_id = user_response.json()["id"]
+
+        exp_response = await client.post(
+            "/api/experiments/",
+            json={"name": "Batch Event Experiment"}
+        )
+        exp_id = exp_response.json()["id"]
+
+        response = await client.post(
+            "/api/events/batch",
+            json={
+                "events": [
+                    {"user_id": user_id, "experiment_id": exp_id, "type": "page_view"},
+                    {"user_id": "missing-user", "experiment_id": exp_id, "type": "page_view"},
+                    {"user_id": user_id, "experiment_id": exp_id, "type": "conversion", "properties": {"value": 5}}
+                ]
+            }
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["accepted"] == 2
+        assert data["rejected"] == 1
+        assert [r["accepted"] for r in data["results"]] == [True, False, True]
+        assert data["results"][1]["error"] == "User not found"
+        assert data["results"][0]["id"] < data["results"][2]["id"]
+
+        response = await client.post(f"/api/events/{exp_id}", json={})
+        events = {e["id"]: e for e in response.json()["events"]}
+        assert len(events) == 2
+        assert events[data["results"][2]["id"]]["type"] == "conversion"
+        assert events[data["results"][2]["id"]]["properties"] == {"value": 5}
+
+
+    async def test_create_events_batch_too_large(self, client: AsyncClient):
+        response = await client.post(
+            "/api/events/batch",
+            json={"events": [{"user_id": "u", "type": "click"}] * 1001}
+        )
+        assert response.status_code == 422
+
+        response = await client.post("/api/events/batch", json={"events": []})
+        assert response.status_code == 422
+
+    async def test_create_events_rejects_out_of_range_ids(self, client: AsyncClient):
+        for field in ("experiment_id", "variant_id"):
+            for value in (2**70, 0):
+                event = {"user_id": "u", "type": "click", field: value}
+                for url, body in (
+                    ("/api/events/", event), ("/api/events/async", event), ("/api/events/batch", {"events": [event]})
+                ):
+                    response = await client.post(url, json=body)
+                    assert response.status_code == 422
+
+
+    async def test_enqueue_event_flushes_on_stop(self, client: AsyncClient, test_engine, monkeypatch):
+        buffer = event_service.EventBuffer(
+            async_sessionmaker(test_engine, class_=AsyncSession, expire_on_commit=False),
+            flush_interval_ms=60000
+        )
+        monkeypatch.setattr(event_service, "event_buffer", buffer)
+
+        user_response = await client.post(
+            "/api/users/",
+            json={
+                "first_name": "Async",
+                "last_name": "User",
+                "email": "async@example.com"
+            }
+        )
+        user_id = user_response.json()["id"]
+
+        exp_response = await client.post(
+            "/api/experiments/",
+            json={"name": "Async Event Experiment"}
+        )
+        exp_id = exp_response.json()["id"]
+
+        ingestion_ids = set()
+        for event_type in ["page_view", "conversion"]:
+            response = await client.post(
+                "/api/events/async",
+                json={"user_id": user_id, "experiment_id": exp_id, "type": event_type}
+            )
+            assert response.status_code == 202
+            ingestion_ids.add(response.json()["ingestion_id"])
+        assert len(ingestion_ids) == 2
+
+        response = await client.post(f"/api/events/{exp_id}", json={})
+        assert response.json()["events"] == []
+
+        await buffer.stop()
+        assert len(buffer) == 0
+
+        response = await client.post(f"/api/events/{exp_id}", json={})
+        assert sorted(e["type"] for e in response.json()["events"]) == ["conversion", "page_view"]
+
+        response = await client.post(
+            "/api/events/async",
+            json={"user_id": user_id, "experiment_id": exp_id, "type": "click"}
+        )
+        assert response.status_code == 503
+
+
+    async def test_enqueue_event_flushes_full_batch(self, client: AsyncClient, test_engine, monkeypatch):
+        buffer = event_service.EventBuffer(
+            async_sessionmaker(test_engine, class_=AsyncSession, expire_on_commit=False),
+            flush_interval_ms=60000,
+            flush_batch_size=2
+        )
+        monkeypatch.setattr(event_service, "event_buffer", buffer)
+
+        user_response = await client.post(
+            "/api/users/",
+            json={
+                "first_name": "Full",
+                "last_name": "Batch",
+                "email": "fullbatch@example.com"
+            }
+        )
+        user_id = user_response.json()["id"]
+
+        for _ in range(2):
+            response = await client.post(
+                "/api/events/async",
+                json={"user_id": user_id, "experiment_id": 1, "type": "click"}
+            )
+            assert response.status_code == 202
+
+        for _ in range(50):
+            if len(buffer) == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert len(buffer) == 0
+
+        await buffer.stop()
+        response = await client.post("/api/events/1", json={})
+        assert len(response.json()["events"]) == 2
+
+
+    async def test_enqueue_event_retries_failed_writes(self, client: AsyncClient, test_engine, monkeypatch):
+        buffer = event_service.EventBuffer(
+            async_sessionmaker(test_engine, class_=AsyncSession, expire_on_commit=False),
+            flush_interval_ms=10,
+            max_retry_delay_ms=20
+        )
+        monkeypatch.setattr(event_service, "event_buffer", buffer)
+
+        user_id = (await client.post(
+            "/api/users/",
+            json={"first_name": "Retry", "last_name": "User", "email": "retry@example.com"}
+        )).json()["id"]
+
+        write = event_service.create_events_batch
+        attempts = []
+
+        async def flaky_write(db, events):
+            attempts.append(len(events))
+            if len(attempts) <= 2:
+                raise OperationalError("INSERT INTO events", {}, Exception("database is locked"))
+            return await write(db, events)
+
+        monkeypatch.setattr(event_service, "create_events_batch", flaky_write)
+
+        for i in range(3):
+            response = await client.post(
+                "/api/events/async",
+                json={"user_id": user_id, "experiment_id": 1, "type": f"event_{i}"}
+            )
+            assert response.status_code == 202
+
+        for _ in range(200):
+            if len(attempts) == 3 and buffer.failures == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert len(buffer) == 0
+        assert attempts == [3, 3, 3]
+        assert buffer.failures == 0
+
+        await buffer.stop()
+        response = await client.post("/api/events/1", json={})
+        assert [event["type"] for event in response.json()["events"]] == ["event_0", "event_1", "event_2"]
+
+
+    async def test_enqueue_event_dead_letters_unwritable_events(self, client: AsyncClient, test_engine, monkeypatch):
+        buffer = event_service.EventBuffer(
+            async_sessionmaker(test_engine, class_=AsyncSession, expire_on_commit=False),
+            flush_interval_ms=60000
+        )
+        monkeypatch.setattr(event_service, "event_buffer", buffer)
+
+        user_id = (await client.post(
+            "/api/users/",
+            json={"first_name": "Poison", "last_name": "User", "email": "poison@example.com"}
+        )).json()["id"]
+
+        # Bypasses the schema bounds, as a row the database can never store
+        buffer.enqueue(EventCreate.model_construct(user_id=user_id, experiment_id=2**70, type="poison", properties=None))
+        for i in range(5):
+            response = await client.post(
+                "/api/events/async",
+                json={"user_id": user_id, "experiment_id": 1, "type": f"event_{i}"}
+            )
+            assert response.status_code == 202
+
+        assert await buffer.flush() == 5
+        assert len(buffer) == 0
+        assert buffer.dead_lettered == 1
+        assert buffer.failures == 0
+
+        await buffer.stop()
+        response = await client.post("/api/events/1", json={})
+        assert [event["type"] for event in response.json()["events"]] == [f"event_{i}" for i in range(5)]
+
+
+    async def test_enqueue_event_caps_retries(self, client: AsyncClient, test_engine, monkeypatch):
+        buffer = event_service.EventBuffer(
+            async_sessionmaker(test_engine, class_=AsyncSession, expire_on_commit=False),
+            flush_interval_ms=60000,
+            max_retries=2
+        )
+
+        async def locked_write(db, events):
+            raise OperationalError("INSERT INTO events", {}, Exception("database is locked"))
+
+        monkeypatch.setattr(event_service, "create_events_batch", locked_write)
+        buffer.enqueue(EventCreate(user_id="any-user", type="click"))
+
+        for attempt in (1, 2):
+            assert await buffer.flush() == 0
+            assert len(buffer) == 1
+            assert buffer.failures == attempt
+
+        assert await buffer.flush() == 0
+        assert len(buffer) == 0
+        assert buffer.dead_lettered == 1
+        assert buffer.failures == 0
+        await buffer.stop()
+
+
+    async def test_enqueue_event_backpressure(self, client: AsyncClient, test_engine, monkeypatch):
+        buffer = event_service.EventBuffer(
+            async_sessionmaker(test_engine, class_=AsyncSession, expire_on_commit=False),
+            max_size=1,
+            flush_interval_ms=60000
+        )
+        monkeypatch.setattr(event_service, "event_buffer", buffer)
+
+        event = {"user_id": "any-user", "type": "click"}
+        response = await client.post("/api/events/async", json=event)
+        assert response.status_code == 202
+
+        response = await client.post("/api/events/async", json=event)
+        assert response.status_code == 429
+
+        await buffer.stop()
+
+
+    async def test_get_events_paginates_and_exports(self, client: AsyncClient):
+        user_id = (await client.post(
+            "/api/users/",
+            json={"first_name": "Export", "last_name": "User", "email": "export@example.com"}
+        )).json()["id"]
+        exp_id = (await client.post("/api/experiments/", json={"name": "Export Experiment"})).json()["id"]
+        for i in range(5):
+            await client.post(
+                "/api/events/",
+                json={"user_id": user_id, "experiment_id": exp_id, "type": f"event_{i}", "properties": {"i": i}}
+            )
+
+        pages, after = [], None
+        while True:
+            page = (await client.post(f"/api/events/{exp_id}", json={"limit": 2, "after": after})).json()
+            pages.append([event["type"] for event in page["events"]])
+            after = page["next_after"]
+            if after is None:
+                break
+        assert pages == [["event_0", "event_1"], ["event_2", "event_3"], ["event_4"]]
+
+        response = await client.post(f"/api/events/{exp_id}/export", json={"event_types": ["event_1", "event_3"]})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        events = [json.loads(line) for line in response.text.splitlines()]
+        assert [(event["type"], event["properties"]) for event in events] == [("event_1", {"i": 1}), ("event_3", {"i": 3})]
+
+        response = await client.post(f"/api/events/{exp_id}/export?format=csv", json={})
+        assert response.headers["content-type"].startswith("text/csv")
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        assert [row["type"] for row in rows] == [f"event_{i}" for i in range(5)]
+        assert json.loads(rows[2]["properties"]) == {"i": 2}
+
+        response = await client.post(f"/api/events/{exp_id}", json={"after": "garbage"})
+        assert response.status_code == 400
@@ -1,5 +1,17 @@
+import asyncio
 import pytest
 from httpx import AsyncClient
+from sqlalchemy import event, insert
+from types import SimpleNamespace
+from src.cache import clear_all_caches, bump_config_version
+from src.models import UserVariantAssignment
+from src.services import experiments as experiment_service
+from src.services.changes import ChangeLog, stream_changes
+from src.services.config_snapshot import VersionedStore
+from src.services.utils import (
+    BUCKET_COUNT, AllocationTable, assign_variant_by_hash, assign_variants_by_hash,
+    assign_variants_by_lookup, build_bucket_lookup, hash_bucket, pick_variant, resize_bucket_ranges
+)
 
 
 @pytest.mark.asyncio
@@ -307,3 +319,404 @@ class TestExperimentsAPI:
             for resp in responses
         ]
         assert all(vid == variant_ids[0] for vid in variant_ids)
+
+    async def test_check_eligibility_sees_segment_rule_changes(self, client: AsyncClient):
+        user_response = await client.post(
+            "/api/users/",
+            json={
+                "first_name": "Rule",
+                "last_name": "Change",
+                "email": "rule.change@example.com",
+                "country_code": "CA"
+            }
+        )
+        user_id = user_response.json()["id"]
+
+        segment_response = await client.post(
+            "/api/segments/",
+            json={"name": "us_only", "rules": {"country_code": "US"}}
+        )
+        segment_id = segment_response.json()["id"]
+
+        exp_response = await client.post("/api/experiments/", json={"name": "Rule Change Experiment"})
+        exp_id = exp_response.json()["id"]
+
+        await client.post(
+            "/api/segments/assign-experiment",
+            json={"experiment_id": exp_id, "segment_id": segment_id}
+        )
+
+        request = {"user_id": user_id, "experiment_ids": [exp_id]}
+        response = await client.post("/api/experiments/check-eligibility", json=request)
+        assert str(exp_id) not in response.json()["eligible_experiment_ids"]
+
+        await client.put(f"/api/segments/{segment_id}", json={"rules": {"country_code": "CA"}})
+
+        response = await client.post("/api/experiments/check-eligibility", json=request)
+        assert str(exp_id) in response.json()["eligible_experiment_ids"]
+
+    async def test_check_eligibility_ignores_unknown_and_duplicate_experiments(self, client: AsyncClient):
+        user_response = await client.post(
+            "/api/users/",
+            json={"first_name": "Dup", "last_name": "User", "email": "dup@example.com"}
+        )
+        user_id = user_response.json()["id"]
+
+        exp_response = await client.post("/api/experiments/", json={"name": "Duplicate Request Experiment"})
+        exp_id = exp_response.json()["id"]
+
+        response = await client.post(
+            "/api/experiments/check-eligibility",
+            json={"user_id": user_id, "experiment_ids": [exp_id, exp_id, 999999]}
+        )
+        assert response.status_code == 200
+        assert list(response.json()["eligible_experiment_ids"]) == [str(exp_id)]
+
+    async def test_bulk_check_eligibility(self, client: AsyncClient):
+        user_ids = []
+        for i, is_premium in enumerate([True, False, True]):
+            user_response = await client.post(
+                "/api/users/",
+                json={
+                    "first_name": "Bulk",
+                    "last_name": f"User{i}",
+                    "email": f"bulk{i}@example.com",
+                    "is_premium": is_premium
+                }
+            )
+            user_ids.append(user_response.json()["id"])
+
+        segment_response = await client.post(
+            "/api/segments/",
+            json={"name": "bulk_premium", "rules": {"is_premium": True}}
+        )
+        segment_id = segment_response.json()["id"]
+
+        open_exp_id = (await client.post("/api/experiments/", json={"name": "Bulk Open"})).json()["id"]
+        premium_exp_id = (await client.post("/api/experiments/", json={"name": "Bulk Premium"})).json()["id"]
+        await client.post(
+            "/api/segments/assign-experiment",
+            json={"experiment_id": premium_exp_id, "segment_id": segment_id}
+        )
+
+        request = {"user_ids": user_ids + ["missing-user"], "experiment_ids": [open_exp_id, premium_exp_id]}
+        response = await client.post("/api/experiments/check-eligibility/bulk", json=request)
+        assert response.status_code == 200
+        data = response.json()
+
+        assert data["missing_user_ids"] == ["missing-user"]
+        assignments = data["assignments"]
+        assert set(assignments) == set(user_ids)
+        assert set(assignments[user_ids[0]]) == {str(open_exp_id), str(premium_exp_id)}
+        assert set(assignments[user_ids[1]]) == {str(open_exp_id)}
+
+        # Bulk assignments are persisted and agree with the single-user endpoint
+        for user_id in user_ids:
+            single = await client.post(
+                "/api/experiments/check-eligibility",
+                json={"user_id": user_id, "experiment_ids": [open_exp_id, premium_exp_id]}
+            )
+            assert single.json()["eligible_experiment_ids"] == assignments[user_id]
+
+        repeat = await client.post("/api/experiments/check-eligibility/bulk", json=request)
+        assert repeat.json() == data
+
+    async def test_bulk_check_eligibility_requires_users(self, client: AsyncClient):
+        response = await client.post(
+            "/api/experiments/check-eligibility/bulk",
+            json={"user_ids": [], "experiment_ids": [1]}
+        )
+        assert response.status_code == 422
+
+    async def test_bulk_check_eligibility_returns_concurrently_stored_variant(self, client: AsyncClient, monkeypatch):
+        user_id = (await client.post(
+            "/api/users/", json={"first_name": "Race", "last_name": "User", "email": "race@example.com"}
+        )).json()["id"]
+        exp_id = (await client.post("/api/experiments/", json={"name": "Race Experiment"})).json()["id"]
+        # Never picked by hashing, so it can only come from the concurrent writer
+        late_id = (await client.post(
+            f"/api/experiments/{exp_id}/variants", json={"name": "late", "percent_allocated": 0.0}
+        )).json()["id"]
+
+        get_user_segment_ids = experiment_service.get_user_segment_ids
+
+        async def racing_get_user_segment_ids(db, user_ids, segment_ids):
+            await db.execute(
+                insert(UserVariantAssignment).values(user_id=user_id, experiment_id=exp_id, variant_id=late_id)
+            )
+            return await get_user_segment_ids(db, user_ids, segment_ids)
+
+        monkeypatch.setattr(experiment_service, "get_user_segment_ids", racing_get_user_segment_ids)
+        request = {"user_ids": [user_id], "experiment_ids": [exp_id]}
+        response = await client.post("/api/experiments/check-eligibility/bulk", json=request)
+        assert response.json()["assignments"][user_id][str(exp_id)]["variant_id"] == late_id
+
+        monkeypatch.undo()
+        response = await client.post("/api/experiments/check-eligibility/bulk", json=request)
+        assert response.json()["assignments"][user_id][str(exp_id)]["variant_id"] == late_id
+
+    async def test_ranged_bucketing_ramps_from_unallocated_pool(self, client: AsyncClient):
+        exp_response = await client.post(
+            "/api/experiments/",
+            json={"name": "Ranged Experiment", "bucketing": "ranged"}
+        )
+        assert exp_response.json()["bucketing"] == "ranged"
+        exp_id = exp_response.json()["id"]
+        control = (await client.get(f"/api/experiments/{exp_id}")).json()["variants"][0]
+        assert control["bucket_ranges"] == [[0, 10000]]
+
+        response = await client.put(
+            f"/api/experiments/{exp_id}/variants/{control['id']}",
+            json={"percent_allocated": 50.0}
+        )
+        assert response.json()["bucket_ranges"] == [[0, 5000]]
+
+        response = await client.post(
+            f"/api/experiments/{exp_id}/variants",
+            json={"name": "treatment", "percent_allocated": 30.25}
+        )
+        treatment = response.json()
+        assert treatment["bucket_ranges"] == [[5000, 8025]]
+
+        response = await client.put(
+            f"/api/experiments/{exp_id}/variants/{treatment['id']}",
+            json={"percent_allocated": 40.0}
+        )
+        assert response.json()["bucket_ranges"] == [[5000, 9000]]
+
+        response = await client.put(
+            f"/api/experiments/{exp_id}/variants/{control['id']}",
+            json={"percent_allocated": 60.0}
+        )
+        assert response.json()["bucket_ranges"] == [[0, 5000], [9000, 10000]]
+
+        detail = (await client.get(f"/api/experiments/{exp_id}")).json()
+        ranges = {v["name"]: v["bucket_ranges"] for v in detail["variants"]}
+        assert ranges == {"control": [[0, 5000], [9000, 10000]], "treatment": [[5000, 9000]]}
+
+def test_batch_assignment_matches_scalar():
+    variants = [
+        SimpleNamespace(id=7, percent_allocated=33.3),
+        SimpleNamespace(id=3, percent_allocated=0.0),
+        SimpleNamespace(id=12, percent_allocated=41.7),
+    ]
+    user_ids = [f"user-{i}" for i in range(2000)] + ["", "ünïcode", "with:colon"]
+    table = AllocationTable.from_variants(variants)
+
+    batch = assign_variants_by_hash(user_ids, 5, table)
+
+    assert batch.tolist() == [assign_variant_by_hash(user_id, 5, variants) for user_id in user_ids]
+    # 25% of buckets are unallocated and fall through to the last variant
+    assert set(batch.tolist()) == {7, 12}
+
+
+def test_ranged_reallocation_never_moves_users_between_variants():
+    user_ids = [f"user-{i}" for i in range(20000)]
+    control = resize_bucket_ranges([], [], 4000)
+    treatment = resize_bucket_ranges([], control, 2000)
+    before = assign_variants_by_lookup(user_ids, 9, build_bucket_lookup([(1, control), (2, treatment)]))
+
+    treatment = resize_bucket_ranges(treatment, control, 3500)
+    control = resize_bucket_ranges(control, treatment, 4500)
+    after = assign_variants_by_lookup(user_ids, 9, build_bucket_lookup([(1, control), (2, treatment)]))
+
+    moved = before != after
+    # Only users from the unallocated pool (0) change, and only into a variant
+    assert moved.any()
+    assert (before[moved] == 0).all()
+    assert (after[before == 0] != 0).sum() == moved.sum()
+
+
+@pytest.mark.asyncio
+async def test_conditional_get_with_etags(client: AsyncClient, test_engine):
+    statements = []
+    event.listen(test_engine.sync_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    exp_id = (await client.post("/api/experiments/", json={"name": "ETag Experiment"})).json()["id"]
+    segment_id = (await client.post("/api/segments/", json={"name": "etag_segment"})).json()["id"]
+    await client.post("/api/segments/assign-experiment", json={"experiment_id": exp_id, "segment_id": segment_id})
+
+    for url in ("/api/experiments/", f"/api/experiments/{exp_id}", "/api/segments/"):
+        response = await client.get(url)
+        etag = response.headers["etag"]
+        assert response.json()
+
+        # Served from the cached version without a database round trip
+        statements.clear()
+        response = await client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["etag"] == etag
+        assert response.content == b""
+        assert statements == []
+
+        # On a cold cache only the versions are read, not the body
+        clear_all_caches()
+        response = await client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert len([statement for statement in statements if "FROM api_keys" not in statement]) == 1
+
+        response = await client.get(url, headers={"If-None-Match": '"stale"'})
+        assert response.status_code == 200
+
+    # Segment membership is not part of any of these responses
+    user_id = (await client.post("/api/users/", json={
+        "first_name": "Etag", "last_name": "User", "email": "etag@example.com", "is_premium": False
+    })).json()["id"]
+    urls = ("/api/experiments/", f"/api/experiments/{exp_id}", "/api/segments/")
+    etags = {url: (await client.get(url)).headers["etag"] for url in urls}
+    await client.post("/api/segments/assign-user", json={"user_id": user_id, "segment_id": segment_id})
+    for url, etag in etags.items():
+        assert (await client.get(url, headers={"If-None-Match": etag})).status_code == 304
+
+    detail = await client.get(f"/api/experiments/{exp_id}")
+    variant_id = detail.json()["variants"][0]["id"]
+    version = detail.json()["config_version"]
+
+    await client.put(f"/api/experiments/{exp_id}/variants/{variant_id}", json={"percent_allocated": 50.0})
+    response = await client.get(f"/api/experiments/{exp_id}", headers={"If-None-Match": detail.headers["etag"]})
+    assert response.status_code == 200
+    assert response.json()["config_version"] == version + 1
+
+    # Segment changes show up in the detail of experiments targeting the segment
+    etag = response.headers["etag"]
+    await client.put(f"/api/segments/{segment_id}", json={"description": "changed"})
+    response = await client.get(f"/api/experiments/{exp_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["segments"][0]["config_version"] == 2
+
+
+@pytest.mark.asyncio
+async def test_change_feed_long_poll(client: AsyncClient):
+    response = await client.get("/api/experiments/changes")
+    assert response.json()["reset"] is True
+    since = response.json()["version"]
+
+    exp_id = (await client.post("/api/experiments/", json={"name": "Changes Experiment"})).json()["id"]
+    variant_id = (await client.post(
+        f"/api/experiments/{exp_id}/variants", json={"name": "treatment", "percent_allocated": 0.0}
+    )).json()["id"]
+    segment_id = (await client.post("/api/segments/", json={"name": "changes_segment"})).json()["id"]
+    await client.post("/api/segments/assign-experiment", json={"experiment_id": exp_id, "segment_id": segment_id})
+
+    response = await client.get("/api/experiments/changes", params={"since": since, "timeout": 0})
+    changes = response.json()["changes"]
+    assert [change["type"] for change in changes] == ["experiment.created", "variant.created", "segment.attached"]
+    assert changes[1]["data"]["id"] == variant_id
+    assert changes[2]["data"] == {"experiment_id": exp_id, "segment_id": segment_id}
+    since = response.json()["version"]
+
+    # A waiting poll returns as soon as something changes
+    poll = asyncio.create_task(client.get("/api/experiments/changes", params={"since": since, "timeout": 5}))
+    await asyncio.sleep(0.05)
+    assert not poll.done()
+    await client.put(f"/api/experiments/{exp_id}/variants/{variant_id}", json={"enabled": False})
+    response = await asyncio.wait_for(poll, 1)
+    assert [change["type"] for change in response.json()["changes"]] == ["variant.updated"]
+    assert response.json()["changes"][0]["data"]["enabled"] is False
+
+    response = await client.get("/api/experiments/changes", params={"since": 1, "timeout": 0})
+    assert response.json()["reset"] is True
+
+
+@pytest.mark.asyncio
+async def test_change_stream_events():
+    log = ChangeLog(max_size=2)
+    stream = stream_changes(None, log, heartbeat_seconds=0.01)
+
+    reset = await stream.__anext__()
+    assert reset.startswith(f"id: {log.version}\nevent: reset\n".encode())
+    assert await stream.__anext__() == b": keep-alive\n\n"
+
+    log.record("variant.updated", {"id": 1})
+    event_text = (await stream.__anext__()).decode()
+    assert event_text == f'id: {log.version}\nevent: change\ndata: {{"version":{log.version},"type":"variant.updated","data":{{"id":1}}}}\n\n'
+    await stream.aclose()
+
+    # Only the last two changes are kept; older versions must start over
+    first = log.version
+    for i in range(3):
+        log.record("segment.updated", {"id": i})
+    assert log.since(first) is None
+    assert [change.data["id"] for change in log.since(first + 1)] == [1, 2]
+    stream = stream_changes(first, log)
+    assert b"event: reset" in await stream.__anext__()
+    await stream.aclose()
+
+
+@pytest.mark.asyncio
+async def test_config_bundle_matches_server_assignment(client: AsyncClient):
+    percent_id = (await client.post("/api/experiments/", json={"name": "Bundle Percent"})).json()["id"]
+    detail = (await client.get(f"/api/experiments/{percent_id}")).json()
+    await client.put(
+        f"/api/experiments/{percent_id}/variants/{detail['variants'][0]['id']}", json={"percent_allocated": 40.0}
+    )
+    await client.post(f"/api/experiments/{percent_id}/variants", json={"name": "treatment", "percent_allocated": 60.0})
+    ranged_id = (await client.post("/api/experiments/", json={"name": "Bundle Ranged", "bucketing": "ranged"})).json()["id"]
+    segment_id = (await client.post("/api/segments/", json={"name": "bundle_us", "rules": {"country_code": "US"}})).json()["id"]
+    await client.post("/api/segments/assign-experiment", json={"experiment_id": ranged_id, "segment_id": segment_id})
+
+    response = await client.get("/api/experiments/bundle")
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    bundle = response.json()
+    assert etag == f'"{bundle["version"]}"'
+    assert bundle["hashing"]["bucket_count"] == BUCKET_COUNT
+    assert bundle["segments"] == [{"id": segment_id, "name": "bundle_us", "rules": {"country_code": "US"}}]
+
+    experiments = {experiment["id"]: experiment for experiment in bundle["experiments"]}
+    assert experiments[ranged_id]["segment_ids"] == [segment_id]
+    percent = experiments[percent_id]
+    variant_ids = [variant["id"] for variant in percent["variants"]]
+    user_ids = []
+    for i in range(20):
+        response = await client.post(
+            "/api/users/", json={"first_name": "Bundle", "last_name": str(i), "email": f"bundle{i}@example.com"}
+        )
+        user_ids.append(response.json()["id"])
+    response = await client.post(
+        "/api/experiments/check-eligibility/bulk", json={"user_ids": user_ids, "experiment_ids": [percent_id]}
+    )
+    for user_id in user_ids:
+        bucket = hash_bucket(user_id, percent_id, bundle["hashing"]["bucket_count"])
+        local = pick_variant(bucket, variant_ids, percent["boundaries"])
+        assert local == response.json()["assignments"][user_id][str(percent_id)]["variant_id"]
+
+    response = await client.get("/api/experiments/bundle", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    response = await client.get("/api/experiments/bundle", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json() == bundle
+
+    await client.post(f"/api/experiments/{percent_id}/variants", json={"name": "late", "percent_allocated": 0.0})
+    response = await client.get("/api/experiments/bundle", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+@pytest.mark.asyncio
+async def test_versioned_store_rebuilds_on_version_and_ttl():
+    builds = []
+
+    async def build(db, version):
+        builds.append(version)
+        if len(builds) == 2:
+            # A write lands while this build is reading
+            bump_config_version()
+        return SimpleNamespace(version=version)
+
+    store = VersionedStore(build, ttl_seconds=60)
+    first = await store.get(None)
+    assert await store.get(None) is first
+    assert len(builds) == 1
+
+    bump_config_version()
+    raced = await store.get(None)
+    assert raced.version == builds[1]
+    # Built against a version that moved on while building, so it is not kept
+    current = await store.get(None)
+    assert current is not raced and len(builds) == 3
+    assert await store.get(None) is current
+
+    store.ttl_seconds = 0
+    assert await store.get(None) is not current
+    assert len(builds) == 4
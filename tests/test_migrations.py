@@ -0,0 +1,74 @@
+from sqlalchemy import create_engine, inspect
+from src.database import Base
+from src.migrations import upgrade_schema
+from src import models  # noqa: F401
+
+
+def test_upgrade_schema_creates_missing_event_indexes():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DROP INDEX ix_events_experiment_variant_type")
+        conn.exec_driver_sql("DROP INDEX ix_events_experiment_timestamp")
+
+    with engine.begin() as conn:
+        created = upgrade_schema(conn)
+    assert sorted(created) == ["ix_events_experiment_timestamp", "ix_events_experiment_variant_type"]
+
+    indexes = {index["name"]: index["column_names"] for index in inspect(engine).get_indexes("events")}
+    assert indexes["ix_events_experiment_variant_type"] == ["experiment_id", "variant_id", "type"]
+    assert indexes["ix_events_experiment_timestamp"] == ["experiment_id", "timestamp"]
+
+    with engine.begin() as conn:
+        assert upgrade_schema(conn) == []
+
+
+def test_upgrade_schema_drops_obsolete_indexes():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE INDEX ix_events_variant_type ON events (variant_id, type)")
+        upgrade_schema(conn)
+
+    indexes = {index["name"] for index in inspect(engine).get_indexes("events")}
+    assert "ix_events_variant_type" not in indexes
+
+
+def test_upgrade_schema_adds_missing_columns():
+    engine = create_engine("sqlite:///:memory:")
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE experiments (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, description VARCHAR, "
+            "status VARCHAR(9) NOT NULL, created_at DATETIME, started_at DATETIME, ended_at DATETIME)"
+        )
+        conn.exec_driver_sql("INSERT INTO experiments (id, name, status) VALUES (1, 'old', 'DRAFT')")
+    Base.metadata.create_all(engine)
+
+    with engine.begin() as conn:
+        upgrade_schema(conn)
+
+    columns = {column["name"] for column in inspect(engine).get_columns("experiments")}
+    assert "bucketing" in columns
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT bucketing FROM experiments").scalar() == "PERCENT"
+
+
+def test_upgrade_schema_adds_membership_version_triggers():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for (name,) in conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'trigger'").all():
+            conn.exec_driver_sql(f"DROP TRIGGER {name}")
+        conn.exec_driver_sql("DELETE FROM membership_version")
+
+    with engine.begin() as conn:
+        upgrade_schema(conn)
+        upgrade_schema(conn)
+        conn.exec_driver_sql("INSERT INTO users (id, first_name, last_name, email, is_premium) VALUES ('u', 'a', 'b', 'e', 0)")
+        conn.exec_driver_sql("INSERT INTO segments (id, name) VALUES (1, 's')")
+        conn.exec_driver_sql("INSERT INTO user_segments (user_id, segment_id) VALUES ('u', 1)")
+        conn.exec_driver_sql("DELETE FROM user_segments")
+        conn.exec_driver_sql("INSERT INTO rule_segment_members (segment_id, user_id) VALUES (1, 'u')")
+        assert conn.exec_driver_sql("SELECT version FROM membership_version").scalar() == 3
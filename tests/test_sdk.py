@@ -0,0 +1,226 @@
+import asyncio
+import json
+import pytest
+import httpx
+from httpx import AsyncClient
+from datetime import datetime
+from types import SimpleNamespace
+from sdk import ExperimentationClient
+from sdk.evaluation import compile_rules as sdk_compile_rules
+from src.services.rules import compile_rules
+
+
+async def make_sdk(client: AsyncClient, **kwargs) -> ExperimentationClient:
+    sdk = ExperimentationClient("http://test", "unused", refresh_interval=0, http_client=client, **kwargs)
+    # The fixture client already carries a valid key
+    sdk.headers = {}
+    await sdk.start()
+    return sdk
+
+
+@pytest.mark.asyncio
+class TestExperimentationClient:
+    async def test_local_assignments_match_server(self, client: AsyncClient):
+        percent_id = (await client.post("/api/experiments/", json={"name": "SDK Percent"})).json()["id"]
+        control_id = (await client.get(f"/api/experiments/{percent_id}")).json()["variants"][0]["id"]
+        await client.put(f"/api/experiments/{percent_id}/variants/{control_id}", json={"percent_allocated": 30.0})
+        await client.post(f"/api/experiments/{percent_id}/variants", json={"name": "treatment", "percent_allocated": 70.0})
+
+        ranged_id = (await client.post("/api/experiments/", json={"name": "SDK Ranged", "bucketing": "ranged"})).json()["id"]
+        ranged_control_id = (await client.get(f"/api/experiments/{ranged_id}")).json()["variants"][0]["id"]
+        await client.put(f"/api/experiments/{ranged_id}/variants/{ranged_control_id}", json={"percent_allocated": 40.0})
+        await client.post(f"/api/experiments/{ranged_id}/variants", json={"name": "treatment", "percent_allocated": 35.0})
+
+        rule_segment_id = (await client.post(
+            "/api/segments/", json={"name": "sdk_gb_premium", "rules": {"or": [{"country_code": "GB"}, {"is_premium": True}]}}
+        )).json()["id"]
+        explicit_segment_id = (await client.post("/api/segments/", json={"name": "sdk_vip"})).json()["id"]
+        for experiment_id in (percent_id, ranged_id):
+            for segment_id in (rule_segment_id, explicit_segment_id):
+                await client.post(
+                    "/api/segments/assign-experiment", json={"experiment_id": experiment_id, "segment_id": segment_id}
+                )
+
+        users = []
+        for i in range(30):
+            response = await client.post("/api/users/", json={
+                "first_name": "SDK",
+                "last_name": str(i),
+                "email": f"sdk{i}@example.com",
+                "country_code": ["GB", "US", "DE"][i % 3],
+                "is_premium": i % 4 == 0
+            })
+            users.append(response.json())
+        vip_ids = [user["id"] for user in users[1::5]]
+        await client.post("/api/segments/assign-users", json={"user_ids": vip_ids, "segment_id": explicit_segment_id})
+
+        sdk = await make_sdk(client)
+        try:
+            experiment_ids = [percent_id, ranged_id, 9999]
+            response = await client.post(
+                "/api/experiments/check-eligibility/bulk",
+                json={"user_ids": [user["id"] for user in users], "experiment_ids": experiment_ids}
+            )
+            server = response.json()["assignments"]
+            eligible = 0
+            for user in users:
+                local = sdk.get_assignments(
+                    user["id"],
+                    experiment_ids,
+                    attributes=user,
+                    segment_ids=[explicit_segment_id] if user["id"] in vip_ids else []
+                )
+                expected = {int(experiment_id): info["variant_id"] for experiment_id, info in server.get(user["id"], {}).items()}
+                assert local == expected
+                eligible += len(local)
+            assert eligible > 0
+            assert sdk.get_variant("nobody", percent_id, attributes={"country_code": "US"}) is None
+        finally:
+            await sdk.close()
+
+    async def test_refresh_uses_conditional_requests(self, client: AsyncClient):
+        experiment_id = (await client.post("/api/experiments/", json={"name": "SDK Refresh"})).json()["id"]
+        statuses = []
+
+        async def record_status(response: httpx.Response):
+            statuses.append(response.status_code)
+
+        client.event_hooks["response"].append(record_status)
+
+        sdk = await make_sdk(client)
+        try:
+            assert await sdk.refresh() is False
+            await client.post(f"/api/experiments/{experiment_id}/variants", json={"name": "late", "percent_allocated": 0.0})
+            assert await sdk.refresh() is True
+            assert len(sdk.bundle.experiments[experiment_id].variant_ids) == 2
+        finally:
+            await sdk.close()
+
+        assert statuses[:3] == [200, 304, 200]
+
+    async def test_events_are_sent_in_batches(self, client: AsyncClient):
+        user_id = (await client.post(
+            "/api/users/", json={"first_name": "SDK", "last_name": "Events", "email": "sdkevents@example.com"}
+        )).json()["id"]
+        experiment_id = (await client.post("/api/experiments/", json={"name": "SDK Events"})).json()["id"]
+        batch_sizes = []
+
+        async def count_batches(request: httpx.Request):
+            if request.url.path == "/api/events/batch":
+                await request.aread()
+                batch_sizes.append(request.content.count(b'"type"'))
+
+        client.event_hooks["request"].append(count_batches)
+
+        sdk = await make_sdk(client, event_batch_size=100, flush_interval=60)
+        try:
+            for i in range(250):
+                assert sdk.track(user_id, "page_view", experiment_id=experiment_id, properties={"i": i})
+            assert len(sdk.events) == 250
+            assert await sdk.flush() == 250
+        finally:
+            await sdk.close()
+
+        assert batch_sizes == [100, 100, 50]
+        response = await client.post(f"/api/events/{experiment_id}", json={})
+        assert len(response.json()["events"]) == 250
+
+
+async def test_requests_are_retried_with_backoff():
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url.path)
+        if len(calls) < 3:
+            return httpx.Response(503)
+        return httpx.Response(200, json={"accepted": 1, "rejected": 0, "results": []})
+
+    http = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://test")
+    sdk = ExperimentationClient("http://test", "key", http_client=http, retry_base_delay=0)
+    try:
+        await sdk.send_events([{"user_id": "u", "type": "click"}])
+        assert calls == ["/api/events/batch"] * 3
+
+        calls.clear()
+        sdk.max_retries = 1
+        sdk.track("u", "click")
+        with pytest.raises(httpx.HTTPStatusError):
+            await sdk.flush()
+        # The failed batch stays queued for the next flush
+        assert len(sdk.events) == 1
+        assert await sdk.flush() == 1
+    finally:
+        await http.aclose()
+
+
+async def test_close_waits_for_a_batch_in_flight():
+    received = []
+    sending = asyncio.Event()
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        sending.set()
+        await asyncio.sleep(0.05)
+        events = json.loads(request.content)["events"]
+        received.extend(event["type"] for event in events)
+        return httpx.Response(200, json={"accepted": len(events), "rejected": 0, "results": []})
+
+    http = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://test")
+    sdk = ExperimentationClient("http://test", "key", http_client=http, event_batch_size=2, flush_interval=60)
+    sdk.events.start()
+    try:
+        for i in range(4):
+            sdk.track("u", f"event_{i}")
+        await sending.wait()
+        await sdk.close()
+    finally:
+        await http.aclose()
+
+    assert received == [f"event_{i}" for i in range(4)]
+    assert len(sdk.events) == 0
+
+
+async def test_events_the_server_refuses_are_dropped():
+    posts = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        events = json.loads(request.content)["events"]
+        posts.append(len(events))
+        if any(not isinstance(event["type"], str) for event in events):
+            return httpx.Response(422)
+        return httpx.Response(200, json={"accepted": len(events), "rejected": 0, "results": []})
+
+    http = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://test")
+    sdk = ExperimentationClient("http://test", "key", http_client=http, event_batch_size=1, retry_base_delay=0)
+    try:
+        sdk.track("u", 42)
+        for i in range(5):
+            sdk.track("u", f"event_{i}")
+        assert await sdk.flush() == 5
+        assert sdk.events.dropped == 1
+        assert len(sdk.events) == 0
+        assert posts == [1] * 6
+    finally:
+        await http.aclose()
+
+
+def test_rules_match_the_server():
+    rules = [
+        {"country_code": "US"},
+        {"country_code": {"in": ["US", "CA"]}},
+        {"country_code": {"not_in": ["US", None]}},
+        {"created_at": {"gte": "2024-01-01", "lt": "2025-01-01"}},
+        {"not": {"is_premium": True}},
+        {"or": [{"country_code": "GB"}, {"and": [{"is_premium": True}, {"country_code": {"ne": "DE"}}]}]},
+        {"is_premium": {"gt": 0}},
+    ]
+    users = [
+        {"country_code": "US", "is_premium": True, "created_at": datetime(2024, 6, 1)},
+        {"country_code": "CA", "is_premium": False, "created_at": datetime(2023, 6, 1)},
+        {"country_code": "GB", "is_premium": False, "created_at": datetime(2025, 1, 1)},
+        {"country_code": None, "is_premium": True, "created_at": None},
+        {"country_code": "DE", "is_premium": True, "created_at": datetime(2024, 12, 31)},
+    ]
+    for rule in rules:
+        server, local = compile_rules(rule), sdk_compile_rules(rule)
+        for user in users:
+            assert local(user) == server(SimpleNamespace(**user)), (rule, user)
@@ -1,5 +1,16 @@
 import pytest
+from datetime import datetime
 from httpx import AsyncClient
+from types import SimpleNamespace
+from sqlalchemy import select, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from src.bitmap import Bitmap
+from src.models import User, UserSegment
+from src.services.rules import RuleError, compile_rules, rules_to_clause
+from src.services.segment_membership import SegmentMaterializer
+from src.services.segment_index import SegmentMembershipIndex, segment_index
+from src.services import segments as segment_service
+import numpy as np
 
 
 @pytest.mark.asyncio
@@ -48,7 +59,8 @@ class TestSegmentsAPI:
         data = response.json()
         assert data["id"] == segment_id
         assert data["name"] == "get_me_segment"
-        assert "users" in data
+        assert data["member_count"] == 0
+        assert "users" not in data
 
 
     async def test_update_segment(self, client: AsyncClient):
@@ -101,9 +113,91 @@ class TestSegmentsAPI:
         assert response.json()["message"] == "User assigned to segment successfully"
 
         segment_detail = await client.get(f"/api/segments/{segment_id}")
-        users = segment_detail.json()["users"]
+        assert segment_detail.json()["member_count"] == 1
+        users = (await client.get(f"/api/segments/{segment_id}/users")).json()["users"]
         assert any(u["id"] == user_id for u in users)
 
+    async def test_bulk_assign_users_to_segment(self, client: AsyncClient, monkeypatch):
+        monkeypatch.setattr(segment_service, "SEGMENT_ASSIGN_CHUNK_SIZE", 2)
+        segment_id = (await client.post("/api/segments/", json={"name": "bulk"})).json()["id"]
+        user_ids = []
+        for i in range(4):
+            response = await client.post(
+                "/api/users/",
+                json={"first_name": "Bulk", "last_name": str(i), "email": f"bulk{i}@example.com"}
+            )
+            user_ids.append(response.json()["id"])
+        await client.post("/api/segments/assign-user", json={"user_id": user_ids[0], "segment_id": segment_id})
+
+        response = await client.post(
+            "/api/segments/assign-users",
+            json={"segment_id": segment_id, "user_ids": [user_ids[0], user_ids[1], "ghost", user_ids[1]]}
+        )
+        assert response.status_code == 200
+        # The repeated ID falls in a later chunk, where it is already assigned
+        assert response.json() == {
+            "assigned": 1, "already_assigned": 2, "missing_count": 1, "missing_user_ids": ["ghost"]
+        }
+
+        csv_body = f"email,user_id\nx,{user_ids[2]}\ny,{user_ids[1]}\r\n\n"
+        response = await client.post(
+            f"/api/segments/{segment_id}/users/import", content=csv_body, headers={"Content-Type": "text/csv"}
+        )
+        assert response.json()["assigned"] == 1
+        assert response.json()["already_assigned"] == 1
+
+        ndjson_body = f'"{user_ids[3]}"\n{{"user_id": "{user_ids[2]}"}}\n"ghost"'
+        response = await client.post(
+            f"/api/segments/{segment_id}/users/import", content=ndjson_body,
+            headers={"Content-Type": "application/x-ndjson"}
+        )
+        assert response.json() == {
+            "assigned": 1, "already_assigned": 1, "missing_count": 1, "missing_user_ids": ["ghost"]
+        }
+        assert (await client.get(f"/api/segments/{segment_id}")).json()["member_count"] == 4
+
+        response = await client.post(
+            f"/api/segments/{segment_id}/users/import", content="[1, 2]", headers={"Content-Type": "application/x-ndjson"}
+        )
+        assert response.status_code == 400
+        response = await client.post(
+            f"/api/segments/{segment_id}/users/import", content="a,b", headers={"Content-Type": "text/plain"}
+        )
+        assert response.status_code == 415
+        response = await client.post("/api/segments/assign-users", json={"segment_id": 99999, "user_ids": ["a"]})
+        assert response.status_code == 404
+
+    async def test_get_segment_users_paginates(self, client: AsyncClient):
+        segment_id = (await client.post("/api/segments/", json={"name": "paged"})).json()["id"]
+        user_ids = []
+        for i in range(5):
+            response = await client.post(
+                "/api/users/",
+                json={"first_name": "Paged", "last_name": str(i), "email": f"paged{i}@example.com"}
+            )
+            user_ids.append(response.json()["id"])
+            await client.post("/api/segments/assign-user", json={"user_id": user_ids[-1], "segment_id": segment_id})
+
+        pages, after = [], None
+        while True:
+            params = {"limit": 2, **({"after": after} if after else {})}
+            response = await client.get(f"/api/segments/{segment_id}/users", params=params)
+            assert response.status_code == 200
+            page = response.json()
+            pages.append([user["id"] for user in page["users"]])
+            after = page["next_after"]
+            if after is None:
+                break
+
+        assert [len(page) for page in pages] == [2, 2, 1]
+        assert [user_id for page in pages for user_id in page] == sorted(user_ids)
+        assert (await client.get(f"/api/segments/{segment_id}")).json()["member_count"] == 5
+
+        response = await client.get(f"/api/segments/{segment_id}/users", params={"limit": 0})
+        assert response.status_code == 422
+        response = await client.get("/api/segments/99999/users")
+        assert response.status_code == 404
+
 
     async def test_assign_segment_to_experiment(self, client: AsyncClient):
         segment_response = await client.post(
@@ -131,3 +225,338 @@ class TestSegmentsAPI:
         exp_detail = await client.get(f"/api/experiments/{exp_id}")
         segments = exp_detail.json()["segments"]
         assert any(s["id"] == segment_id for s in segments)
+
+    async def test_create_segment_rejects_invalid_rules(self, client: AsyncClient):
+        response = await client.post(
+            "/api/segments/",
+            json={"name": "bad_rules", "rules": {"country_code": {"like": "U%"}}}
+        )
+        assert response.status_code == 400
+        assert "Unknown operator 'like'" in response.json()["detail"]
+
+    async def test_eligibility_with_operator_rules(self, client: AsyncClient):
+        users = {}
+        for name, country, premium in [("us", "US", False), ("ca", "CA", True), ("fr", "FR", True)]:
+            response = await client.post(
+                "/api/users/",
+                json={
+                    "first_name": name,
+                    "last_name": "User",
+                    "email": f"{name}@example.com",
+                    "country_code": country,
+                    "is_premium": premium
+                }
+            )
+            users[name] = response.json()["id"]
+
+        segment_response = await client.post(
+            "/api/segments/",
+            json={
+                "name": "north_america_or_premium",
+                "rules": {
+                    "or": [
+                        {"country_code": {"in": ["US", "CA"]}, "not": {"is_premium": True}},
+                        {"is_premium": True, "country_code": {"ne": "CA"}}
+                    ]
+                }
+            }
+        )
+        assert segment_response.status_code == 200
+        segment_id = segment_response.json()["id"]
+
+        exp_id = (await client.post("/api/experiments/", json={"name": "Operator Rules"})).json()["id"]
+        await client.post(
+            "/api/segments/assign-experiment",
+            json={"experiment_id": exp_id, "segment_id": segment_id}
+        )
+
+        response = await client.post(
+            "/api/experiments/check-eligibility/bulk",
+            json={"user_ids": list(users.values()), "experiment_ids": [exp_id]}
+        )
+        eligible = {
+            name for name, user_id in users.items()
+            if str(exp_id) in response.json()["assignments"][user_id]
+        }
+        assert eligible == {"us", "fr"}
+
+
+def test_compile_rules_operators():
+    user = SimpleNamespace(
+        country_code="US", is_premium=True, created_at=datetime(2024, 6, 1), email="a@example.com"
+    )
+
+    def matches(rules):
+        return compile_rules(rules)(user)
+
+    assert matches({"country_code": "US", "is_premium": 1})
+    assert matches({"country_code": {"in": ["US", "CA"]}})
+    assert not matches({"country_code": {"not_in": ["US"]}})
+    assert matches({"created_at": {"gte": "2024-01-01", "lt": "2025-01-01"}})
+    assert not matches({"created_at": {"gt": "2024-06-01T00:00:00"}})
+    assert matches({"not": {"country_code": "CA"}})
+    assert matches({"or": [{"country_code": "CA"}, {"and": [{"is_premium": True}, {"email": {"ne": None}}]}]})
+    # Missing attributes and mismatched types never satisfy a range
+    assert not matches({"last_login": {"gte": 1}})
+    assert not matches({"country_code": {"gt": 5}})
+    assert compile_rules({}) is None
+
+
+def test_compile_rules_rejects_malformed_rules():
+    for rules in [
+        {"country_code": {"like": "U%"}},
+        {"country_code": {"in": "US"}},
+        {"or": []},
+        {"not": ["US"]},
+        {"created_at": {"gte": "yesterday"}},
+        {"country_code": {}},
+    ]:
+        with pytest.raises(RuleError):
+            compile_rules(rules)
+
+
+@pytest.mark.asyncio
+async def test_materialized_rule_segment_membership(client: AsyncClient, test_engine):
+    users = {}
+    for name, country in [("us", "US"), ("ca", "CA"), ("none", None)]:
+        response = await client.post(
+            "/api/users/",
+            json={"first_name": name, "last_name": "Member", "email": f"{name}.member@example.com", "country_code": country}
+        )
+        users[name] = response.json()["id"]
+
+    segment_response = await client.post(
+        "/api/segments/",
+        json={"name": "north_america", "rules": {"country_code": {"in": ["US", "CA"]}}}
+    )
+    segment_id = segment_response.json()["id"]
+
+    materializer = SegmentMaterializer(async_sessionmaker(test_engine, class_=AsyncSession, expire_on_commit=False))
+    assert await materializer.run_once() == [segment_id]
+    assert await materializer.run_once() == []
+
+    members = await client.get(f"/api/segments/{segment_id}/users")
+    assert {user["id"] for user in members.json()["users"]} == {users["us"], users["ca"]}
+
+    # Attribute changes and new users update membership straight away
+    await client.put(f"/api/users/{users['ca']}", json={"country_code": "FR"})
+    await client.put(f"/api/users/{users['none']}", json={"country_code": "US"})
+    response = await client.post(
+        "/api/users/",
+        json={"first_name": "new", "last_name": "Member", "email": "new.member@example.com", "country_code": "CA"}
+    )
+    users["new"] = response.json()["id"]
+
+    members = await client.get(f"/api/segments/{segment_id}/users")
+    assert {user["id"] for user in members.json()["users"]} == {users["us"], users["none"], users["new"]}
+    assert (await client.get(f"/api/segments/{segment_id}")).json()["member_count"] == 3
+
+    exp_id = (await client.post("/api/experiments/", json={"name": "Materialized Segment"})).json()["id"]
+    await client.post("/api/segments/assign-experiment", json={"experiment_id": exp_id, "segment_id": segment_id})
+    response = await client.post(
+        "/api/experiments/check-eligibility/bulk",
+        json={"user_ids": list(users.values()), "experiment_ids": [exp_id]}
+    )
+    eligible = {name for name, user_id in users.items() if response.json()["assignments"][user_id]}
+    assert eligible == {"us", "none", "new"}
+
+    # Changing the rules makes the segment stale until it is rebuilt
+    await client.put(f"/api/segments/{segment_id}", json={"rules": {"country_code": "FR"}})
+    assert await materializer.run_once() == [segment_id]
+    members = await client.get(f"/api/segments/{segment_id}/users")
+    assert [user["id"] for user in members.json()["users"]] == [users["ca"]]
+
+
+@pytest.mark.asyncio
+async def test_user_writes_refresh_memberships_in_constant_statements(client: AsyncClient, test_engine):
+    statements = []
+    event.listen(test_engine.sync_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    user_id = (await client.post(
+        "/api/users/", json={"first_name": "Many", "last_name": "Segments", "email": "many@example.com"}
+    )).json()["id"]
+
+    counts = []
+    segment_ids = []
+    for total in (1, 20):
+        while len(segment_ids) < total:
+            segment_ids.append((await client.post(
+                "/api/segments/", json={"name": f"country_{len(segment_ids)}", "rules": {"country_code": "NZ"}}
+            )).json()["id"])
+        for country in ("NZ", "AU"):
+            statements.clear()
+            await client.put(f"/api/users/{user_id}", json={"country_code": country})
+            counts.append(len(statements))
+
+    assert counts[:2] == counts[2:]
+    members = await client.get(f"/api/segments/{segment_ids[-1]}/users")
+    assert members.json()["users"] == []
+    await client.put(f"/api/users/{user_id}", json={"country_code": "NZ"})
+    for segment_id in (segment_ids[0], segment_ids[-1]):
+        members = await client.get(f"/api/segments/{segment_id}/users")
+        assert [user["id"] for user in members.json()["users"]] == [user_id]
+
+
+@pytest.mark.asyncio
+async def test_rules_to_clause_matches_compiled_predicate(test_session: AsyncSession):
+    for i, (country, premium, created_at) in enumerate([
+        ("US", True, datetime(2023, 5, 1)),
+        ("CA", False, datetime(2024, 2, 1)),
+        (None, False, datetime(2024, 8, 1)),
+        ("FR", True, None),
+    ]):
+        test_session.add(User(
+            id=f"user-{i}", first_name="Rule", last_name=str(i), email=f"rule{i}@example.com",
+            country_code=country, is_premium=premium, created_at=created_at
+        ))
+    await test_session.commit()
+    users = (await test_session.execute(select(User))).scalars().all()
+
+    for rules in [
+        {"country_code": "US"},
+        {"country_code": None},
+        {"country_code": {"ne": "US"}},
+        {"country_code": {"in": ["US", None]}},
+        {"country_code": {"not_in": ["US", "CA"]}},
+        {"not": {"country_code": {"in": ["US"]}}},
+        {"created_at": {"gte": "2024-01-01", "lt": "2024-06-01"}},
+        {"not": {"created_at": {"gte": "2024-01-01"}}},
+        {"is_premium": 1, "country_code": {"gt": "A"}},
+        {"country_code": {"gt": 5}},
+        {"or": [{"is_premium": True}, {"and": [{"country_code": "CA"}, {"not": {"is_premium": True}}]}]},
+        {"last_login": None},
+        {"last_login": {"gte": 1}},
+    ]:
+        predicate = compile_rules(rules)
+        expected = {user.id for user in users if predicate(user)}
+        result = await test_session.execute(select(User.id).where(rules_to_clause(rules)))
+        assert set(result.scalars().all()) == expected, rules
+
+
+def test_bitmap_matches_set_operations():
+    rng = np.random.default_rng(7)
+    # Sparse values spread over many containers plus one container dense enough to become a bitset
+    left_values = set(rng.integers(0, 1 << 22, 3000).tolist()) | set(range(70000, 80000))
+    right_values = set(rng.integers(0, 1 << 22, 3000).tolist()) | set(range(75000, 76000, 3))
+    left, right = Bitmap.from_values(left_values), Bitmap.from_values(right_values)
+
+    assert len(left) == len(left_values)
+    assert set(left | right) == left_values | right_values
+    assert set(left & right) == left_values & right_values
+    assert set(left - right) == left_values - right_values
+    assert all(value in left for value in list(left_values)[:100])
+    assert 1 << 23 not in left
+
+    left.difference_update(range(70000, 79000))
+    left.add(5)
+    left.discard(79999)
+    expected = (left_values - set(range(70000, 79000)) - {79999}) | {5}
+    assert set(left) == expected and len(left) == len(expected)
+    assert Bitmap.deserialize(left.serialize()) == left
+
+
+@pytest.mark.asyncio
+async def test_segment_membership_index(client: AsyncClient, test_engine, test_session: AsyncSession, tmp_path, monkeypatch):
+    users = {}
+    for name, country in [("a", "FR"), ("b", "US"), ("c", "FR")]:
+        response = await client.post(
+            "/api/users/",
+            json={"first_name": name, "last_name": "Indexed", "email": f"{name}.indexed@example.com", "country_code": country}
+        )
+        users[name] = response.json()["id"]
+
+    explicit_id = (await client.post("/api/segments/", json={"name": "explicit"})).json()["id"]
+    rules_id = (await client.post("/api/segments/", json={"name": "us", "rules": {"country_code": "US"}})).json()["id"]
+    await client.post("/api/segments/assign-user", json={"user_id": users["a"], "segment_id": explicit_id})
+    session_factory = async_sessionmaker(test_engine, class_=AsyncSession, expire_on_commit=False)
+    await SegmentMaterializer(session_factory).run_once()
+
+    snapshot_path = str(tmp_path / "segment_index.npz")
+    monkeypatch.setattr(segment_index, "session_factory", session_factory)
+    monkeypatch.setattr(segment_index, "snapshot_path", snapshot_path)
+    await segment_index.load()
+    assert segment_index.ready
+
+    index = segment_index.index
+    assert index.segments_of(users["a"], [explicit_id, rules_id]) == {explicit_id}
+    assert index.is_member_of_any(users["b"], [explicit_id, rules_id])
+    assert not index.is_member_of_any(users["c"], [explicit_id, rules_id])
+    assert (await client.get(f"/api/segments/{rules_id}")).json()["member_count"] == 1
+
+    # Writes through the API update the index in place
+    await client.post("/api/segments/assign-user", json={"user_id": users["c"], "segment_id": explicit_id})
+    await client.put(f"/api/users/{users['a']}", json={"country_code": "US"})
+    assert index.count(explicit_id) == 2
+    assert index.segments_of(users["a"], [explicit_id, rules_id]) == {explicit_id, rules_id}
+    assert index.count(rules_id) == 2
+    await client.delete(f"/api/users/{users['b']}")
+    assert index.count(rules_id) == 1
+    await client.post("/api/segments/assign-users", json={"segment_id": explicit_id, "user_ids": [users["a"], users["c"]]})
+    await client.put(f"/api/segments/{rules_id}", json={"rules": {"country_code": {"in": ["US", "FR"]}}})
+    await SegmentMaterializer(session_factory).run_once()
+    assert index.count(rules_id) == 2
+
+    # ...and advance its watermark, so this process's own writes never force a rebuild
+    assert not await segment_index.refresh()
+    assert segment_index.index is index
+    await client.put(f"/api/segments/{rules_id}", json={"rules": {"country_code": "US"}})
+    await SegmentMaterializer(session_factory).run_once()
+    assert index.count(rules_id) == 1
+
+    exp_id = (await client.post("/api/experiments/", json={"name": "Indexed Segment"})).json()["id"]
+    await client.post("/api/segments/assign-experiment", json={"experiment_id": exp_id, "segment_id": rules_id})
+    response = await client.post(
+        "/api/experiments/check-eligibility/bulk",
+        json={"user_ids": [users["a"], users["c"]], "experiment_ids": [exp_id]}
+    )
+    assignments = response.json()["assignments"]
+    assert assignments[users["a"]] and not assignments[users["c"]]
+
+    # The snapshot written on load round-trips
+    restored = SegmentMembershipIndex.load(snapshot_path)
+    assert restored.segments_of(users["b"], [explicit_id, rules_id]) == {rules_id}
+
+    # Membership written behind the service's back is picked up by the next refresh
+    test_session.add(UserSegment(user_id=users["c"], segment_id=rules_id))
+    await test_session.commit()
+    assert await segment_index.refresh()
+    assert segment_index.index.segments_of(users["c"], [explicit_id, rules_id]) == {explicit_id, rules_id}
+    assert not await segment_index.refresh()
+    assert SegmentMembershipIndex.load(snapshot_path).watermark == segment_index.index.watermark
+
+
+async def test_segment_index_sees_delete_then_insert(client: AsyncClient, test_engine, test_session: AsyncSession, tmp_path, monkeypatch):
+    segment_id = (await client.post("/api/segments/", json={"name": "reused_ids"})).json()["id"]
+    user_ids = []
+    for name in ("a", "b", "c"):
+        response = await client.post("/api/users/", json={"first_name": name, "last_name": "R", "email": f"reuse_{name}@example.com"})
+        user_ids.append(response.json()["id"])
+    for user_id in user_ids[:2]:
+        await client.post("/api/segments/assign-user", json={"user_id": user_id, "segment_id": segment_id})
+
+    session_factory = async_sessionmaker(test_engine, class_=AsyncSession, expire_on_commit=False)
+    snapshot_path = str(tmp_path / "segment_index.npz")
+    monkeypatch.setattr(segment_index, "session_factory", session_factory)
+    monkeypatch.setattr(segment_index, "snapshot_path", snapshot_path)
+    await segment_index.load()
+
+    # SQLite hands the deleted newest row's id to the next insert, so count and max(id) are unchanged
+    newest = (await test_session.execute(select(UserSegment).order_by(UserSegment.id.desc()))).scalars().first()
+    newest_id = newest.id
+    await test_session.delete(newest)
+    await test_session.commit()
+    test_session.add(UserSegment(user_id=user_ids[2], segment_id=segment_id))
+    await test_session.commit()
+    assert (await test_session.execute(select(UserSegment.id).filter(UserSegment.user_id == user_ids[2]))).scalar() == newest_id
+
+    assert await segment_index.refresh()
+    assert segment_index.index.segments_of(user_ids[2], [segment_id]) == {segment_id}
+    assert segment_index.index.segments_of(user_ids[1], [segment_id]) == set()
+
+    # A snapshot from before the change is not trusted on the next start
+    stale = SegmentMembershipIndex.load(snapshot_path)
+    await test_session.execute(UserSegment.__table__.delete().where(UserSegment.user_id == user_ids[0]))
+    await test_session.commit()
+    segment_index.reset()
+    await segment_index.load()
+    assert segment_index.index.watermark != stale.watermark
+    assert segment_index.index.segments_of(user_ids[0], [segment_id]) == set()
@@ -1,5 +1,8 @@
 import pytest
 from httpx import AsyncClient
+from sqlalchemy import update
+from src.models import VariantEventCounter
+from src.services.counters import check_variant_event_counters, rebuild_variant_event_counters
 
 
 @pytest.mark.asyncio
@@ -199,3 +202,54 @@ async def test_no_conversions(client: AsyncClient):
     assert stats["variants"][0]["conversions"] == 0
     assert stats["variants"][0]["conversion_rate"] == 0.0
     assert stats["winner"] is None
+
+
+@pytest.mark.asyncio
+async def test_variant_event_counters_rebuild_and_check(client: AsyncClient, test_session):
+    exp_response = await client.post(
+        "/api/experiments/",
+        json={"name": "Counter Test", "description": "Test counter rollup"}
+    )
+    experiment_id = exp_response.json()["id"]
+    exp_detail = await client.get(f"/api/experiments/{experiment_id}")
+    control_variant_id = exp_detail.json()["variants"][0]["id"]
+
+    user_response = await client.post("/api/users/", json={
+        "first_name": "Counter",
+        "last_name": "User",
+        "email": "counter@test.com"
+    })
+    user_id = user_response.json()["id"]
+
+    await client.post("/api/events/", json={
+        "user_id": user_id,
+        "experiment_id": experiment_id,
+        "variant_id": control_variant_id,
+        "type": "page_view"
+    })
+    await client.post("/api/events/batch", json={"events": [
+        {"user_id": user_id, "experiment_id": experiment_id, "variant_id": control_variant_id, "type": "page_view"},
+        {"user_id": user_id, "experiment_id": experiment_id, "variant_id": control_variant_id, "type": "conversion"},
+        {"user_id": user_id, "experiment_id": experiment_id, "type": "page_view"}
+    ]})
+
+    assert await check_variant_event_counters(test_session) == []
+
+    stats = (await client.post(f"/api/experiments/{experiment_id}/results")).json()
+    assert stats["variants"][0]["total_users"] == 2
+    assert stats["variants"][0]["conversions"] == 1
+
+    await test_session.execute(update(VariantEventCounter).values(count=VariantEventCounter.count + 5))
+    await test_session.commit()
+
+    mismatches = await check_variant_event_counters(test_session, experiment_id)
+    assert {(m["event_type"], m["expected"], m["actual"]) for m in mismatches} == {
+        ("page_view", 2, 7),
+        ("conversion", 1, 6)
+    }
+
+    assert await rebuild_variant_event_counters(test_session) == 2
+    assert await check_variant_event_counters(test_session) == []
+
+    stats = (await client.post(f"/api/experiments/{experiment_id}/results")).json()
+    assert stats["variants"][0]["total_users"] == 2
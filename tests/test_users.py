@@ -1,3 +1,4 @@
+import json
 import pytest
 from httpx import AsyncClient
 
@@ -40,7 +41,39 @@ class TestUsersAPI:
         response = await client.get("/api/users/")
         assert response.status_code == 200
         data = response.json()
-        assert len(data) == 3
+        assert len(data["users"]) == 3
+        assert data["next_after"] is None
+
+    async def test_get_users_paginates_and_streams(self, client: AsyncClient):
+        for i in range(5):
+            await client.post(
+                "/api/users/",
+                json={"first_name": f"Page{i}", "last_name": "Test", "email": f"page{i}@example.com"}
+            )
+
+        pages, after = [], None
+        while True:
+            params = {"limit": 2, **({"after": after} if after else {})}
+            page = (await client.get("/api/users/", params=params)).json()
+            pages.append([user["first_name"] for user in page["users"]])
+            after = page["next_after"]
+            if after is None:
+                break
+        assert pages == [["Page0", "Page1"], ["Page2", "Page3"], ["Page4"]]
+
+        response = await client.get("/api/users/", params={"format": "ndjson"})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert [user["first_name"] for user in lines] == [f"Page{i}" for i in range(5)]
+
+        # Streams resume from a page cursor too
+        first_page = (await client.get("/api/users/", params={"limit": 3})).json()
+        response = await client.get("/api/users/", params={"format": "ndjson", "after": first_page["next_after"]})
+        assert [json.loads(line)["first_name"] for line in response.text.splitlines()] == ["Page3", "Page4"]
+
+        response = await client.get("/api/users/", params={"after": "not-a-cursor"})
+        assert response.status_code == 400
 
     async def test_get_user_by_id(self, client: AsyncClient):
         create_response = await client.post(
@@ -0,0 +1,45 @@
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.models import ApiKey
+
+
+@pytest.mark.asyncio
+class TestExperimentViews:
+    async def test_list_and_detail_pages(self, client: AsyncClient, test_session: AsyncSession):
+        experiment_id = (await client.post(
+            "/api/experiments/", json={"name": "UI Checkout", "description": "Checkout flow"}
+        )).json()["id"]
+        await client.post(f"/api/experiments/{experiment_id}/variants", json={"name": "ui_treatment", "percent_allocated": 0.0})
+        segment_id = (await client.post("/api/segments/", json={"name": "ui_segment", "rules": {"country_code": "GB"}})).json()["id"]
+        await client.post("/api/segments/assign-experiment", json={"experiment_id": experiment_id, "segment_id": segment_id})
+        keys_before = (await test_session.execute(select(func.count(ApiKey.id)))).scalar()
+
+        response = await client.get("/ui/experiments")
+        assert response.status_code == 200
+        assert "UI Checkout" in response.text
+        assert f"/ui/experiment/{experiment_id}" in response.text
+
+        response = await client.get(f"/ui/experiment/{experiment_id}")
+        assert response.status_code == 200
+        assert "ui_treatment" in response.text
+        assert "ui_segment" in response.text
+        assert "pill status draft" in response.text
+
+        # Pages no longer mint an API key per view to call the API over HTTP
+        assert (await test_session.execute(select(func.count(ApiKey.id)))).scalar() == keys_before
+
+    async def test_missing_experiment(self, client: AsyncClient):
+        response = await client.get("/ui/experiment/9999")
+        assert response.status_code == 200
+        assert "ui_treatment" not in response.text
+
+    async def test_create_experiment_form(self, client: AsyncClient):
+        for _ in range(2):
+            response = await client.post("/ui/experiments", data={"name": "UI Created", "description": "From the form"})
+            assert response.status_code == 303
+            assert response.headers["location"] == "/ui/experiments"
+
+        experiments = (await client.get("/api/experiments/")).json()
+        assert [experiment["name"] for experiment in experiments].count("UI Created") == 1